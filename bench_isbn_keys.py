@@ -0,0 +1,111 @@
+# bench_isbn_keys.py
+"""
+String ISBNs vs integer ISBN keys, on SQLite.
+
+Builds the central catalog tables (book_global / book_availability) twice,
+once joined on the hyphenated ISBN string and once on the integer ISBN-13
+key, then compares index size, a full title-to-availability join and
+batched IN lookups (what apply_sync_batch and the catalog search do).
+
+    python bench_isbn_keys.py --titles 200000 --branches 5
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from common.isbn import isbn_key
+
+
+def make_isbn(n):
+    first12 = f"9781{n:08d}"
+    total = sum(int(c) * (3 if i % 2 else 1) for i, c in enumerate(first12))
+    return f"978-1{n:08d}{(10 - total % 10) % 10}"
+
+
+def build(path, titles, branches, column):
+    """
+    column is "isbn" (TEXT) or "isbn_key" (INTEGER). Returns (connection,
+    index bytes).
+    """
+    conn = sqlite3.connect(path)
+    col_type = "TEXT" if column == "isbn" else "INTEGER"
+    conn.execute(f"CREATE TABLE book_global (id INTEGER PRIMARY KEY, {column} {col_type})")
+    conn.execute(
+        f"CREATE TABLE book_availability (id INTEGER PRIMARY KEY, {column} {col_type}, "
+        "branch_code TEXT, total_copies INTEGER, available_copies INTEGER)"
+    )
+    rows = []
+    for n in range(titles):
+        isbn = make_isbn(n)
+        rows.append(isbn if column == "isbn" else isbn_key(isbn))
+    conn.executemany(f"INSERT INTO book_global ({column}) VALUES (?)", ((r,) for r in rows))
+    conn.executemany(
+        f"INSERT INTO book_availability ({column}, branch_code, total_copies, available_copies) "
+        "VALUES (?, ?, 3, 2)",
+        ((r, f"BRANCH_{b}") for r in rows for b in range(branches)),
+    )
+    conn.commit()
+
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    before = conn.execute("PRAGMA page_count").fetchone()[0]
+    conn.execute(f"CREATE UNIQUE INDEX ix_global ON book_global ({column})")
+    conn.execute(f"CREATE INDEX ix_avail ON book_availability ({column}, branch_code)")
+    conn.commit()
+    after = conn.execute("PRAGMA page_count").fetchone()[0]
+    return conn, rows, (after - before) * page_size
+
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best * 1000, 2)
+
+
+def bench(conn, rows, column, lookups, repeat):
+    join_sql = (
+        "SELECT count(*), sum(a.available_copies) FROM book_global g "
+        f"JOIN book_availability a ON a.{column} = g.{column}"
+    )
+    sample = random.Random(1).sample(rows, lookups)
+    marks = ",".join("?" * len(sample))
+    in_sql = f"SELECT {column}, available_copies FROM book_availability WHERE {column} IN ({marks})"
+    return {
+        "full_join_ms": timed(lambda: conn.execute(join_sql).fetchall(), repeat),
+        f"in_lookup_{lookups}_ms": timed(lambda: conn.execute(in_sql, sample).fetchall(), repeat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="String vs integer ISBN keys")
+    parser.add_argument("--titles", type=int, default=200000)
+    parser.add_argument("--branches", type=int, default=5)
+    parser.add_argument("--lookups", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    report = {"titles": args.titles, "branches": args.branches}
+    workdir = tempfile.mkdtemp(prefix="bench_isbn_")
+    for column in ("isbn", "isbn_key"):
+        conn, rows, index_bytes = build(
+            os.path.join(workdir, f"{column}.db"), args.titles, args.branches, column
+        )
+        report[column] = {"index_bytes": index_bytes}
+        report[column].update(bench(conn, rows, column, args.lookups, args.repeat))
+        conn.close()
+
+    s, k = report["isbn"], report["isbn_key"]
+    report["index_size_ratio"] = round(k["index_bytes"] / s["index_bytes"], 3)
+    report["join_speedup"] = round(s["full_join_ms"] / k["full_join_ms"], 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
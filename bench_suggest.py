@@ -0,0 +1,97 @@
+# bench_suggest.py
+"""
+Latency of the typeahead prefix index (central_service/suggest.py).
+
+Builds a SuggestIndex over synthetic titles/authors drawn from a skewed
+vocabulary, then times lookups for prefixes of what patrons would type:
+1-6 letters of a word, and two-word prefixes. Also times incremental
+inserts and renames, which the sync path performs.
+
+    python bench_suggest.py --titles 500000
+"""
+import argparse
+import json
+import random
+import string
+import time
+from itertools import accumulate
+
+from central_service.suggest import SuggestIndex
+
+
+def vocabulary(rng, size):
+    return [
+        "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 10)))
+        for _ in range(size)
+    ]
+
+
+def make_titles(rng, n, vocab):
+    # a few very common words ("the", "of", ...) and a long tail
+    cum_weights = list(accumulate(1.0 / (rank + 1) for rank in range(len(vocab))))
+    for doc_id in range(1, n + 1):
+        title = " ".join(
+            rng.choices(vocab, cum_weights=cum_weights, k=rng.randint(2, 7))
+        ).title()
+        author = " ".join(rng.choices(vocab, k=2)).title()
+        yield doc_id, f"978{doc_id:010d}", title, author
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda p: round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1e6, 1)
+    return {"p50_us": pick(0.50), "p99_us": pick(0.99), "max_us": pick(1.0)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Typeahead index latency")
+    parser.add_argument("--titles", type=int, default=500000)
+    parser.add_argument("--vocab", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=20000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocab = vocabulary(rng, args.vocab)
+    index = SuggestIndex()
+
+    t = time.perf_counter()
+    index.load(make_titles(rng, args.titles, vocab))
+    report = {"titles": args.titles, "build_s": round(time.perf_counter() - t, 2)}
+    report.update(index.stats())
+
+    prefixes = []
+    for _ in range(args.queries):
+        word = rng.choice(vocab)
+        if rng.random() < 0.3:
+            prefixes.append(f"{rng.choice(vocab)} {word[: rng.randint(1, 4)]}")
+        else:
+            prefixes.append(word[: rng.randint(1, 6)])
+
+    samples, empty = [], 0
+    for prefix in prefixes:
+        t = time.perf_counter()
+        found = index.suggest(prefix, args.limit)
+        samples.append(time.perf_counter() - t)
+        empty += not found
+    report["lookup"] = percentiles(samples)
+    report["lookup"]["empty_results"] = empty
+
+    # new titles, then renames of existing ones (a rename also has to take
+    # the title out of its old words' postings)
+    inserts, renames = [], []
+    for doc_id, isbn, title, author in make_titles(rng, 2000, vocab):
+        rename = doc_id % 2 == 0
+        target = rng.randint(1, args.titles) if rename else args.titles + doc_id
+        t = time.perf_counter()
+        index.upsert(target, isbn, title, author)
+        (renames if rename else inserts).append(time.perf_counter() - t)
+    report["insert"] = percentiles(inserts)
+    report["rename"] = percentiles(renames)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+# bench_sync.py
+"""
+Sync simulation: central plus N branches in one process.
+
+Every service runs as a Flask test client on its own throwaway SQLite DB.
+The branches' calls to central go through a fault-injecting link (central
+down, slow responses, lost responses) while borrow/return traffic runs in
+phases. Afterwards the faults are cleared, the outboxes are replayed and
+the harness measures how long it takes until every branch Book row matches
+central's BookAvailability.
+
+    python bench_sync.py --branches 5 --scale 2 --out bench_sync.jsonl
+
+The report is printed as JSON. With --out it is also appended as one line
+to a JSONL file so runs can be compared over time.
+"""
+import argparse
+import importlib
+import importlib.util
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import requests
+from sqlalchemy import func, select
+
+ROOT = Path(__file__).resolve().parent
+SERVICE_API_KEY = "bench-service-key"
+KEY = {"X-API-Key": SERVICE_API_KEY}
+CENTRAL_URL = "http://central.sim"
+# Phases last seconds, not minutes, so the per-host circuit breaker must
+# half-open just as quickly for the link to be exercised at all
+BREAKER_RESET_SECONDS = "0.5"
+
+# (name, operations, fault settings); operations are multiplied by --scale
+PHASES = [
+    ("baseline", 200, {}),
+    ("central_down", 300, {"down": 1.0}),
+    ("slow", 200, {"slow": 1.0, "latency": 0.02}),
+    ("flaky", 300, {"down": 0.1, "drop": 0.3}),
+]
+
+
+# ----------------- in-process transport -----------------
+
+class SimResponse:
+    def __init__(self, resp):
+        self.status_code = resp.status_code
+        self.ok = resp.status_code < 400
+        self.headers = resp.headers
+        self.text = resp.get_data(as_text=True)
+        self._resp = resp
+
+    def json(self):
+        return self._resp.get_json()
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError(f"{self.status_code} Error")
+
+
+class SimLink:
+    """
+    Transport for a service's HttpClient (see HttpClient.set_transport).
+    Calls are routed to test clients by host, with faults injected per call:
+      down    - fraction refused before reaching the target
+      drop    - fraction delivered but the response is lost
+      slow    - fraction delayed by `latency` seconds; if that exceeds the
+                caller's timeout the caller sees a timeout (after delivery)
+    """
+
+    def __init__(self, clients, rng):
+        self.clients = clients  # netloc -> Flask test client
+        self.rng = rng
+        self.faults = {}
+        self.stats = Counter()
+
+    def set_faults(self, down=0.0, drop=0.0, slow=0.0, latency=0.0):
+        self.faults = {"down": down, "drop": drop, "slow": slow, "latency": latency}
+
+    def request(self, method, url, json=None, headers=None, params=None, timeout=None, **_):
+        parts = urlsplit(url)
+        client = self.clients.get(parts.netloc)
+        if client is None:
+            raise requests.ConnectionError(f"simulated: unknown host {parts.netloc}")
+
+        f = self.faults
+        self.stats["calls"] += 1
+        if self.rng.random() < f.get("down", 0):
+            self.stats["refused"] += 1
+            raise requests.ConnectionError("simulated: connection refused")
+
+        timed_out = False
+        if self.rng.random() < f.get("slow", 0):
+            self.stats["slow"] += 1
+            time.sleep(f["latency"])
+            read_timeout = timeout[1] if isinstance(timeout, tuple) else timeout
+            timed_out = read_timeout is not None and f["latency"] >= read_timeout
+
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        resp = getattr(client, method.lower())(
+            path, json=json, headers=headers or {}, query_string=params
+        )
+
+        if timed_out:
+            self.stats["timed_out"] += 1
+            raise requests.Timeout("simulated: read timed out")
+        if self.rng.random() < f.get("drop", 0):
+            self.stats["dropped"] += 1
+            raise requests.ConnectionError("simulated: response lost")
+        self.stats["delivered"] += 1
+        return SimResponse(resp)
+
+
+# ----------------- booting the services -----------------
+
+def load_central(workdir):
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/central.db"
+    os.environ["SERVICE_API_KEY"] = SERVICE_API_KEY
+    os.environ["RECONCILE_SECONDS"] = "0"
+    return importlib.import_module("central_service.app")
+
+
+def load_branch(workdir, code):
+    """
+    Import branch_service again under a private package name so each
+    branch gets its own config, engine and module-level state.
+    """
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/branch_{code.lower()}.db"
+    os.environ["BRANCH_CODE"] = code
+    os.environ["CENTRAL_BASE_URL"] = CENTRAL_URL
+    os.environ["SERVICE_API_KEY"] = SERVICE_API_KEY
+    os.environ["GLOBAL_REPLICA_ENABLED"] = "0"
+    os.environ["HTTP_BREAKER_RESET_SECONDS"] = BREAKER_RESET_SECONDS
+
+    name = f"sim_branch_{code.lower()}"
+    pkg_dir = ROOT / "branch_service"
+    spec = importlib.util.spec_from_file_location(
+        name, pkg_dir / "__init__.py", submodule_search_locations=[str(pkg_dir)]
+    )
+    pkg = importlib.util.module_from_spec(spec)
+    sys.modules[name] = pkg
+    spec.loader.exec_module(pkg)
+    return importlib.import_module(f"{name}.app")
+
+
+class Simulation:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.workdir = tempfile.mkdtemp(prefix="bench_sync_")
+
+        self.central = load_central(self.workdir)
+        self.central_client = self.central.app.test_client()
+
+        self.branches = {}
+        for i in range(1, args.branches + 1):
+            code = f"SIM_{i}"
+            module = load_branch(self.workdir, code)
+            self.branches[code] = {
+                "module": module,
+                "client": module.app.test_client(),
+                "url": f"http://{code.lower()}.sim",
+                "loans": [],
+            }
+
+        # branch -> central goes through the faulty link; central -> branch
+        # (reconciliation) is always healthy
+        self.link = SimLink({urlsplit(CENTRAL_URL).netloc: self.central_client}, self.rng)
+        for b in self.branches.values():
+            b["module"].http_client.set_transport(self.link)
+        to_branches = SimLink(
+            {urlsplit(b["url"]).netloc: b["client"] for b in self.branches.values()},
+            self.rng,
+        )
+        self.central.http_client.set_transport(to_branches)
+
+        self.isbns = [make_isbn(n) for n in range(args.books)]
+        self.users = [f"sim-user-{n}" for n in range(args.users)]
+
+    # ----------------- setup -----------------
+
+    def seed(self):
+        self.link.set_faults()
+        users = [
+            {"external_id": u, "name": u, "email": f"{u}@sim.local"} for u in self.users
+        ]
+        for code, b in self.branches.items():
+            self.central_client.post(
+                "/api/branches",
+                json={"code": code, "name": code, "base_url": b["url"]},
+            )
+            b["client"].post("/api/users/bulk", headers=KEY, json={"users": users})
+            for n, isbn in enumerate(self.isbns):
+                b["client"].post(
+                    "/api/books",
+                    headers=KEY,
+                    json={
+                        "isbn": isbn,
+                        "title": f"Simulated title {n}",
+                        "author": "Bench",
+                        "total_copies": self.rng.randint(1, 5),
+                    },
+                )
+
+    # ----------------- traffic -----------------
+
+    def one_op(self):
+        code = self.rng.choice(list(self.branches))
+        b = self.branches[code]
+        if b["loans"] and self.rng.random() < 0.45:
+            loan_id = b["loans"].pop(self.rng.randrange(len(b["loans"])))
+            resp = b["client"].post(f"/api/loans/{loan_id}/return", headers=KEY)
+            return resp.status_code == 200
+        resp = b["client"].post(
+            "/api/loans",
+            headers=KEY,
+            json={
+                "isbn": self.rng.choice(self.isbns),
+                "user_external_id": self.rng.choice(self.users),
+            },
+        )
+        if resp.status_code == 201:
+            b["loans"].append(resp.get_json()["loan_id"])
+            return True
+        # 409 (no copies left) is normal traffic, not a failure
+        return resp.status_code == 409
+
+    def outbox_size(self):
+        total = 0
+        for b in self.branches.values():
+            m = b["module"]
+            session = m.SessionLocal()
+            try:
+                total += session.execute(
+                    select(func.count()).select_from(m.PendingSyncEvent)
+                ).scalar_one()
+            finally:
+                session.close()
+        return total
+
+    def short_circuited(self):
+        return sum(
+            host["short_circuited"]
+            for b in self.branches.values()
+            for host in b["module"].http_client.stats().values()
+        )
+
+    def run_phase(self, name, ops, faults):
+        self.link.set_faults(**faults)
+        before = Counter(self.link.stats)
+        short_before = self.short_circuited()
+        ok = failed = 0
+        peak = self.outbox_size()
+        started = time.monotonic()
+        for n in range(ops):
+            if self.one_op():
+                ok += 1
+            else:
+                failed += 1
+            if n % 25 == 0:
+                peak = max(peak, self.outbox_size())
+        elapsed = time.monotonic() - started
+        outbox = self.outbox_size()
+        return {
+            "phase": name,
+            "faults": faults,
+            "ops": ops,
+            "ops_failed": failed,
+            "seconds": round(elapsed, 3),
+            "ops_per_second": round(ops / elapsed, 1) if elapsed else None,
+            "outbox_end": outbox,
+            "outbox_peak": max(peak, outbox),
+            "link": dict(self.link.stats - before),
+            "short_circuited": self.short_circuited() - short_before,
+        }
+
+    # ----------------- recovery -----------------
+
+    def mismatches(self):
+        """
+        Rows where a branch's Book and central's BookAvailability disagree
+        (including rows present on only one side).
+        """
+        C = self.central
+        session = C.SessionLocal()
+        try:
+            central_rows = {
+                (r.branch_code, r.isbn): (r.total_copies, r.available_copies)
+                for r in session.execute(select(C.BookAvailability)).scalars()
+            }
+        finally:
+            session.close()
+
+        branch_rows = {}
+        for code, b in self.branches.items():
+            m = b["module"]
+            session = m.SessionLocal()
+            try:
+                for isbn, total, available in session.execute(
+                    select(m.Book.isbn, m.Book.total_copies, m.Book.available_copies)
+                ):
+                    branch_rows[(code, isbn)] = (total, available)
+            finally:
+                session.close()
+
+        keys = central_rows.keys() | branch_rows.keys()
+        return sum(1 for k in keys if central_rows.get(k) != branch_rows.get(k))
+
+    def recover(self, max_rounds=50):
+        self.link.set_faults()
+        started = time.monotonic()
+        outbox_start = self.outbox_size()
+        rounds = 0
+        replay_seconds = 0.0
+        while self.outbox_size() and rounds < max_rounds:
+            rounds += 1
+            pending = self.outbox_size()
+            t = time.monotonic()
+            for b in self.branches.values():
+                b["module"].retry_pending_events()
+            replay_seconds += time.monotonic() - t
+            if self.outbox_size() == pending:
+                # circuit still open after the fault phases: wait for it
+                time.sleep(float(BREAKER_RESET_SECONDS) / 5)
+        drained = time.monotonic() - started
+        outbox_left = self.outbox_size()
+
+        mismatched = self.mismatches()
+        result = {
+            "outbox_start": outbox_start,
+            "outbox_left": outbox_left,
+            "replay_rounds": rounds,
+            "seconds_to_drain": round(drained, 3),
+            "replay_events_per_second": (
+                round((outbox_start - outbox_left) / replay_seconds, 1)
+                if replay_seconds
+                else None
+            ),
+            "mismatched_after_replay": mismatched,
+        }
+        if mismatched:
+            self.central.reconciler.run()
+            mismatched = self.mismatches()
+            result["mismatched_after_reconcile"] = mismatched
+        result["converged"] = mismatched == 0 and outbox_left == 0
+        result["seconds_to_converge"] = round(time.monotonic() - started, 3)
+        return result
+
+    def run(self):
+        t = time.monotonic()
+        self.seed()
+        setup = {"seconds": round(time.monotonic() - t, 3), "outbox": self.outbox_size()}
+        phases = [
+            self.run_phase(name, int(ops * self.args.scale), faults)
+            for name, ops, faults in PHASES
+        ]
+        return {
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "git_rev": git_rev(),
+            "params": {
+                "branches": self.args.branches,
+                "books": self.args.books,
+                "users": self.args.users,
+                "scale": self.args.scale,
+                "seed": self.args.seed,
+            },
+            "setup": setup,
+            "phases": phases,
+            "recovery": self.recover(),
+            "central_sync_writer": self.central.sync_writer.stats(),
+        }
+
+
+def make_isbn(n):
+    """
+    Valid, hyphenated ISBN-13 for the n-th simulated title.
+    """
+    first12 = f"9781{n:08d}"
+    total = sum(int(c) * (3 if i % 2 else 1) for i, c in enumerate(first12))
+    return f"978-1{n:08d}{(10 - total % 10) % 10}"
+
+
+def git_rev():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--branches", type=int, default=3)
+    parser.add_argument("--books", type=int, default=50)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply ops per phase")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="append the report to this JSONL file")
+    parser.add_argument("--verbose", action="store_true", help="keep service logs")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(ROOT))
+    sim = Simulation(args)
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    report = sim.run()
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "a") as f:
+            f.write(json.dumps(report) + "\n")
+
+
+if __name__ == "__main__":
+    main()
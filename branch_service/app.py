@@ -1,15 +1,49 @@
 import os
 import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from urllib.parse import quote
 
-import requests
-from flask import Flask, jsonify, request, abort
+from flask import Flask, jsonify, request, abort, g
 from flask_cors import CORS
-from sqlalchemy import create_engine, select
+from sqlalchemy import create_engine, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker
 
+from common.http_client import HttpClient, install_deadlines
+from common.isbn import InvalidIsbn, isbn_key, try_isbn_key
+from common.periodic import in_serving_process, start_periodic
+from common.profiling import install_profiling
+from common.schema import upgrade_schema
+from common.tokens import TokenError, TokenVerifier, bearer_token
 from .config import Config
-from .models import Base, Book, User, Loan, PendingSyncEvent
+from .models import (
+    Base,
+    Book,
+    BorrowCounter,
+    Hold,
+    User,
+    Loan,
+    LoanArchive,
+    PendingSyncEvent,
+    RejectedSyncEvent,
+    SyncSequence,
+)
+from .archival import archive_returned_loans
+from .global_replica import GlobalAvailabilityReplica
+from .holds import ACTIVE as ACTIVE_HOLDS
+from .holds import (
+    allocate_copy,
+    expire_ready_holds,
+    position,
+    ready_holds,
+    release_hold,
+)
+from .overdue import sweep_overdue
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -19,8 +53,98 @@ CORS(app)
 engine = create_engine(app.config["SQLALCHEMY_DATABASE_URI"], future=True)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
+install_profiling(app, [engine])
+
+# One pooled client for every outbound service call
+http_client = HttpClient(
+    pool_size=app.config["HTTP_POOL_SIZE"],
+    timeout=app.config["HTTP_TIMEOUT_SECONDS"],
+    connect_timeout=app.config["HTTP_CONNECT_TIMEOUT_SECONDS"],
+    retries=app.config["HTTP_RETRIES"],
+    breaker_failures=app.config["HTTP_BREAKER_FAILURES"],
+    breaker_reset=app.config["HTTP_BREAKER_RESET_SECONDS"],
+)
+install_deadlines(app)
+
 # Create tables
 Base.metadata.create_all(engine)
+upgrade_schema(engine, Base.metadata)
+
+
+def _init_sync_sequence():
+    """
+    Make sure the sync version counter exists. A fresh counter starts at the
+    current time in ms, so a branch whose DB was wiped still produces
+    versions newer than anything central has seen from it before.
+    """
+    session = SessionLocal()
+    try:
+        if session.get(SyncSequence, 1) is None:
+            session.add(SyncSequence(id=1, value=int(time.time() * 1000)))
+            session.commit()
+    finally:
+        session.close()
+
+
+_init_sync_sequence()
+
+
+def migrate_isbn_keys():
+    """
+    Fill Book.isbn_key for rows created before ISBN keys existed. Rows that
+    aren't valid ISBNs, or that spell an ISBN another row already has, keep
+    a NULL key and are logged for a librarian to fix.
+    """
+    session = SessionLocal()
+    try:
+        pending = session.execute(
+            select(Book.id, Book.isbn).where(Book.isbn_key.is_(None)).order_by(Book.id)
+        ).all()
+        if not pending:
+            return
+        taken = set(
+            session.execute(select(Book.isbn_key).where(Book.isbn_key.isnot(None))).scalars()
+        )
+        updates = []
+        for book_id, isbn in pending:
+            key = try_isbn_key(isbn)
+            if key is None or key in taken:
+                logger.warning(
+                    "Book %s: no isbn_key for %r (invalid, or another book has it)",
+                    book_id,
+                    isbn,
+                )
+                continue
+            taken.add(key)
+            updates.append({"id": book_id, "isbn_key": key})
+        if updates:
+            session.execute(update(Book), updates)
+            session.commit()
+            logger.info("Backfilled isbn_key for %d books", len(updates))
+    finally:
+        session.close()
+
+
+migrate_isbn_keys()
+
+# Patron tokens are issued by central and verified here with the shared
+# secret; the deny-list is refreshed from central in the background.
+token_verifier = TokenVerifier(
+    app.config["JWT_SECRET"],
+    app.config["JWT_ALGORITHM"],
+    cache_size=app.config["TOKEN_CACHE_SIZE"],
+)
+
+# Where-else-is-it lookups are served from this replica; start from whatever
+# was stored last time so it works even if central is down right now.
+global_replica = GlobalAvailabilityReplica(
+    SessionLocal,
+    app.config["CENTRAL_BASE_URL"],
+    app.config["SERVICE_API_KEY"],
+    http_client,
+    poll_wait=app.config["GLOBAL_REPLICA_POLL_WAIT"],
+)
+global_replica.load_local()
 
 
 # ----------------- helpers: API key, sync -----------------
@@ -39,12 +163,157 @@ def require_api_key(func):
     return wrapper
 
 
-def send_availability_event(book: Book, session):
+def require_api_key_or_user_token(func):
     """
-    Try to send availability update (with metadata) to central.
-    If it fails, store in PendingSyncEvent for retry.
+    Accept either a service call (X-API-Key) or a patron Bearer token.
+    For patrons, the verified claims are exposed as g.user_claims; for
+    service calls g.user_claims is None. No DB lookups either way.
+    """
+    from functools import wraps
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        g.user_claims = None
+        expected = app.config.get("SERVICE_API_KEY")
+        if expected and request.headers.get("X-API-Key") == expected:
+            return func(*args, **kwargs)
+
+        token = bearer_token(request.headers.get("Authorization"))
+        if not token:
+            abort(401, description="Invalid or missing service API key")
+        try:
+            g.user_claims = token_verifier.verify(token)
+        except TokenError as e:
+            abort(401, description=str(e))
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def refresh_deny_list():
     """
-    payload = {
+    Pull the list of revoked token ids from central. If central is down
+    we keep using the last list we had.
+    """
+    url = f'{app.config["CENTRAL_BASE_URL"].rstrip("/")}/api/tokens/revoked'
+    try:
+        resp = http_client.get(url, headers={"X-API-Key": app.config["SERVICE_API_KEY"]})
+        if resp.status_code == 200:
+            token_verifier.deny_list.replace(resp.json())
+    except Exception as e:
+        logger.debug("Deny-list refresh failed: %s", e)
+
+
+def ensure_local_user(external_id):
+    """
+    Make sure a patron exists in this branch's user table, creating it on
+    first use from the profile central holds. Returns False if the patron
+    is unknown (or central can't be reached to find out).
+    """
+    if not external_id:
+        return False
+
+    session = SessionLocal()
+    try:
+        exists = session.execute(
+            select(User.id).where(User.external_id == external_id)
+        ).scalar_one_or_none()
+        if exists is not None:
+            return True
+
+        url = (
+            f'{app.config["CENTRAL_BASE_URL"].rstrip("/")}'
+            f'/api/user_central/{quote(external_id, safe="")}'
+        )
+        try:
+            resp = http_client.get(url, headers={"X-API-Key": app.config["SERVICE_API_KEY"]})
+        except Exception as e:
+            logger.warning("Could not look up user %s on central: %s", external_id, e)
+            return False
+        if resp.status_code != 200:
+            return False
+        profile = resp.json()
+
+        session.add(
+            User(
+                external_id=external_id,
+                name=profile["name"],
+                email=profile["email"],
+                home_branch=profile.get("home_branch"),
+            )
+        )
+        try:
+            session.commit()
+        except IntegrityError:
+            # a concurrent request created them first (or the email is taken)
+            session.rollback()
+            return session.execute(
+                select(User.id).where(User.external_id == external_id)
+            ).scalar_one_or_none() is not None
+        logger.info("Provisioned user %s from central", external_id)
+        return True
+    finally:
+        session.close()
+
+
+def bump_sync_version(book: Book, session):
+    """
+    Stamp a changed book with the next branch sync version. Must run in the
+    same transaction as the change so versions follow commit order.
+    """
+    session.execute(update(SyncSequence).values(value=SyncSequence.value + 1))
+    book.sync_version = session.execute(
+        select(SyncSequence.value).where(SyncSequence.id == 1)
+    ).scalar_one()
+
+
+# When central sheds load (429/503 + Retry-After) we stop calling it until
+# this monotonic deadline and let events queue up in the outbox instead.
+_central_backoff_until = 0.0
+
+
+def _note_central_backoff(resp):
+    global _central_backoff_until
+    if resp.status_code in (429, 503):
+        try:
+            delay = float(resp.headers.get("Retry-After", "1"))
+        except ValueError:
+            delay = 1.0
+        _central_backoff_until = time.monotonic() + delay
+
+
+def central_backing_off():
+    return time.monotonic() < _central_backoff_until
+
+
+def record_borrows(session, counts):
+    """
+    Add counts ({isbn: n}) to today's borrow counters, in the caller's
+    transaction. Returns {isbn: {"YYYY-MM-DD": new absolute count}}, which
+    goes into the sync payload; absolute values keep retries idempotent.
+    """
+    bucket = datetime.utcnow().date()
+    out = {}
+    for isbn, n in counts.items():
+        result = session.execute(
+            update(BorrowCounter)
+            .where((BorrowCounter.isbn == isbn) & (BorrowCounter.bucket == bucket))
+            .values(count=BorrowCounter.count + n)
+        )
+        if result.rowcount == 0:
+            session.add(BorrowCounter(isbn=isbn, bucket=bucket, count=n))
+            session.flush()
+        count = session.execute(
+            select(BorrowCounter.count).where(
+                (BorrowCounter.isbn == isbn) & (BorrowCounter.bucket == bucket)
+            )
+        ).scalar_one()
+        out[isbn] = {bucket.isoformat(): count}
+    return out
+
+
+def _availability_payload(book: Book, borrows=None):
+    return {
         "isbn": book.isbn,
         "title": book.title,
         "author": book.author,
@@ -53,53 +322,140 @@ def send_availability_event(book: Book, session):
         "branch_code": app.config["BRANCH_CODE"],
         "total_copies": book.total_copies,
         "available_copies": book.available_copies,
+        "holds_waiting": book.holds_waiting,
+        "version": book.sync_version,
         "timestamp": datetime.utcnow().isoformat(),
+        # {day: borrows that day}, only present on borrow events
+        "borrows": (borrows or {}).get(book.isbn),
     }
+
+
+def _queue_pending(book: Book, payload, session):
+    evt = PendingSyncEvent(
+        isbn=book.isbn,
+        total_copies=book.total_copies,
+        available_copies=book.available_copies,
+        payload=json.dumps(payload),
+    )
+    session.add(evt)
+
+
+def send_availability_event(book: Book, session, borrows=None):
+    """
+    Try to send availability update (with metadata) to central.
+    If it fails, store in PendingSyncEvent for retry.
+    """
+    payload = _availability_payload(book, borrows)
     url = f'{app.config["CENTRAL_BASE_URL"].rstrip("/")}/api/global/sync/availability'
 
     try:
-        resp = requests.post(
+        if central_backing_off():
+            raise RuntimeError("Central asked us to back off")
+        # one attempt only: this runs inside the patron's request, and a
+        # failed send already has the outbox (replayed with retries)
+        resp = http_client.post(
             url,
             json=payload,
             headers={"X-API-Key": app.config["SERVICE_API_KEY"]},
-            timeout=3,
+            idempotent=False,
         )
         if resp.status_code != 200:
+            _note_central_backoff(resp)
             raise RuntimeError(f"Central returned {resp.status_code}")
     except Exception:
         # store for later retry
-        evt = PendingSyncEvent(
-            isbn=book.isbn,
-            total_copies=book.total_copies,
-            available_copies=book.available_copies,
-            payload=json.dumps(payload),
+        _queue_pending(book, payload, session)
+
+
+def send_availability_events(books, session, borrows=None):
+    """
+    Batched variant: one call to central for several books (each book
+    once, with its latest state). On failure every event goes to the
+    outbox, exactly like send_availability_event.
+    """
+    unique = list({b.id: b for b in books}.values())
+    if not unique:
+        return
+    payloads = [_availability_payload(b, borrows) for b in unique]
+    url = f'{app.config["CENTRAL_BASE_URL"].rstrip("/")}/api/global/sync/availability/batch'
+
+    try:
+        if central_backing_off():
+            raise RuntimeError("Central asked us to back off")
+        resp = http_client.post(
+            url,
+            json={"events": payloads},
+            headers={"X-API-Key": app.config["SERVICE_API_KEY"]},
+            idempotent=False,
         )
-        session.add(evt)
+        if resp.status_code != 200:
+            _note_central_backoff(resp)
+            raise RuntimeError(f"Central returned {resp.status_code}")
+    except Exception:
+        for book, payload in zip(unique, payloads):
+            _queue_pending(book, payload, session)
+
+
+def _post_pending_payload(payload):
+    """
+    True when central took the event, False to retry later, or central's
+    error text when it refused the event for good (400).
+    """
+    url = f'{app.config["CENTRAL_BASE_URL"].rstrip("/")}/api/global/sync/availability'
+    if central_backing_off():
+        return False
+    try:
+        resp = http_client.post(
+            url,
+            json=payload,
+            headers={"X-API-Key": app.config["SERVICE_API_KEY"]},
+            idempotent=True,
+        )
+        _note_central_backoff(resp)
+        if resp.status_code == 400:
+            # e.g. not a valid ISBN: retrying can never succeed
+            logger.warning(
+                "Central rejected sync event for %s (version %s): %s",
+                payload.get("isbn"),
+                payload.get("version"),
+                resp.text,
+            )
+            return resp.text or "rejected"
+        return resp.status_code == 200
+    except Exception:
+        # leave for next retry
+        return False
 
 
 def retry_pending_events():
     """
     Retry sending all pending sync events.
     Can be called manually or scheduled.
+
+    Events are versioned, so central ignores anything older than what it
+    already has; that lets us replay over several connections at once
+    without caring about order.
     """
     session = SessionLocal()
     try:
         events = session.execute(select(PendingSyncEvent)).scalars().all()
-        for evt in events:
-            try:
-                payload = json.loads(evt.payload)
-                url = f'{app.config["CENTRAL_BASE_URL"].rstrip("/")}/api/global/sync/availability'
-                resp = requests.post(
-                    url,
-                    json=payload,
-                    headers={"X-API-Key": app.config["SERVICE_API_KEY"]},
-                    timeout=3,
+        payloads = [json.loads(evt.payload) for evt in events]
+        with ThreadPoolExecutor(max_workers=app.config["SYNC_RETRY_CONCURRENCY"]) as pool:
+            delivered = list(pool.map(_post_pending_payload, payloads))
+        for evt, payload, outcome in zip(events, payloads, delivered):
+            if isinstance(outcome, str):
+                # rejected by central: park it, don't retry forever
+                session.add(
+                    RejectedSyncEvent(
+                        isbn=evt.isbn,
+                        version=payload.get("version"),
+                        reason=outcome[:2000],
+                        payload=evt.payload,
+                        created_at=evt.created_at,
+                    )
                 )
-                if resp.status_code == 200:
-                    session.delete(evt)
-            except Exception:
-                # leave for next retry
-                pass
+            if outcome:
+                session.delete(evt)
         session.commit()
     finally:
         session.close()
@@ -112,6 +468,14 @@ def health():
     return jsonify({"status": "ok", "branch": app.config["BRANCH_CODE"]})
 
 
+@app.get("/api/metrics")
+def metrics():
+    """
+    Outbound HTTP pool, latency and circuit-breaker counters per host.
+    """
+    return jsonify({"http_client": http_client.stats()})
+
+
 # ----------------- user endpoints -----------------
 
 @app.post("/api/users")
@@ -142,6 +506,86 @@ def create_user():
         session.close()
 
 
+@app.post("/api/users/bulk")
+@require_api_key
+def create_users_bulk():
+    """
+    Upsert a batch of patrons (used by central's bulk import).
+
+    Request JSON: {"users": [{"external_id", "name", "email", "home_branch"}, ...]}
+    Existing patrons are updated, new ones inserted, all in one transaction.
+    Entries that are malformed or whose email (compared case-insensitively)
+    belongs to someone else here are skipped and listed in "errors".
+    """
+    users = (request.get_json(force=True) or {}).get("users")
+    if not isinstance(users, list):
+        abort(400, description="users must be a list")
+
+    by_id = {}
+    errors = []
+    for n, u in enumerate(users):
+        if not isinstance(u, dict):
+            errors.append({"index": n, "error": "entry must be an object"})
+            continue
+        fields = {f: u.get(f) for f in ("external_id", "name", "email", "home_branch")}
+        if not all(isinstance(v, str) for v in fields.values() if v is not None):
+            error = "external_id, name, email, home_branch must be strings"
+        elif not (fields["external_id"] and fields["name"] and fields["email"]):
+            error = "external_id, name, email are required"
+        else:
+            error = None
+        if error:
+            errors.append({"index": n, "external_id": fields["external_id"], "error": error})
+            continue
+        by_id[fields["external_id"]] = fields
+    emails = {u["email"].lower() for u in by_id.values()}
+
+    session = SessionLocal()
+    try:
+        existing = {}
+        email_owner = {}
+        for user in session.execute(
+            select(User).where(
+                or_(
+                    User.external_id.in_(by_id.keys()),
+                    func.lower(User.email).in_(emails),
+                )
+            )
+        ).scalars():
+            if user.external_id in by_id:
+                existing[user.external_id] = user
+            email_owner[user.email.lower()] = user.external_id
+
+        created = updated = 0
+        for ext, u in by_id.items():
+            email = u["email"].lower()
+            owner = email_owner.get(email)
+            if owner is not None and owner != ext:
+                errors.append({"external_id": ext, "error": f"email already used by {owner}"})
+                continue
+            email_owner[email] = ext
+            user = existing.get(ext)
+            if user is None:
+                session.add(
+                    User(
+                        external_id=ext,
+                        name=u["name"],
+                        email=u["email"],
+                        home_branch=u.get("home_branch"),
+                    )
+                )
+                created += 1
+            else:
+                user.name = u["name"]
+                user.email = u["email"]
+                user.home_branch = u.get("home_branch") or user.home_branch
+                updated += 1
+        session.commit()
+        return jsonify({"created": created, "updated": updated, "errors": errors})
+    finally:
+        session.close()
+
+
 @app.get("/api/users/<external_id>")
 def get_user(external_id):
     session = SessionLocal()
@@ -172,7 +616,11 @@ def create_or_update_book():
     Librarian endpoint – upsert book by ISBN.
     """
     data = request.get_json(force=True)
-    isbn = data["isbn"]
+    isbn = str(data["isbn"]).strip()
+    try:
+        key = isbn_key(isbn)
+    except InvalidIsbn as e:
+        abort(400, description=str(e))
     title = data["title"]
     author = data.get("author")
     publisher = data.get("publisher")
@@ -181,7 +629,7 @@ def create_or_update_book():
 
     session = SessionLocal()
     try:
-        q = select(Book).where(Book.isbn == isbn).with_for_update()
+        q = select(Book).where(Book.isbn_key == key).with_for_update()
         book = session.execute(q).scalar_one_or_none()
 
         if book:
@@ -190,12 +638,29 @@ def create_or_update_book():
             book.author = author
             book.publisher = publisher
             book.year = year
-            if diff != 0:
-                book.total_copies = total_copies
-                book.available_copies = max(0, book.available_copies + diff)
+            book.total_copies = total_copies
+            if diff > 0:
+                # new copies serve the hold queue before the shelf
+                now = datetime.utcnow()
+                for _ in range(diff):
+                    allocate_copy(session, book, now, app.config["HOLD_PICKUP_DAYS"])
+            elif diff < 0:
+                # only shelf copies can go; loaned and held ones still exist
+                on_loan = session.execute(
+                    select(func.count())
+                    .select_from(Loan)
+                    .where(
+                        (Loan.book_id == book.id)
+                        & Loan.status.in_(("BORROWED", "OVERDUE"))
+                    )
+                ).scalar_one()
+                book.available_copies = max(
+                    0, total_copies - on_loan - book.held_copies
+                )
         else:
             book = Book(
                 isbn=isbn,
+                isbn_key=key,
                 title=title,
                 author=author,
                 publisher=publisher,
@@ -205,6 +670,7 @@ def create_or_update_book():
             )
             session.add(book)
 
+        bump_sync_version(book, session)
         session.commit()
 
         # Sync availability to central (with metadata)
@@ -253,7 +719,8 @@ def search_books():
 def get_book(isbn):
     session = SessionLocal()
     try:
-        q = select(Book).where(Book.isbn == isbn)
+        # an invalid ISBN matches nothing ("== None" would mean IS NULL)
+        q = select(Book).where(Book.isbn_key == (try_isbn_key(isbn) or -1))
         book = session.execute(q).scalar_one_or_none()
         if not book:
             return jsonify({"error": "Book not found"}), 404
@@ -276,31 +743,46 @@ def get_book(isbn):
 # ----------------- loan endpoints -----------------
 
 @app.post("/api/loans")
-@require_api_key
+@require_api_key_or_user_token
 def borrow_book():
     data = request.get_json(force=True)
     isbn = data["isbn"]
-    user_external_id = data["user_external_id"]
     days = int(data.get("days", 14))
 
+    # Patrons can only borrow for themselves; the token already says who
+    # they are, so no extra lookup is needed to authorize the call.
+    if g.user_claims is not None:
+        user_external_id = g.user_claims["sub"]
+        if data.get("user_external_id") not in (None, user_external_id):
+            return jsonify({"error": "Token does not match user_external_id"}), 403
+    else:
+        user_external_id = data["user_external_id"]
+
+    ensure_local_user(user_external_id)
+
     session = SessionLocal()
     try:
         user = session.execute(
             select(User).where(User.external_id == user_external_id).with_for_update()
         ).scalar_one_or_none()
         if not user:
-            return jsonify({"error": "User not found in this branch"}), 404
+            return jsonify({"error": "User not found"}), 404
 
         book = session.execute(
-            select(Book).where(Book.isbn == isbn).with_for_update()
+            select(Book).where(Book.isbn_key == (try_isbn_key(isbn) or -1)).with_for_update()
         ).scalar_one_or_none()
         if not book:
             return jsonify({"error": "Book not found in this branch"}), 404
 
-        if book.available_copies <= 0:
+        # a copy set aside for this patron's hold comes first
+        hold = ready_holds(session, user.id, [book.id]).get(book.id) if book.held_copies else None
+        if hold is not None:
+            book.held_copies -= 1
+        elif book.available_copies <= 0:
             return jsonify({"error": "No copies available"}), 409
+        else:
+            book.available_copies -= 1
 
-        book.available_copies -= 1
         loan = Loan(
             user_id=user.id,
             book_id=book.id,
@@ -309,10 +791,16 @@ def borrow_book():
             status="BORROWED",
         )
         session.add(loan)
+        if hold is not None:
+            session.flush()
+            hold.status = "FULFILLED"
+            hold.loan_id = loan.id
+        bump_sync_version(book, session)
+        borrows = record_borrows(session, {book.isbn: 1})
         session.commit()
 
-        # Sync availability
-        send_availability_event(book, session)
+        # Sync availability (and today's borrow count for this title)
+        send_availability_event(book, session, borrows)
         session.commit()
 
         return jsonify(
@@ -326,6 +814,196 @@ def borrow_book():
         session.close()
 
 
+@app.post("/api/loans/batch")
+@require_api_key_or_user_token
+def borrow_books_batch():
+    """
+    Check out a stack of books in one go.
+
+    Request JSON: {"user_external_id": "...", "isbns": ["...", ...], "days": 14}
+    The user is resolved once, every ISBN is handled in one transaction and
+    central gets one coalesced availability update. Each item gets its own
+    result (201 / 404 / 409), so one unavailable title doesn't fail the rest.
+    """
+    data = request.get_json(force=True)
+    isbns = data.get("isbns")
+    if not isinstance(isbns, list) or not isbns:
+        abort(400, description="isbns must be a non-empty list")
+    days = int(data.get("days", 14))
+
+    if g.user_claims is not None:
+        user_external_id = g.user_claims["sub"]
+        if data.get("user_external_id") not in (None, user_external_id):
+            return jsonify({"error": "Token does not match user_external_id"}), 403
+    else:
+        user_external_id = data.get("user_external_id")
+
+    ensure_local_user(user_external_id)
+
+    session = SessionLocal()
+    try:
+        user = session.execute(
+            select(User).where(User.external_id == user_external_id)
+        ).scalar_one_or_none()
+        if not user:
+            return jsonify({"error": "User not found"}), 404
+
+        keys = {isbn: try_isbn_key(isbn) for isbn in isbns}
+        books = {
+            b.isbn_key: b
+            for b in session.execute(
+                select(Book)
+                .where(Book.isbn_key.in_({k for k in keys.values() if k is not None}))
+                .with_for_update()
+            ).scalars()
+        }
+        books_by_id = {b.id: b for b in books.values()}
+        held = ready_holds(session, user.id, [b.id for b in books.values() if b.held_copies])
+
+        now = datetime.utcnow()
+        due_at = now + timedelta(days=days)
+        results = []
+        new_loans = []
+        changed = []
+        fulfilled = []
+        for isbn in isbns:
+            book = books.get(keys[isbn])
+            if not book:
+                results.append({"isbn": isbn, "status": 404, "error": "Book not found in this branch"})
+                continue
+            hold = held.pop(book.id, None)
+            if hold is not None:
+                book.held_copies -= 1
+            elif book.available_copies <= 0:
+                results.append({"isbn": isbn, "status": 409, "error": "No copies available"})
+                continue
+            else:
+                book.available_copies -= 1
+
+            loan = Loan(
+                user_id=user.id,
+                book_id=book.id,
+                borrowed_at=now,
+                due_at=due_at,
+                status="BORROWED",
+            )
+            session.add(loan)
+            if hold is not None:
+                fulfilled.append((hold, loan))
+            new_loans.append((len(results), loan))
+            results.append({"isbn": isbn, "status": 201})
+            if book not in changed:
+                changed.append(book)
+
+        if fulfilled:
+            session.flush()
+            for hold, loan in fulfilled:
+                hold.status = "FULFILLED"
+                hold.loan_id = loan.id
+        for book in changed:
+            bump_sync_version(book, session)
+        borrow_counts = {}
+        for _, loan in new_loans:
+            isbn = books_by_id[loan.book_id].isbn
+            borrow_counts[isbn] = borrow_counts.get(isbn, 0) + 1
+        borrows = record_borrows(session, borrow_counts)
+        session.commit()
+
+        for idx, loan in new_loans:
+            results[idx]["loan_id"] = loan.id
+            results[idx]["due_at"] = loan.due_at.isoformat()
+
+        # One availability update for the whole stack
+        send_availability_events(changed, session, borrows)
+        session.commit()
+
+        return jsonify(
+            {
+                "branch": app.config["BRANCH_CODE"],
+                "borrowed": len(new_loans),
+                "results": results,
+            }
+        ), 207 if len(new_loans) != len(isbns) else 201
+    finally:
+        session.close()
+
+
+@app.post("/api/loans/batch/return")
+@require_api_key
+def return_books_batch():
+    """
+    Return several loans at once (desk / drop-box, like return_book).
+
+    Request JSON: {"loan_ids": [1, 2, 3]}
+    One transaction, one coalesced availability update to central, and a
+    per-loan result.
+    """
+    data = request.get_json(force=True)
+    loan_ids = data.get("loan_ids")
+    if not isinstance(loan_ids, list) or not loan_ids:
+        abort(400, description="loan_ids must be a non-empty list")
+
+    session = SessionLocal()
+    try:
+        loans = {
+            loan.id: loan
+            for loan in session.execute(
+                select(Loan).where(Loan.id.in_(set(loan_ids))).with_for_update()
+            ).scalars()
+        }
+        books = {
+            b.id: b
+            for b in session.execute(
+                select(Book)
+                .where(Book.id.in_({loan.book_id for loan in loans.values()}))
+                .with_for_update()
+            ).scalars()
+        }
+
+        archived = set()
+        missing = set(loan_ids) - loans.keys()
+        if missing:
+            archived = set(
+                session.execute(
+                    select(LoanArchive.id).where(LoanArchive.id.in_(missing))
+                ).scalars()
+            )
+
+        now = datetime.utcnow()
+        results = []
+        changed = []
+        for loan_id in loan_ids:
+            loan = loans.get(loan_id)
+            if not loan and loan_id in archived:
+                results.append({"loan_id": loan_id, "status": 200, "message": "Already returned"})
+                continue
+            if not loan:
+                results.append({"loan_id": loan_id, "status": 404, "error": "Loan not found"})
+                continue
+            if loan.status == "RETURNED":
+                results.append({"loan_id": loan_id, "status": 200, "message": "Already returned"})
+                continue
+
+            loan.status = "RETURNED"
+            loan.returned_at = now
+            book = books[loan.book_id]
+            allocate_copy(session, book, now, app.config["HOLD_PICKUP_DAYS"])
+            if book not in changed:
+                changed.append(book)
+            results.append({"loan_id": loan_id, "status": 200, "message": "Returned"})
+
+        for book in changed:
+            bump_sync_version(book, session)
+        session.commit()
+
+        send_availability_events(changed, session)
+        session.commit()
+
+        return jsonify({"results": results}), 200
+    finally:
+        session.close()
+
+
 @app.post("/api/loans/<int:loan_id>/return")
 @require_api_key
 def return_book(loan_id):
@@ -335,6 +1013,8 @@ def return_book(loan_id):
             select(Loan).where(Loan.id == loan_id).with_for_update()
         ).scalar_one_or_none()
         if not loan:
+            if session.get(LoanArchive, loan_id) is not None:
+                return jsonify({"message": "Already returned"}), 200
             return jsonify({"error": "Loan not found"}), 404
 
         if loan.status == "RETURNED":
@@ -343,11 +1023,12 @@ def return_book(loan_id):
         loan.status = "RETURNED"
         loan.returned_at = datetime.utcnow()
 
-        # update book availability
+        # the copy goes to the next hold in the queue, else back on the shelf
         book = session.execute(
             select(Book).where(Book.id == loan.book_id).with_for_update()
         ).scalar_one()
-        book.available_copies += 1
+        allocate_copy(session, book, loan.returned_at, app.config["HOLD_PICKUP_DAYS"])
+        bump_sync_version(book, session)
 
         session.commit()
 
@@ -361,12 +1042,20 @@ def return_book(loan_id):
 
 
 @app.get("/api/loans")
-@require_api_key
+@require_api_key_or_user_token
 def list_loans():
     """
-    List all loans for a user_external_id for this branch.
+    List loans for a user_external_id for this branch.
+    Patrons calling with a token always get their own loans.
+
+    By default only active (BORROWED / OVERDUE) loans are returned, which
+    only touches the hot part of the loan table. ?include_history=1 adds
+    returned loans, including those moved to the archive.
     """
+    include_history = request.args.get("include_history") == "1"
     user_external_id = request.args.get("user_external_id")
+    if g.user_claims is not None:
+        user_external_id = g.user_claims["sub"]
     if not user_external_id:
         return jsonify([])
 
@@ -378,14 +1067,21 @@ def list_loans():
         if not user:
             return jsonify([])
 
-        loans = session.execute(select(Loan).where(Loan.user_id == user.id)).scalars().all()
+        q = (
+            select(Loan, Book.isbn, Book.title)
+            .join(Book, Book.id == Loan.book_id)
+            .where(Loan.user_id == user.id)
+        )
+        if not include_history:
+            q = q.where(Loan.status.in_(("BORROWED", "OVERDUE")))
+
         result = []
-        for loan in loans:
+        for loan, isbn, title in session.execute(q):
             result.append(
                 {
                     "loan_id": loan.id,
-                    "isbn": loan.book.isbn,
-                    "title": loan.book.title,
+                    "isbn": isbn,
+                    "title": title,
                     "status": loan.status,
                     "borrowed_at": loan.borrowed_at.isoformat(),
                     "due_at": loan.due_at.isoformat(),
@@ -395,33 +1091,310 @@ def list_loans():
                     "branch": app.config["BRANCH_CODE"],
                 }
             )
+
+        if include_history:
+            archived = session.execute(
+                select(LoanArchive, Book.isbn, Book.title)
+                .join(Book, Book.id == LoanArchive.book_id)
+                .where(LoanArchive.user_id == user.id)
+            )
+            for loan, isbn, title in archived:
+                result.append(
+                    {
+                        "loan_id": loan.id,
+                        "isbn": isbn,
+                        "title": title,
+                        "status": "RETURNED",
+                        "borrowed_at": loan.borrowed_at.isoformat(),
+                        "due_at": loan.due_at.isoformat(),
+                        "returned_at": loan.returned_at.isoformat(),
+                        "branch": app.config["BRANCH_CODE"],
+                        "archived": True,
+                    }
+                )
         return jsonify(result)
     finally:
         session.close()
 
 
+@app.get("/api/loans/overdue")
+@require_api_key
+def list_overdue_loans():
+    """
+    Overdue loans at this branch, served from the (status, due_at) index.
+    - ?count_only=1     just {"branch": ..., "overdue": n} (for central)
+    - ?limit=&offset=   page through the listing, oldest due first
+    """
+    session = SessionLocal()
+    try:
+        count = session.execute(
+            select(func.count()).select_from(Loan).where(Loan.status == "OVERDUE")
+        ).scalar_one()
+        if request.args.get("count_only") == "1":
+            return jsonify({"branch": app.config["BRANCH_CODE"], "overdue": count})
+
+        limit = min(int(request.args.get("limit", 100)), 1000)
+        offset = int(request.args.get("offset", 0))
+        rows = session.execute(
+            select(Loan.id, Loan.due_at, Book.isbn, Book.title, User.external_id)
+            .join(Book, Book.id == Loan.book_id)
+            .join(User, User.id == Loan.user_id)
+            .where(Loan.status == "OVERDUE")
+            .order_by(Loan.due_at)
+            .limit(limit)
+            .offset(offset)
+        ).all()
+        return jsonify(
+            {
+                "branch": app.config["BRANCH_CODE"],
+                "overdue": count,
+                "loans": [
+                    {
+                        "loan_id": r.id,
+                        "isbn": r.isbn,
+                        "title": r.title,
+                        "user_external_id": r.external_id,
+                        "due_at": r.due_at.isoformat(),
+                    }
+                    for r in rows
+                ],
+            }
+        )
+    finally:
+        session.close()
+
+
+@app.post("/api/loans/overdue/sweep")
+@require_api_key
+def run_overdue_sweep():
+    flipped = sweep_overdue(SessionLocal, app.config["OVERDUE_SWEEP_CHUNK"])
+    return jsonify({"marked_overdue": flipped}), 200
+
+
+@app.post("/api/loans/archive")
+@require_api_key
+def run_loan_archival():
+    archived = archive_returned_loans(
+        SessionLocal,
+        app.config["LOAN_ARCHIVE_AFTER_DAYS"],
+        app.config["LOAN_ARCHIVE_BATCH"],
+    )
+    return jsonify({"archived": archived}), 200
+
+
+# ----------------- hold endpoints -----------------
+
+def _hold_json(session, hold, isbn, title):
+    entry = {
+        "hold_id": hold.id,
+        "isbn": isbn,
+        "title": title,
+        "status": hold.status,
+        "created_at": hold.created_at.isoformat(),
+        "expires_at": hold.expires_at.isoformat() if hold.expires_at else None,
+        "branch": app.config["BRANCH_CODE"],
+    }
+    if hold.status == "WAITING":
+        entry["position"] = position(session, hold)
+    return entry
+
+
+@app.post("/api/holds")
+@require_api_key_or_user_token
+def place_hold():
+    """
+    Join the queue for a title with no copy on the shelf.
+
+    Request JSON: {"user_external_id": "...", "isbn": "..."}
+    When a copy comes back it is set aside for the oldest hold (READY) and
+    kept for HOLD_PICKUP_DAYS; borrowing the title then takes that copy.
+    """
+    data = request.get_json(force=True)
+    isbn = data["isbn"]
+    if g.user_claims is not None:
+        user_external_id = g.user_claims["sub"]
+        if data.get("user_external_id") not in (None, user_external_id):
+            return jsonify({"error": "Token does not match user_external_id"}), 403
+    else:
+        user_external_id = data["user_external_id"]
+
+    ensure_local_user(user_external_id)
+
+    session = SessionLocal()
+    try:
+        user = session.execute(
+            select(User).where(User.external_id == user_external_id)
+        ).scalar_one_or_none()
+        if not user:
+            return jsonify({"error": "User not found"}), 404
+
+        book = session.execute(
+            select(Book).where(Book.isbn_key == (try_isbn_key(isbn) or -1)).with_for_update()
+        ).scalar_one_or_none()
+        if not book:
+            return jsonify({"error": "Book not found in this branch"}), 404
+
+        existing = session.execute(
+            select(Hold).where(
+                (Hold.user_id == user.id)
+                & (Hold.book_id == book.id)
+                & Hold.status.in_(ACTIVE_HOLDS)
+            )
+        ).scalar_one_or_none()
+        if existing:
+            return jsonify(_hold_json(session, existing, book.isbn, book.title)), 200
+
+        if book.available_copies > 0:
+            return jsonify({"error": "Copies are available, borrow instead"}), 409
+
+        hold = Hold(
+            user_id=user.id,
+            book_id=book.id,
+            isbn_key=book.isbn_key,
+            status="WAITING",
+            created_at=datetime.utcnow(),
+        )
+        session.add(hold)
+        book.holds_waiting += 1
+        bump_sync_version(book, session)
+        session.commit()
+
+        # central shows queue lengths next to availability
+        send_availability_event(book, session)
+        session.commit()
+
+        return jsonify(_hold_json(session, hold, book.isbn, book.title)), 201
+    finally:
+        session.close()
+
+
+@app.get("/api/holds")
+@require_api_key_or_user_token
+def list_holds():
+    """
+    Active (WAITING / READY) holds of a user at this branch, with queue
+    position or pickup deadline.
+    """
+    user_external_id = request.args.get("user_external_id")
+    if g.user_claims is not None:
+        user_external_id = g.user_claims["sub"]
+    if not user_external_id:
+        return jsonify([])
+
+    session = SessionLocal()
+    try:
+        user = session.execute(
+            select(User).where(User.external_id == user_external_id)
+        ).scalar_one_or_none()
+        if not user:
+            return jsonify([])
+
+        rows = session.execute(
+            select(Hold, Book.isbn, Book.title)
+            .join(Book, Book.id == Hold.book_id)
+            .where((Hold.user_id == user.id) & Hold.status.in_(ACTIVE_HOLDS))
+            .order_by(Hold.created_at)
+        )
+        return jsonify([_hold_json(session, hold, isbn, title) for hold, isbn, title in rows])
+    finally:
+        session.close()
+
+
+@app.post("/api/holds/<int:hold_id>/cancel")
+@require_api_key_or_user_token
+def cancel_hold(hold_id):
+    session = SessionLocal()
+    try:
+        hold = session.execute(
+            select(Hold).where(Hold.id == hold_id).with_for_update()
+        ).scalar_one_or_none()
+        if not hold:
+            return jsonify({"error": "Hold not found"}), 404
+        if g.user_claims is not None:
+            owner = session.get(User, hold.user_id)
+            if owner.external_id != g.user_claims["sub"]:
+                return jsonify({"error": "Not your hold"}), 403
+        if hold.status not in ACTIVE_HOLDS:
+            return jsonify({"message": f"Hold already {hold.status.lower()}"}), 200
+
+        book = session.execute(
+            select(Book).where(Book.id == hold.book_id).with_for_update()
+        ).scalar_one()
+        release_hold(
+            session, hold, book, "CANCELLED", datetime.utcnow(), app.config["HOLD_PICKUP_DAYS"]
+        )
+        bump_sync_version(book, session)
+        session.commit()
+
+        send_availability_event(book, session)
+        session.commit()
+
+        return jsonify({"message": "Cancelled"}), 200
+    finally:
+        session.close()
+
+
+def expire_holds():
+    """
+    Expire READY holds past their pickup deadline, passing each copy on to
+    the next hold (or back to the shelf). Returns the number of books
+    touched.
+    """
+    session = SessionLocal()
+    try:
+        books = expire_ready_holds(session, datetime.utcnow(), app.config["HOLD_PICKUP_DAYS"])
+        for book in books:
+            bump_sync_version(book, session)
+        session.commit()
+        if books:
+            send_availability_events(books, session)
+            session.commit()
+        return len(books)
+    finally:
+        session.close()
+
+
+@app.post("/api/holds/expire")
+@require_api_key
+def run_hold_expiry():
+    return jsonify({"books_updated": expire_holds()}), 200
+
+
 # ----------------- sync endpoints -----------------
 
 @app.get("/api/sync/availability")
 @require_api_key
 def availability_snapshot():
     """
-    Central can call this for reconciliation.
+    Full availability snapshot for central's reconciliation.
+
+    "version" is the branch sync sequence read before the books: anything
+    central holds with a higher version is newer than this snapshot.
     """
     session = SessionLocal()
     try:
+        version = session.execute(
+            select(SyncSequence.value).where(SyncSequence.id == 1)
+        ).scalar_one()
         books = session.execute(select(Book)).scalars().all()
         data = []
         for b in books:
             data.append(
                 {
                     "isbn": b.isbn,
-                    "branch_code": app.config["BRANCH_CODE"],
+                    "title": b.title,
+                    "author": b.author,
+                    "publisher": b.publisher,
+                    "year": b.year,
                     "total_copies": b.total_copies,
                     "available_copies": b.available_copies,
+                    "holds_waiting": b.holds_waiting,
+                    "version": b.sync_version,
                 }
             )
-        return jsonify(data)
+        return jsonify(
+            {"branch_code": app.config["BRANCH_CODE"], "version": version, "books": data}
+        )
     finally:
         session.close()
 
@@ -433,6 +1406,94 @@ def retry_sync():
     return jsonify({"message": "Retry triggered"}), 200
 
 
+@app.get("/api/sync/rejected")
+@require_api_key
+def rejected_sync_events():
+    """
+    Outbox events central refused, newest first, with its reason.
+    """
+    session = SessionLocal()
+    try:
+        rows = session.execute(
+            select(RejectedSyncEvent).order_by(RejectedSyncEvent.id.desc()).limit(500)
+        ).scalars()
+        return jsonify(
+            [
+                {
+                    "id": r.id,
+                    "isbn": r.isbn,
+                    "version": r.version,
+                    "reason": r.reason,
+                    "payload": json.loads(r.payload) if r.payload else None,
+                    "created_at": r.created_at.isoformat(),
+                    "rejected_at": r.rejected_at.isoformat(),
+                }
+                for r in rows
+            ]
+        )
+    finally:
+        session.close()
+
+
+@app.get("/api/availability/elsewhere/<isbn>")
+def availability_elsewhere(isbn):
+    """
+    Other branches' availability for a title, from the local replica.
+    Never calls central; "synced_at" says how fresh the answer is
+    (null = not synced with central since this process started).
+    """
+    own = app.config["BRANCH_CODE"]
+    entries = global_replica.lookup(isbn)
+    branches = [
+        {"branch_code": code, "available_copies": available, "total_copies": total}
+        for code, (available, total) in sorted(entries.items())
+        if code != own
+    ]
+    synced_at = global_replica.synced_at
+    return jsonify(
+        {
+            "isbn": isbn,
+            "branches": branches,
+            "available_elsewhere": sum(b["available_copies"] for b in branches),
+            "synced_at": synced_at.isoformat() + "Z" if synced_at else None,
+        }
+    )
+
+
+def start_background_tasks():
+    if app.config["LOAN_ARCHIVE_SECONDS"] > 0:
+        start_periodic(
+            "loan-archival",
+            app.config["LOAN_ARCHIVE_SECONDS"],
+            lambda: archive_returned_loans(
+                SessionLocal,
+                app.config["LOAN_ARCHIVE_AFTER_DAYS"],
+                app.config["LOAN_ARCHIVE_BATCH"],
+            ),
+        )
+    if app.config["OVERDUE_SWEEP_SECONDS"] > 0:
+        start_periodic(
+            "overdue-sweep",
+            app.config["OVERDUE_SWEEP_SECONDS"],
+            lambda: sweep_overdue(SessionLocal, app.config["OVERDUE_SWEEP_CHUNK"]),
+            run_immediately=True,
+        )
+    if app.config["HOLD_EXPIRY_SWEEP_SECONDS"] > 0:
+        start_periodic("hold-expiry", app.config["HOLD_EXPIRY_SWEEP_SECONDS"], expire_holds)
+    if app.config["TOKEN_DENYLIST_REFRESH_SECONDS"] > 0:
+        start_periodic(
+            "deny-list-refresh",
+            app.config["TOKEN_DENYLIST_REFRESH_SECONDS"],
+            refresh_deny_list,
+            run_immediately=True,
+        )
+    if app.config["GLOBAL_REPLICA_ENABLED"]:
+        global_replica.start()
+
+
 if __name__ == "__main__":
+    debug = True
+    if in_serving_process(debug):
+        start_background_tasks()
     port = int(os.getenv("PORT", "5001"))
-    app.run(host="0.0.0.0", port=port, debug=True)
+    app.run(host="0.0.0.0", port=port, debug=debug)
@@ -0,0 +1,81 @@
+# branch_service/archival.py
+"""
+Loan archival: moves RETURNED loans older than a cutoff out of the hot
+loan table into loan_archive, in bounded batches, so the loan table and
+its indexes only grow with active lending.
+"""
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, select
+
+from .models import Loan, LoanArchive
+
+logger = logging.getLogger(__name__)
+
+
+def archive_returned_loans(session_factory, older_than_days, batch_size=1000, now=None):
+    """
+    Move returned loans with returned_at older than older_than_days.
+    Returns the number of loans archived.
+    """
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=older_than_days)
+    session = session_factory()
+    try:
+        # Never archive the newest loan row: SQLite hands out max(id) + 1 for
+        # new rows, so emptying the top of the table would reuse loan ids
+        # that already live in the archive.
+        max_id = session.execute(select(func.max(Loan.id))).scalar()
+        if max_id is None:
+            return 0
+
+        moved = 0
+        while True:
+            rows = session.execute(
+                select(
+                    Loan.id,
+                    Loan.user_id,
+                    Loan.book_id,
+                    Loan.borrowed_at,
+                    Loan.due_at,
+                    Loan.returned_at,
+                )
+                .where(
+                    (Loan.status == "RETURNED")
+                    & (Loan.returned_at < cutoff)
+                    & (Loan.id < max_id)
+                )
+                .order_by(Loan.returned_at)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+
+            session.execute(
+                insert(LoanArchive),
+                [
+                    {
+                        "id": r.id,
+                        "user_id": r.user_id,
+                        "book_id": r.book_id,
+                        "borrowed_at": r.borrowed_at,
+                        "due_at": r.due_at,
+                        "returned_at": r.returned_at,
+                        "archived_at": now,
+                    }
+                    for r in rows
+                ],
+            )
+            session.execute(delete(Loan).where(Loan.id.in_([r.id for r in rows])))
+            # one transaction per batch: copy + delete land together
+            session.commit()
+            moved += len(rows)
+            if len(rows) < batch_size:
+                break
+
+        if moved:
+            logger.info("Archived %d returned loans", moved)
+        return moved
+    finally:
+        session.close()
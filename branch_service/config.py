@@ -11,3 +11,50 @@ class Config:
 
     # Shared API key with central
     SERVICE_API_KEY = os.getenv("SERVICE_API_KEY", "dev-service-key")
+
+    # Must match central's JWT settings: branches verify patron tokens locally
+    JWT_SECRET = os.getenv("JWT_SECRET", "jwt-dev-secret")
+    JWT_ALGORITHM = "HS256"
+    TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
+    # How often to pull central's list of revoked tokens
+    TOKEN_DENYLIST_REFRESH_SECONDS = int(os.getenv("TOKEN_DENYLIST_REFRESH_SECONDS", "30"))
+
+    # Parallel connections used when replaying the sync outbox
+    SYNC_RETRY_CONCURRENCY = int(os.getenv("SYNC_RETRY_CONCURRENCY", "4"))
+
+    # Overdue sweeper: how often it runs and how many loans per UPDATE
+    OVERDUE_SWEEP_SECONDS = int(os.getenv("OVERDUE_SWEEP_SECONDS", "300"))
+    OVERDUE_SWEEP_CHUNK = int(os.getenv("OVERDUE_SWEEP_CHUNK", "500"))
+
+    # Per-request profiling (off by default). A request is profiled when it
+    # sends "X-Profile: <PROFILING_TOKEN>" or is sampled at PROFILING_SAMPLE_RATE.
+    PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+    PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+    PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+    PROFILING_DIR = os.getenv("PROFILING_DIR", "profiles")
+    PROFILING_MAX_FILES = int(os.getenv("PROFILING_MAX_FILES", "200"))
+
+    # Holds: how long a returned copy is kept for the patron at the head of
+    # the queue, and how often unclaimed ones are expired
+    HOLD_PICKUP_DAYS = int(os.getenv("HOLD_PICKUP_DAYS", "3"))
+    HOLD_EXPIRY_SWEEP_SECONDS = int(os.getenv("HOLD_EXPIRY_SWEEP_SECONDS", "600"))
+
+    # Loan archival: RETURNED loans older than this move to loan_archive
+    LOAN_ARCHIVE_AFTER_DAYS = int(os.getenv("LOAN_ARCHIVE_AFTER_DAYS", "90"))
+    LOAN_ARCHIVE_BATCH = int(os.getenv("LOAN_ARCHIVE_BATCH", "1000"))
+    LOAN_ARCHIVE_SECONDS = int(os.getenv("LOAN_ARCHIVE_SECONDS", "3600"))
+
+    # Local replica of other branches' availability, fed from central's
+    # change feed (long-poll held for GLOBAL_REPLICA_POLL_WAIT seconds)
+    GLOBAL_REPLICA_ENABLED = os.getenv("GLOBAL_REPLICA_ENABLED", "1") == "1"
+    GLOBAL_REPLICA_POLL_WAIT = int(os.getenv("GLOBAL_REPLICA_POLL_WAIT", "25"))
+
+    # Outbound service-to-service HTTP (common/http_client.py): connections
+    # kept alive per target host, default timeouts, retries for idempotent
+    # calls, and the per-host circuit breaker
+    HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+    HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "3"))
+    HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "1"))
+    HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+    HTTP_BREAKER_FAILURES = int(os.getenv("HTTP_BREAKER_FAILURES", "5"))
+    HTTP_BREAKER_RESET_SECONDS = float(os.getenv("HTTP_BREAKER_RESET_SECONDS", "10"))
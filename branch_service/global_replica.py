@@ -0,0 +1,176 @@
+# branch_service/global_replica.py
+"""
+Branch-local replica of global availability (isbn -> {branch: available}).
+
+Bootstrapped once from central's snapshot, then kept current by
+long-polling central's change feed. Lookups are answered from memory;
+the rows are also written to the local DB so a restart while central is
+down still has the last known state.
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import delete, insert, select
+
+from common.isbn import try_isbn_key
+from .models import RemoteAvailability
+
+logger = logging.getLogger(__name__)
+
+
+class GlobalAvailabilityReplica:
+    def __init__(self, session_factory, central_base_url, api_key, http, poll_wait=25):
+        self.session_factory = session_factory
+        self.http = http
+        self.central = central_base_url.rstrip("/")
+        self.headers = {"X-API-Key": api_key}
+        self.poll_wait = poll_wait
+        self.cursor = None
+        self.synced_at = None  # last successful contact with central
+        self._index = {}       # isbn key -> {branch_code: (available, total)}
+        self._lock = threading.Lock()
+
+    # ----------------- reads -----------------
+
+    def lookup(self, isbn):
+        """
+        Any ISBN-10/13 spelling of the title works.
+        """
+        key = try_isbn_key(isbn)
+        if key is None:
+            return {}
+        with self._lock:
+            return dict(self._index.get(key, {}))
+
+    # ----------------- local persistence -----------------
+
+    def load_local(self):
+        session = self.session_factory()
+        try:
+            index = {}
+            for r in session.execute(select(RemoteAvailability)).scalars():
+                key = try_isbn_key(r.isbn)
+                index.setdefault(key, {})[r.branch_code] = (r.available_copies, r.total_copies)
+        finally:
+            session.close()
+        with self._lock:
+            self._index = index
+        logger.info("Loaded %d titles from local availability replica", len(index))
+
+    def _persist(self, rows, full=False, removed=()):
+        """
+        rows: iterable of (isbn, branch_code, total, available).
+        full=True replaces the whole table (after a bootstrap); removed
+        lists (isbn, branch_code) pairs to drop.
+        """
+        now = datetime.utcnow()
+        session = self.session_factory()
+        try:
+            if full:
+                session.execute(delete(RemoteAvailability))
+            for isbn, branch_code in removed:
+                session.execute(
+                    delete(RemoteAvailability).where(
+                        RemoteAvailability.isbn == isbn,
+                        RemoteAvailability.branch_code == branch_code,
+                    )
+                )
+            if full:
+                # the table was just emptied: plain multi-row inserts, no
+                # per-row existence check (last row wins for a repeated key)
+                fresh = {
+                    (isbn, branch_code): {
+                        "isbn": isbn,
+                        "branch_code": branch_code,
+                        "total_copies": total,
+                        "available_copies": available,
+                        "updated_at": now,
+                    }
+                    for isbn, branch_code, total, available in rows
+                }
+                if fresh:
+                    session.execute(insert(RemoteAvailability), list(fresh.values()))
+                rows = ()
+            for isbn, branch_code, total, available in rows:
+                session.merge(
+                    RemoteAvailability(
+                        isbn=isbn,
+                        branch_code=branch_code,
+                        total_copies=total,
+                        available_copies=available,
+                        updated_at=now,
+                    )
+                )
+            session.commit()
+        finally:
+            session.close()
+
+    # ----------------- sync from central -----------------
+
+    def bootstrap(self):
+        resp = self.http.get(
+            f"{self.central}/api/global/availability", headers=self.headers, timeout=30
+        )
+        resp.raise_for_status()
+        data = resp.json()
+        index = {}
+        for isbn, branch_code, total, available in data["rows"]:
+            index.setdefault(try_isbn_key(isbn), {})[branch_code] = (available, total)
+        self._persist(data["rows"], full=True)
+        with self._lock:
+            self._index = index
+        self.cursor = data["cursor"]
+        self.synced_at = datetime.utcnow()
+        logger.info("Bootstrapped availability replica: %d titles", len(index))
+
+    def poll_once(self):
+        if self.cursor is None:
+            self.bootstrap()
+            return
+        resp = self.http.get(
+            f"{self.central}/api/global/changes",
+            params={"cursor": self.cursor, "wait": self.poll_wait},
+            headers=self.headers,
+            timeout=self.poll_wait + 10,
+        )
+        resp.raise_for_status()
+        data = resp.json()
+        if data["reset"]:
+            self.cursor = None
+            self.bootstrap()
+            return
+
+        changes = data["changes"]
+        if changes:
+            # last change per key wins; a removal drops the branch entirely
+            latest = {(c["isbn"], c["branch_code"]): c for c in changes}
+            rows = [
+                (isbn, code, c["total_copies"], c["available_copies"])
+                for (isbn, code), c in latest.items()
+                if not c.get("removed")
+            ]
+            removed = [key for key, c in latest.items() if c.get("removed")]
+            self._persist(rows, removed=removed)
+            with self._lock:
+                for isbn, branch_code, total, available in rows:
+                    key = try_isbn_key(isbn)
+                    self._index.setdefault(key, {})[branch_code] = (available, total)
+                for isbn, branch_code in removed:
+                    self._index.get(try_isbn_key(isbn), {}).pop(branch_code, None)
+        self.cursor = data["cursor"]
+        self.synced_at = datetime.utcnow()
+
+    def run_forever(self, error_backoff=5):
+        while True:
+            try:
+                self.poll_once()
+            except Exception as e:
+                logger.debug("Availability replica poll failed: %s", e)
+                time.sleep(error_backoff)
+
+    def start(self):
+        t = threading.Thread(target=self.run_forever, name="global-availability", daemon=True)
+        t.start()
+        return t
@@ -0,0 +1,131 @@
+# branch_service/holds.py
+"""
+Hold queues.
+
+Each title's WAITING holds are a FIFO queue served from the
+(isbn_key, status, created_at, id) index, so finding the head is a single
+index seek however long the queue is. Book.holds_waiting mirrors the queue
+length, which lets the common case (nobody waiting) skip the lookup
+entirely.
+
+All functions work inside the caller's transaction; the caller bumps the
+book's sync version and commits, so central learns the new availability
+and queue length through the normal availability sync.
+"""
+from datetime import timedelta
+
+from sqlalchemy import and_, func, or_, select
+
+from .models import Book, Hold
+
+ACTIVE = ("WAITING", "READY")
+
+
+def queue_head(session, book):
+    """
+    Oldest WAITING hold for book, locked, or None.
+    """
+    if not book.holds_waiting:
+        return None
+    return session.execute(
+        select(Hold)
+        .where((Hold.isbn_key == book.isbn_key) & (Hold.status == "WAITING"))
+        .order_by(Hold.created_at, Hold.id)
+        .limit(1)
+        .with_for_update()
+    ).scalar_one_or_none()
+
+
+def allocate_copy(session, book, now, pickup_days):
+    """
+    A copy of book became free (return, expired or cancelled pickup). Give
+    it to the head of the queue, or put it back on the shelf if nobody is
+    waiting. Returns the hold that got it, or None.
+    """
+    hold = queue_head(session, book)
+    if hold is None:
+        book.available_copies += 1
+        return None
+    hold.status = "READY"
+    hold.ready_at = now
+    hold.expires_at = now + timedelta(days=pickup_days)
+    book.holds_waiting -= 1
+    book.held_copies += 1
+    return hold
+
+
+def release_hold(session, hold, book, status, now, pickup_days):
+    """
+    End an active hold without a loan (cancelled or expired). A READY
+    hold's copy is passed on to the next patron in the queue.
+    """
+    if hold.status == "WAITING":
+        book.holds_waiting -= 1
+    elif hold.status == "READY":
+        book.held_copies -= 1
+        allocate_copy(session, book, now, pickup_days)
+    hold.status = status
+
+
+def ready_holds(session, user_id, book_ids):
+    """
+    {book_id: READY hold} for a patron, locked; borrowing one of these
+    books takes the copy set aside for them.
+    """
+    if not book_ids:
+        return {}
+    return {
+        h.book_id: h
+        for h in session.execute(
+            select(Hold)
+            .where(
+                (Hold.user_id == user_id)
+                & (Hold.status == "READY")
+                & Hold.book_id.in_(book_ids)
+            )
+            .with_for_update()
+        ).scalars()
+    }
+
+
+def position(session, hold):
+    """
+    1-based place of a WAITING hold in its queue.
+    """
+    ahead = session.execute(
+        select(func.count())
+        .select_from(Hold)
+        .where(
+            (Hold.isbn_key == hold.isbn_key)
+            & (Hold.status == "WAITING")
+            & or_(
+                Hold.created_at < hold.created_at,
+                and_(Hold.created_at == hold.created_at, Hold.id < hold.id),
+            )
+        )
+    ).scalar_one()
+    return ahead + 1
+
+
+def expire_ready_holds(session, now, pickup_days, limit=500):
+    """
+    READY holds not picked up by expires_at become EXPIRED and their copies
+    move down the queue. Returns the books whose state changed.
+    """
+    expired = session.execute(
+        select(Hold)
+        .where((Hold.status == "READY") & (Hold.expires_at <= now))
+        .order_by(Hold.expires_at)
+        .limit(limit)
+        .with_for_update()
+    ).scalars().all()
+    books = {}
+    for hold in expired:
+        book = books.get(hold.book_id)
+        if book is None:
+            book = session.execute(
+                select(Book).where(Book.id == hold.book_id).with_for_update()
+            ).scalar_one()
+            books[book.id] = book
+        release_hold(session, hold, book, "EXPIRED", now, pickup_days)
+    return list(books.values())
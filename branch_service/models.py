@@ -4,11 +4,15 @@ from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy import (
     Column,
     Integer,
+    BigInteger,
     String,
+    Date,
     DateTime,
     Enum,
     ForeignKey,
+    Index,
     Text,
+    func,
 )
 
 Base = declarative_base()
@@ -19,13 +23,23 @@ class Book(Base):
 
     # PK as Integer autoincrement so SQLite happily generates IDs
     id = Column(Integer, primary_key=True, autoincrement=True)
+    # ISBN as entered (display form); isbn_key is the canonical ISBN-13 as
+    # an integer (common.isbn.isbn_key) and is what lookups use
     isbn = Column(String(20), unique=True, nullable=False)
+    isbn_key = Column(BigInteger)
     title = Column(String(255), nullable=False)
     author = Column(String(255))
     publisher = Column(String(255))
     year = Column(Integer)
     total_copies = Column(Integer, nullable=False, default=1)
     available_copies = Column(Integer, nullable=False, default=1)
+    # Hold queue summary, kept in step with the hold table: patrons still
+    # waiting, and copies set aside for READY holds (neither on the shelf
+    # nor on loan)
+    holds_waiting = Column(Integer, nullable=False, default=0)
+    held_copies = Column(Integer, nullable=False, default=0)
+    # Branch-wide sync sequence number of the last change to this row
+    sync_version = Column(BigInteger, nullable=False, default=0)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
     updated_at = Column(
         DateTime,
@@ -34,6 +48,8 @@ class Book(Base):
         onupdate=datetime.utcnow,
     )
 
+    __table_args__ = (Index("ix_book_isbn_key", "isbn_key", unique=True),)
+
 
 class User(Base):
     __tablename__ = "user"
@@ -45,6 +61,9 @@ class User(Base):
     home_branch = Column(String(50))
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
 
+    # bulk upserts match emails case-insensitively
+    __table_args__ = (Index("ix_user_email_lower", func.lower(email)),)
+
 
 class Loan(Base):
     __tablename__ = "loan"
@@ -64,6 +83,66 @@ class Loan(Base):
     user = relationship("User")
     book = relationship("Book")
 
+    __table_args__ = (
+        # drives the overdue sweeper and the overdue count/listing
+        Index("ix_loan_status_due_at", "status", "due_at"),
+        # archival picks old RETURNED loans
+        Index("ix_loan_status_returned_at", "status", "returned_at"),
+        # a patron's active loans
+        Index("ix_loan_user_status", "user_id", "status"),
+    )
+
+
+class Hold(Base):
+    """
+    A patron waiting for a title at this branch. The WAITING holds of an
+    ISBN form a FIFO queue in (created_at, id) order; a returned copy goes
+    to the head of the queue (READY, set aside until expires_at) instead of
+    back on the shelf.
+    """
+    __tablename__ = "hold"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("user.id"), nullable=False)
+    book_id = Column(Integer, ForeignKey("book.id"), nullable=False)
+    isbn_key = Column(BigInteger, nullable=False)
+    status = Column(
+        Enum("WAITING", "READY", "FULFILLED", "CANCELLED", "EXPIRED", name="hold_status"),
+        nullable=False,
+        default="WAITING",
+    )
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    ready_at = Column(DateTime)
+    # pickup deadline once READY
+    expires_at = Column(DateTime)
+    # the loan that fulfilled it
+    loan_id = Column(Integer)
+
+    __table_args__ = (
+        # queue head per title: one index seek, oldest WAITING hold first
+        Index("ix_hold_queue", "isbn_key", "status", "created_at", "id"),
+        # a patron's active holds
+        Index("ix_hold_user_status", "user_id", "status"),
+        # expiry sweep over READY holds
+        Index("ix_hold_status_expires_at", "status", "expires_at"),
+    )
+
+
+class LoanArchive(Base):
+    """
+    Returned loans moved out of the hot loan table by the archival job.
+    Keeps the original loan id, so old receipts still resolve.
+    """
+    __tablename__ = "loan_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, nullable=False, index=True)
+    book_id = Column(Integer, nullable=False)
+    borrowed_at = Column(DateTime, nullable=False)
+    due_at = Column(DateTime, nullable=False)
+    returned_at = Column(DateTime, nullable=False)
+    archived_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
 
 class PendingSyncEvent(Base):
     """
@@ -77,3 +156,69 @@ class PendingSyncEvent(Base):
     available_copies = Column(Integer, nullable=False)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
     payload = Column(Text)  # JSON blob
+
+
+class RejectedSyncEvent(Base):
+    """
+    Outbox events central refused with a 400 (e.g. an invalid ISBN).
+    Retrying can never succeed, so they are parked here with central's
+    answer for a librarian to fix instead of being dropped.
+    """
+    __tablename__ = "rejected_sync_event"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    isbn = Column(String(20), nullable=False)
+    version = Column(BigInteger)
+    reason = Column(Text)
+    payload = Column(Text)  # JSON blob, as it was queued
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    rejected_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class SyncSequence(Base):
+    """
+    Single-row counter handing out this branch's monotonically increasing
+    sync versions. Central keeps the highest version it has applied per
+    (isbn, branch) and ignores anything older.
+    """
+    __tablename__ = "sync_sequence"
+
+    id = Column(Integer, primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+
+
+class JobWatermark(Base):
+    """
+    Progress marker for incremental background jobs (e.g. the overdue
+    sweeper remembers up to which due_at it has already looked).
+    """
+    __tablename__ = "job_watermark"
+
+    name = Column(String(50), primary_key=True)
+    value = Column(DateTime)
+
+
+class BorrowCounter(Base):
+    """
+    Borrows per title per day, bumped inside the borrow transaction and
+    shipped to central with the availability sync for popularity ranking.
+    """
+    __tablename__ = "borrow_counter"
+
+    isbn = Column(String(20), primary_key=True)
+    bucket = Column(Date, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class RemoteAvailability(Base):
+    """
+    Local read-only copy of every branch's availability, fed from central's
+    change feed. Lets staff answer "where else is it?" without central.
+    """
+    __tablename__ = "remote_availability"
+
+    isbn = Column(String(20), primary_key=True)
+    branch_code = Column(String(50), primary_key=True)
+    total_copies = Column(Integer, nullable=False)
+    available_copies = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
@@ -0,0 +1,69 @@
+# branch_service/overdue.py
+"""
+Overdue sweeper: flips BORROWED loans past due_at to OVERDUE.
+
+Works set-based in bounded chunks over the (status, due_at) index and keeps
+a watermark, so each run only looks at loans that became due since the
+previous run.
+"""
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+
+from .models import JobWatermark, Loan
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_NAME = "overdue_sweep"
+
+# Re-examine a small window before the watermark in case a loan with an
+# already-past due_at committed just after the previous run.
+OVERLAP = timedelta(minutes=5)
+
+
+def sweep_overdue(session_factory, chunk_size=500, now=None):
+    """
+    Mark newly-due loans as OVERDUE. Returns the number of loans flipped.
+    """
+    now = now or datetime.utcnow()
+    session = session_factory()
+    try:
+        mark = session.get(JobWatermark, WATERMARK_NAME)
+        if mark is None:
+            mark = JobWatermark(name=WATERMARK_NAME, value=None)
+            session.add(mark)
+
+        due_window = (Loan.status == "BORROWED") & (Loan.due_at <= now)
+        if mark.value is not None:
+            due_window = due_window & (Loan.due_at > mark.value - OVERLAP)
+
+        flipped = 0
+        while True:
+            # ids first, then one UPDATE per chunk (MySQL can't LIMIT an
+            # IN-subquery on the table being updated)
+            ids = session.execute(
+                select(Loan.id).where(due_window).order_by(Loan.due_at).limit(chunk_size)
+            ).scalars().all()
+            if ids:
+                result = session.execute(
+                    update(Loan)
+                    .where(Loan.id.in_(ids) & (Loan.status == "BORROWED"))
+                    .values(status="OVERDUE")
+                    .execution_options(synchronize_session=False)
+                )
+                flipped += result.rowcount
+            # commit per chunk so the write lock is never held for long
+            session.commit()
+            if len(ids) < chunk_size:
+                break
+
+        mark = session.get(JobWatermark, WATERMARK_NAME)
+        mark.value = now
+        session.commit()
+
+        if flipped:
+            logger.info("Overdue sweep marked %d loans OVERDUE", flipped)
+        return flipped
+    finally:
+        session.close()
@@ -0,0 +1,90 @@
+# central_service/admission.py
+"""
+Admission control for central.
+
+Requests are split into traffic classes (service-to-service sync, patron
+reads, patron writes). Each class has its own concurrency budget and a
+bounded wait queue; anything beyond that is shed straight away, so a sync
+flood cannot starve catalog reads and vice versa.
+"""
+import threading
+import time
+
+
+class Shed(Exception):
+    def __init__(self, traffic_class, reason):
+        super().__init__(reason)
+        self.traffic_class = traffic_class
+        self.reason = reason
+
+
+class _TrafficClass:
+    def __init__(self, name, concurrency, max_queue):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+        self.cond = threading.Condition()
+
+    def stats(self):
+        return {
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queue_depth": self.queued,
+            "admitted": self.admitted,
+            "shed_queue_full": self.shed_queue_full,
+            "shed_timeout": self.shed_timeout,
+        }
+
+
+class AdmissionController:
+    def __init__(self, budgets, queue_timeout_ms):
+        """
+        budgets: {"sync": (concurrency, max_queue), "read": (...), ...}
+        """
+        self.queue_timeout = queue_timeout_ms / 1000.0
+        self.classes = {
+            name: _TrafficClass(name, conc, q) for name, (conc, q) in budgets.items()
+        }
+
+    def acquire(self, name):
+        """
+        Take a slot in the class or raise Shed.
+        """
+        tc = self.classes[name]
+        with tc.cond:
+            if tc.active < tc.concurrency:
+                tc.active += 1
+                tc.admitted += 1
+                return
+            if tc.queued >= tc.max_queue:
+                tc.shed_queue_full += 1
+                raise Shed(name, "queue full")
+
+            tc.queued += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while tc.active >= tc.concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        tc.shed_timeout += 1
+                        raise Shed(name, "queue timeout")
+                    tc.cond.wait(remaining)
+            finally:
+                tc.queued -= 1
+            tc.active += 1
+            tc.admitted += 1
+
+    def release(self, name):
+        tc = self.classes[name]
+        with tc.cond:
+            tc.active -= 1
+            tc.cond.notify()
+
+    def stats(self):
+        return {name: tc.stats() for name, tc in self.classes.items()}
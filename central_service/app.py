@@ -1,15 +1,43 @@
 import os
+import json
 import logging
-from datetime import datetime
+from datetime import date, datetime, timedelta, timezone
 
-import requests
-from flask import Flask, jsonify, send_from_directory, request, abort
+from flask import Flask, Response, jsonify, request, abort, g
 from flask_cors import CORS
-from sqlalchemy import create_engine, select
+from sqlalchemy import create_engine, delete, func, insert, select, update
 from sqlalchemy.orm import sessionmaker
 
+from common.http_client import HttpClient, install_deadlines
+from common.isbn import InvalidIsbn, isbn_key, try_isbn_key
+from common.periodic import in_serving_process, start_periodic
+from common.profiling import install_profiling
+from common.schema import upgrade_schema
+from common.tokens import TokenError, TokenVerifier, bearer_token, issue_token
 from .config import Config
-from .models import Base, Branch, BookGlobal, BookAvailability, UserCentral
+from .models import (
+    Base,
+    Branch,
+    BookGlobal,
+    BookAvailability,
+    UserCentral,
+    RevokedToken,
+    BorrowStat,
+    StatCounter,
+    AvailabilityLog,
+    HistoryCompaction,
+)
+from .admission import AdmissionController, Shed
+from .assets import AssetStore
+from .availability_matrix import AvailabilityMatrix
+from .change_feed import ChangeFeed
+from .history import HistoryLog, changes_between, raw_horizon, state_at
+from .popularity import TopK
+from .reconcile import Reconciler
+from .replica import ReplicaRouter, now_ms
+from .suggest import SuggestIndex
+from .sync_writer import GroupCommitWriter, WriterBusy
+from .user_import import UserImport, iter_rows
 
 # ---------------------------------------------------------
 # Logging (so you can see sync calls in the terminal)
@@ -23,13 +51,454 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__, static_folder=None)
 app.config.from_object(Config)
-CORS(app)
+CORS(app, expose_headers=["X-Change-Cursor", "X-Write-Token"])
 
 engine = create_engine(app.config["SQLALCHEMY_DATABASE_URI"], future=True)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
+# Optional read replica for catalog reads; writes always use SessionLocal
+replica_engine = (
+    create_engine(app.config["READ_REPLICA_URL"], future=True)
+    if app.config["READ_REPLICA_URL"]
+    else None
+)
+db_router = ReplicaRouter(
+    engine, replica_engine, app.config["REPLICA_MAX_STALENESS_SECONDS"]
+)
+
+install_profiling(app, [engine, replica_engine])
+
+# One pooled client for every outbound service call
+http_client = HttpClient(
+    pool_size=app.config["HTTP_POOL_SIZE"],
+    timeout=app.config["HTTP_TIMEOUT_SECONDS"],
+    connect_timeout=app.config["HTTP_CONNECT_TIMEOUT_SECONDS"],
+    retries=app.config["HTTP_RETRIES"],
+    breaker_failures=app.config["HTTP_BREAKER_FAILURES"],
+    breaker_reset=app.config["HTTP_BREAKER_RESET_SECONDS"],
+)
+install_deadlines(app)
+
 # Create tables if not present
 Base.metadata.create_all(engine)
+upgrade_schema(engine, Base.metadata)
+
+# Availability deltas for live catalog clients (fed by sync_availability)
+change_feed = ChangeFeed(max_changes=app.config["CHANGE_FEED_SIZE"])
+
+
+def migrate_isbn_keys():
+    """
+    Fill isbn_key on BookGlobal / BookAvailability rows from before ISBN
+    keys existed. Titles stored under several spellings of one ISBN are
+    merged into the oldest row; availability rows take that row's display
+    ISBN (for a branch holding both spellings, the newest row is kept).
+    After a merge the summaries and dashboard counters are recomputed.
+    """
+    session = SessionLocal()
+    try:
+        pending = session.execute(
+            select(BookGlobal.id, BookGlobal.isbn)
+            .where(BookGlobal.isbn_key.is_(None))
+            .order_by(BookGlobal.id)
+        ).all()
+        pending_av = session.execute(
+            select(BookAvailability.id, BookAvailability.isbn).where(
+                BookAvailability.isbn_key.is_(None)
+            )
+        ).all()
+        if not pending and not pending_av:
+            return
+
+        display = dict(
+            session.execute(
+                select(BookGlobal.isbn_key, BookGlobal.isbn).where(
+                    BookGlobal.isbn_key.isnot(None)
+                )
+            ).all()
+        )
+        updates, duplicates = [], []
+        for row_id, isbn in pending:
+            key = try_isbn_key(isbn)
+            if key is None:
+                logger.warning("BookGlobal %r is not a valid ISBN; left without a key", isbn)
+            elif key in display:
+                duplicates.append(row_id)
+            else:
+                display[key] = isbn
+                updates.append({"id": row_id, "isbn_key": key})
+        if updates:
+            session.execute(update(BookGlobal), updates)
+
+        av_updates = []
+        for row_id, isbn in pending_av:
+            key = try_isbn_key(isbn)
+            if key is not None:
+                av_updates.append(
+                    {"id": row_id, "isbn_key": key, "isbn": display.get(key, isbn)}
+                )
+        if av_updates:
+            session.execute(update(BookAvailability), av_updates)
+
+        if duplicates:
+            session.execute(delete(BookGlobal).where(BookGlobal.id.in_(duplicates)))
+            seen, extra = set(), []
+            av = BookAvailability
+            for row_id, key, branch_code in session.execute(
+                select(av.id, av.isbn_key, av.branch_code)
+                .where(av.isbn_key.isnot(None))
+                .order_by(av.version.desc(), av.id.desc())
+            ):
+                if (key, branch_code) in seen:
+                    extra.append(row_id)
+                seen.add((key, branch_code))
+            if extra:
+                session.execute(delete(BookAvailability).where(BookAvailability.id.in_(extra)))
+            # recomputed by rebuild_title_summaries / init_stat_counters
+            session.execute(update(BookGlobal).values(available_total=None))
+            session.execute(delete(StatCounter))
+            logger.info("Merged %d duplicate ISBN spellings", len(duplicates))
+
+        session.commit()
+        logger.info("Backfilled isbn_key for %d titles, %d rows", len(updates), len(av_updates))
+    finally:
+        session.close()
+
+
+migrate_isbn_keys()
+
+
+def rebuild_title_summaries(only_missing=True):
+    """
+    Recompute BookGlobal.available_total / branch_count from
+    BookAvailability in one set-based UPDATE. Normally the summary is kept
+    current by sync_availability; this backfills rows that predate it.
+    """
+    avail = BookAvailability.__table__
+    total_q = (
+        select(func.coalesce(func.sum(avail.c.available_copies), 0))
+        .where(avail.c.isbn_key == BookGlobal.isbn_key)
+        .scalar_subquery()
+    )
+    count_q = (
+        select(func.count())
+        .where((avail.c.isbn_key == BookGlobal.isbn_key) & (avail.c.total_copies > 0))
+        .scalar_subquery()
+    )
+    stmt = update(BookGlobal).values(available_total=total_q, branch_count=count_q)
+    if only_missing:
+        stmt = stmt.where(BookGlobal.available_total.is_(None))
+
+    with engine.begin() as conn:
+        conn.execute(stmt)
+
+
+rebuild_title_summaries()
+
+STAT_COUNTERS = (
+    "branches_active",
+    "branches_inactive",
+    "titles",
+    "total_copies",
+    "available_copies",
+    "holds_waiting",
+)
+
+
+def bump_stat_counters(session, deltas):
+    """
+    Add deltas ({name: n}) to the dashboard counters inside the caller's
+    transaction.
+    """
+    for name, delta in deltas.items():
+        if delta:
+            session.execute(
+                update(StatCounter)
+                .where(StatCounter.name == name)
+                .values(value=StatCounter.value + delta)
+            )
+
+
+def init_stat_counters():
+    """
+    Seed missing counters from the tables (first start on an existing DB,
+    or a counter added since); after that they are only ever adjusted
+    incrementally.
+    """
+    session = SessionLocal()
+    try:
+        present = set(session.execute(select(StatCounter.name)).scalars())
+        missing = [n for n in STAT_COUNTERS if n not in present]
+        if not missing:
+            return
+        copies = session.execute(
+            select(
+                func.coalesce(func.sum(BookAvailability.total_copies), 0),
+                func.coalesce(func.sum(BookAvailability.available_copies), 0),
+                func.coalesce(func.sum(BookAvailability.holds_waiting), 0),
+            )
+        ).one()
+        values = {
+            "branches_active": session.execute(
+                select(func.count()).select_from(Branch).where(Branch.is_active == True)  # noqa: E712
+            ).scalar_one(),
+            "branches_inactive": session.execute(
+                select(func.count()).select_from(Branch).where(Branch.is_active != True)  # noqa: E712
+            ).scalar_one(),
+            "titles": session.execute(select(func.count()).select_from(BookGlobal)).scalar_one(),
+            "total_copies": copies[0],
+            "available_copies": copies[1],
+            "holds_waiting": copies[2],
+        }
+        session.add_all(StatCounter(name=n, value=values[n]) for n in missing)
+        session.commit()
+    finally:
+        session.close()
+
+
+init_stat_counters()
+
+# Columnar copy of BookAvailability for the analytics endpoints, loaded once
+# and then kept current from apply_sync_batch
+availability_matrix = AvailabilityMatrix()
+
+
+def load_availability_matrix():
+    session = SessionLocal()
+    try:
+        availability_matrix.load(
+            session.execute(
+                select(
+                    BookAvailability.isbn,
+                    BookAvailability.branch_code,
+                    BookAvailability.total_copies,
+                    BookAvailability.available_copies,
+                )
+            )
+        )
+    finally:
+        session.close()
+
+
+load_availability_matrix()
+
+# Title/author prefix index for /api/global/suggest, loaded once and then
+# kept current from apply_sync_batch
+suggest_index = SuggestIndex(max_scan=app.config["SUGGEST_MAX_SCAN"])
+
+
+def load_suggest_index():
+    session = SessionLocal()
+    try:
+        suggest_index.load(
+            session.execute(
+                select(
+                    BookGlobal.id,
+                    BookGlobal.isbn,
+                    BookGlobal.title,
+                    BookGlobal.author,
+                )
+            )
+        )
+    finally:
+        session.close()
+
+
+load_suggest_index()
+
+# Append-only log of applied availability changes, written in batches by a
+# background thread (fed from apply_sync_batch) and compacted periodically
+availability_history = HistoryLog(
+    SessionLocal,
+    flush_rows=app.config["HISTORY_FLUSH_ROWS"],
+    flush_interval=app.config["HISTORY_FLUSH_SECONDS"],
+    max_buffer=app.config["HISTORY_BUFFER_MAX"],
+    raw_days=app.config["HISTORY_RAW_DAYS"],
+    compact_batch=app.config["HISTORY_COMPACT_BATCH"],
+)
+
+
+def seed_availability_history():
+    """
+    First start with history: log the current rows (as of their last sync)
+    so there is a starting point to answer queries from.
+    """
+    session = SessionLocal()
+    try:
+        if session.get(HistoryCompaction, 1) is not None:
+            return
+        av = BookAvailability
+        session.execute(
+            insert(AvailabilityLog.__table__).from_select(
+                [
+                    "isbn_key",
+                    "branch_code",
+                    "at",
+                    "total_copies",
+                    "available_copies",
+                    "holds_waiting",
+                    "version",
+                ],
+                select(
+                    av.isbn_key,
+                    av.branch_code,
+                    func.coalesce(av.last_sync_at, datetime.utcnow()),
+                    av.total_copies,
+                    av.available_copies,
+                    av.holds_waiting,
+                    av.version,
+                ).where(av.isbn_key.isnot(None)),
+            )
+        )
+        session.add(HistoryCompaction(id=1, last_log_id=0))
+        session.commit()
+    finally:
+        session.close()
+
+
+if app.config["HISTORY_ENABLED"]:
+    seed_availability_history()
+
+# Precomputed most-borrowed titles, served by /api/global/trending
+trending = TopK(app.config["TRENDING_TOP_K"])
+
+
+def _trending_entry(bg):
+    return {
+        "isbn": bg.isbn,
+        "title": bg.title,
+        "author": bg.author,
+        "popularity": bg.popularity or 0,
+    }
+
+
+def refresh_popularity():
+    """
+    Roll the popularity window forward: recompute every title's score from
+    the buckets still inside the window (one set-based UPDATE), drop older
+    buckets, and reload the top-K from the popularity index.
+    """
+    cutoff = date.today() - timedelta(days=app.config["POPULARITY_WINDOW_DAYS"])
+    stat = BorrowStat.__table__
+    window_sum = (
+        select(func.coalesce(func.sum(stat.c.count), 0))
+        .where((stat.c.isbn == BookGlobal.isbn) & (stat.c.bucket > cutoff))
+        .scalar_subquery()
+    )
+    with engine.begin() as conn:
+        conn.execute(update(BookGlobal).values(popularity=window_sum))
+        conn.execute(delete(BorrowStat).where(BorrowStat.bucket <= cutoff))
+
+    session = SessionLocal()
+    try:
+        top = session.execute(
+            select(BookGlobal)
+            .where(BookGlobal.popularity > 0)
+            .order_by(BookGlobal.popularity.desc())
+            .limit(app.config["TRENDING_TOP_K"])
+        ).scalars()
+        trending.replace([_trending_entry(bg) for bg in top])
+    finally:
+        session.close()
+
+
+refresh_popularity()
+
+# Patron tokens are verified in-process; the deny-list is loaded once here
+# and then kept current by /api/logout.
+token_verifier = TokenVerifier(
+    app.config["JWT_SECRET"],
+    app.config["JWT_ALGORITHM"],
+    cache_size=app.config["TOKEN_CACHE_SIZE"],
+)
+
+
+def _load_deny_list():
+    session = SessionLocal()
+    try:
+        rows = session.execute(
+            select(RevokedToken).where(RevokedToken.expires_at > datetime.utcnow())
+        ).scalars().all()
+        token_verifier.deny_list.replace(
+            [
+                {"jti": r.jti, "exp": r.expires_at.replace(tzinfo=timezone.utc).timestamp()}
+                for r in rows
+            ]
+        )
+    finally:
+        session.close()
+
+
+_load_deny_list()
+
+# ---------------------------------------------------------
+# Admission control (per traffic class budgets + load shedding)
+# ---------------------------------------------------------
+
+admission = AdmissionController(
+    {
+        "sync": (app.config["ADMISSION_SYNC_CONCURRENCY"], app.config["ADMISSION_SYNC_QUEUE"]),
+        "read": (app.config["ADMISSION_READ_CONCURRENCY"], app.config["ADMISSION_READ_QUEUE"]),
+        "write": (app.config["ADMISSION_WRITE_CONCURRENCY"], app.config["ADMISSION_WRITE_QUEUE"]),
+        "feed": (app.config["ADMISSION_FEED_CONCURRENCY"], 0),
+    },
+    queue_timeout_ms=app.config["ADMISSION_QUEUE_TIMEOUT_MS"],
+)
+
+
+def admission_exempt(func):
+    """
+    Skip admission control (health, metrics, static files).
+    """
+    func._admission_class = None
+    return func
+
+
+def feed_connection(func):
+    """
+    Change-feed endpoints: mostly idle connections that must not hold read
+    slots, capped by the "feed" class instead.
+    """
+    func._admission_class = "feed"
+    return func
+
+
+def _traffic_class():
+    view = app.view_functions.get(request.endpoint)
+    if view is None:
+        return None
+    if hasattr(view, "_admission_class"):
+        return view._admission_class
+    return "read" if request.method in ("GET", "HEAD") else "write"
+
+
+@app.before_request
+def admit_request():
+    if not app.config["ADMISSION_CONTROL"] or request.method == "OPTIONS":
+        return None
+    traffic_class = _traffic_class()
+    if traffic_class is None:
+        return None
+    try:
+        admission.acquire(traffic_class)
+    except Shed as e:
+        # sync callers get 429 so the branch outbox backs off; patrons 503
+        status = 429 if traffic_class == "sync" else 503
+        return (
+            jsonify({"error": "Central is busy, please retry shortly", "reason": e.reason}),
+            status,
+            {"Retry-After": str(app.config["ADMISSION_RETRY_AFTER_SECONDS"])},
+        )
+    g.admitted_class = traffic_class
+    return None
+
+
+@app.teardown_request
+def release_admission(exc):
+    traffic_class = g.pop("admitted_class", None)
+    if traffic_class is not None:
+        admission.release(traffic_class)
+
 
 # ---------------------------------------------------------
 # Frontend serving
@@ -38,15 +507,41 @@ Base.metadata.create_all(engine)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 FRONTEND_DIR = os.path.join(BASE_DIR, "frontend")
 
+# Read, fingerprinted and gzipped once; requests are served from memory
+assets = AssetStore(max_age=app.config["STATIC_MAX_AGE_SECONDS"]).build(FRONTEND_DIR)
+
+
+def _serve_asset(path):
+    asset = assets.get(path)
+    if asset is None:
+        abort(404)
+    headers = assets.headers(asset)
+    use_gzip = (
+        asset.gzip_body is not None and request.accept_encodings.quality("gzip") > 0
+    )
+    # each encoding is its own representation, so it gets its own ETag
+    etag = f"{asset.etag}-gz" if use_gzip else asset.etag
+    headers["ETag"] = f'"{etag}"'
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=headers)
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        body = asset.gzip_body
+    else:
+        body = asset.body
+    return Response(body, headers=headers, content_type=asset.content_type)
+
 
 @app.route("/")
+@admission_exempt
 def index():
-    return send_from_directory(FRONTEND_DIR, "index.html")
+    return _serve_asset("index.html")
 
 
 @app.route("/<path:path>")
+@admission_exempt
 def static_files(path):
-    return send_from_directory(FRONTEND_DIR, path)
+    return _serve_asset(path)
 
 
 # ---------------------------------------------------------
@@ -65,6 +560,62 @@ def require_api_key(func):
             abort(401, description="Invalid or missing service API key")
         return func(*args, **kwargs)
 
+    # service-to-service traffic gets its own admission budget
+    wrapper._admission_class = "sync"
+    return wrapper
+
+
+def _parse_time(value):
+    """
+    ISO-8601 time as naive UTC (the form stored everywhere), or None if
+    missing or unparseable.
+    """
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def read_session():
+    """
+    Session for read-only endpoints: the replica when it is fresh enough
+    and has caught up with the caller's X-Write-Token, else the primary.
+    """
+    return db_router.read_session(request.headers.get("X-Write-Token"))
+
+
+@app.after_request
+def add_write_token(response):
+    """
+    Successful writes return X-Write-Token; clients that send it back on
+    reads are guaranteed to see their own write (read-your-writes).
+    """
+    if request.method in ("POST", "PUT", "PATCH", "DELETE") and response.status_code < 400:
+        response.headers["X-Write-Token"] = str(now_ms())
+    return response
+
+
+def require_user_token(func):
+    """
+    Patron endpoints: verify the Bearer token locally (no DB lookup) and
+    expose its claims as g.user_claims.
+    """
+    from functools import wraps
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        token = bearer_token(request.headers.get("Authorization"))
+        try:
+            g.user_claims = token_verifier.verify(token)
+        except TokenError as e:
+            abort(401, description=str(e))
+        return func(*args, **kwargs)
+
     return wrapper
 
 
@@ -73,13 +624,47 @@ def require_api_key(func):
 # ---------------------------------------------------------
 
 @app.get("/api/health")
+@admission_exempt
 def health_check():
     return jsonify({"status": "ok", "service": "central_service"}), 200
 
+
+@app.get("/api/metrics")
+@admission_exempt
+def metrics():
+    """
+    Per-class admission queue depth / shed counts plus sync writer and
+    replica routing counters.
+    """
+    return jsonify(
+        {
+            "admission": admission.stats(),
+            "sync_writer": sync_writer.stats(),
+            "replica": {
+                "lag_seconds": db_router.lag_seconds(),
+                "replica_reads": db_router.replica_reads,
+                "primary_reads": db_router.primary_reads,
+            },
+            "reconcile": {
+                "runs": reconciler.runs,
+                "rows_repaired": reconciler.rows_repaired,
+            },
+            "availability_matrix": availability_matrix.stats(),
+            "suggest_index": suggest_index.stats(),
+            "static_assets": assets.stats(),
+            "http_client": http_client.stats(),
+            "history": availability_history.stats(),
+        }
+    )
+
+
 @app.post("/api/users")
 def create_user_central():
     """
-    Create or update a user in the central DB and fan out to all branches.
+    Create or update a user in the central DB.
+
+    Branches are not told: they pull the patron from central the first
+    time the patron borrows there.
 
     Request JSON:
       {
@@ -127,61 +712,110 @@ def create_user_central():
     finally:
         session.close()
 
-    # 2) Fan out to every registered branch
-    session = SessionLocal()
-    try:
-        branches = session.execute(select(Branch)).scalars().all()
-    finally:
-        session.close()
-
-    payload = {
-        "external_id": external_id,
-        "name": name,
-        "email": email,
-        "home_branch": home_branch,
-    }
-
-    branch_results = []
-    for b in branches:
-        try:
-            url = f"{b.base_url.rstrip('/')}/api/users"
-            resp = requests.post(url, json=payload, timeout=5)
-            branch_results.append(
-                {
-                    "branch_code": b.code,
-                    "status": resp.status_code,
-                    "ok": resp.ok,
-                }
-            )
-            logger.info(
-                "Synced user %s to %s -> %s",
-                external_id,
-                b.code,
-                resp.status_code,
-            )
-        except Exception as e:
-            logger.warning("Failed to sync user %s to %s: %s", external_id, b.code, e)
-            branch_results.append(
-                {
-                    "branch_code": b.code,
-                    "status": "error",
-                    "ok": False,
-                    "error": str(e),
-                }
-            )
-
     return (
         jsonify(
             {
                 "external_id": external_id,
                 "created": created,
-                "branches": branch_results,
             }
         ),
         201 if created else 200,
     )
 
 
+@app.post("/api/users/bulk")
+@require_api_key
+def import_users_bulk():
+    """
+    Bulk create/update patrons from a CSV (header: external_id,name,email,
+    home_branch) or NDJSON upload; pick with Content-Type text/csv or
+    ?format=csv, NDJSON is the default.
+
+    The body is parsed as it streams in and written USER_IMPORT_CHUNK rows
+    per transaction. Each committed chunk is pushed to the patrons' home
+    branches in batches; other branches pick patrons up on first use.
+
+    Response: {"summary": {...}, "branches": {code: {...}},
+               "results": [{"row", "external_id", "status", "error"?}, ...]}
+    """
+    fmt = request.args.get("format")
+    if not fmt:
+        fmt = "csv" if request.mimetype == "text/csv" else "ndjson"
+    if fmt not in ("csv", "ndjson"):
+        abort(400, description="format must be csv or ndjson")
+
+    session = SessionLocal()
+    try:
+        active = select(Branch).where(Branch.is_active.is_(True))
+        branch_urls = {
+            b.code: b.base_url.rstrip("/") for b in session.execute(active).scalars()
+        }
+    finally:
+        session.close()
+
+    batch_size = app.config["USER_IMPORT_BRANCH_BATCH"]
+    delivery = {}
+
+    def deliver(users):
+        by_branch = {}
+        for u in users:
+            if u["home_branch"] in branch_urls:
+                by_branch.setdefault(u["home_branch"], []).append(u)
+        for code, rows in by_branch.items():
+            stats = delivery.setdefault(code, {"sent": 0, "failed": 0})
+            for i in range(0, len(rows), batch_size):
+                batch = rows[i : i + batch_size]
+                try:
+                    # existing users are skipped by the branch, so a retry is safe
+                    resp = http_client.post(
+                        f"{branch_urls[code]}/api/users/bulk",
+                        json={"users": batch},
+                        headers={"X-API-Key": app.config["SERVICE_API_KEY"]},
+                        timeout=30,
+                        idempotent=True,
+                    )
+                    rejected = len(resp.json().get("errors", [])) if resp.ok else len(batch)
+                except Exception as e:
+                    logger.warning("Bulk user delivery to %s failed: %s", code, e)
+                    rejected = len(batch)
+                stats["sent"] += len(batch) - rejected
+                stats["failed"] += rejected
+
+    job = UserImport(SessionLocal, app.config["USER_IMPORT_CHUNK"], deliver)
+    for n, row, error in iter_rows(request.stream, fmt):
+        job.add(n, row, error)
+    report = job.finish()
+    report["branches"] = delivery
+    logger.info("Bulk user import: %s", report["summary"])
+    return jsonify(report)
+
+
+@app.get("/api/user_central/<path:external_id>")
+@require_api_key
+def get_user_central(external_id):
+    """
+    Patron record for branches provisioning a user on first visit. Read
+    from the primary: the patron may have registered a moment ago.
+    """
+    session = SessionLocal()
+    try:
+        user = session.execute(
+            select(UserCentral).where(UserCentral.external_id == external_id)
+        ).scalar_one_or_none()
+        if not user:
+            return jsonify({"error": "User not found"}), 404
+        return jsonify(
+            {
+                "external_id": user.external_id,
+                "name": user.name,
+                "email": user.email,
+                "home_branch": user.home_branch,
+            }
+        )
+    finally:
+        session.close()
+
+
 
 
 @app.post("/api/login")
@@ -190,7 +824,10 @@ def login_user():
     Simple login:
     - expects JSON: {"user_external_id": "..."}
     - checks UserCentral
-    - returns a demo "access_token" plus basic user info
+    - returns a signed "access_token" (JWT) plus basic user info
+
+    The token carries the external_id (sub) and home branch, so central and
+    the branches can authorize later calls without touching UserCentral.
     """
     data = request.get_json(force=True)
     external_id = data.get("user_external_id")
@@ -217,13 +854,19 @@ def login_user():
                 }
             ), 404
 
-        # For the demo, the token is just a string derived from the ID.
-        # (If you want real JWTs later, we can wire that up.)
-        token = f"demo-{external_id}"
+        token, claims = issue_token(
+            user.external_id,
+            user.home_branch,
+            app.config["JWT_SECRET"],
+            app.config["JWT_ALGORITHM"],
+            app.config["JWT_EXP_MINUTES"],
+        )
 
         return jsonify(
             {
                 "access_token": token,
+                "token_type": "Bearer",
+                "expires_at": claims["exp"],
                 "user": {
                     "external_id": user.external_id,
                     "name": user.name,
@@ -235,7 +878,93 @@ def login_user():
         session.close()
 
 
+@app.post("/api/logout")
+@require_user_token
+def logout_user():
+    """
+    Revoke the caller's token. Only the jti and expiry are stored, and the
+    row becomes irrelevant once the token would have expired anyway.
+    """
+    claims = g.user_claims
+    session = SessionLocal()
+    try:
+        # Drop deny-list rows that have outlived their tokens
+        session.execute(
+            delete(RevokedToken).where(RevokedToken.expires_at <= datetime.utcnow())
+        )
+        session.add(
+            RevokedToken(
+                jti=claims["jti"],
+                expires_at=datetime.utcfromtimestamp(claims["exp"]),
+                revoked_at=datetime.utcnow(),
+            )
+        )
+        session.commit()
+    finally:
+        session.close()
+
+    token_verifier.revoke(claims)
+    token_verifier.deny_list.prune()
+    logger.info("Revoked token %s for user %s", claims["jti"], claims["sub"])
+    return jsonify({"message": "logged out"}), 200
+
+
+@app.get("/api/tokens/revoked")
+@require_api_key
+def list_revoked_tokens():
+    """
+    Branches poll this to keep their in-memory deny-list current.
+    """
+    token_verifier.deny_list.prune()
+    return jsonify(token_verifier.deny_list.entries())
+
+
+@app.post("/api/borrow")
+@require_user_token
+def borrow_for_user():
+    """
+    Patron-facing borrow: the user comes from the verified token, the loan
+    is placed at the chosen branch (which re-verifies the same token).
+
+    Request JSON: {"isbn": "...", "branch_code": "...", "days": 14}
+    """
+    data = request.get_json(force=True)
+    isbn = data.get("isbn")
+    branch_code = data.get("branch_code")
+    if not isbn or not branch_code:
+        abort(400, description="isbn, branch_code required")
+
+    session = SessionLocal()
+    try:
+        branch = session.execute(
+            select(Branch).where(Branch.code == branch_code)
+        ).scalar_one_or_none()
+        if not branch:
+            return jsonify({"error": "Unknown branch"}), 404
+        base_url = branch.base_url
+    finally:
+        session.close()
+
+    payload = {"isbn": isbn, "user_external_id": g.user_claims["sub"]}
+    if data.get("days") is not None:
+        payload["days"] = data["days"]
+
+    try:
+        resp = http_client.post(
+            f"{base_url.rstrip('/')}/api/loans",
+            json=payload,
+            headers={"Authorization": request.headers.get("Authorization")},
+            timeout=5,
+        )
+    except Exception as e:
+        logger.warning("Borrow at %s failed: %s", branch_code, e)
+        return jsonify({"error": "That branch is not reachable right now."}), 502
 
+    try:
+        body = resp.json()
+    except ValueError:
+        body = {"error": resp.text}
+    return jsonify(body), resp.status_code
 
 
 # ---------------------------------------------------------
@@ -257,6 +986,8 @@ def register_branch():
         q = select(Branch).where(Branch.code == code)
         existing = session.execute(q).scalar_one_or_none()
         if existing:
+            if not existing.is_active:
+                bump_stat_counters(session, {"branches_active": 1, "branches_inactive": -1})
             existing.name = name
             existing.base_url = base_url
             existing.is_active = True
@@ -270,6 +1001,7 @@ def register_branch():
                 created_at=datetime.utcnow(),
             )
             session.add(b)
+            bump_stat_counters(session, {"branches_active": 1})
             logger.info("Registered new branch %s", code)
 
         session.commit()
@@ -280,7 +1012,7 @@ def register_branch():
 
 @app.get("/api/branches")
 def list_branches():
-    session = SessionLocal()
+    session = read_session()
     try:
         branches = session.execute(select(Branch)).scalars().all()
         return jsonify(
@@ -302,13 +1034,322 @@ def list_branches():
 # Sync availability FROM branches
 # ---------------------------------------------------------
 
-@app.post("/api/global/sync/availability")
-@require_api_key
-def sync_availability():
+def _sync_key(event):
+    return (event["isbn_key"], event["branch_code"])
+
+
+def _sync_newer(a, b):
     """
-    Branches call this whenever availability changes.
+    Within a batch, the higher branch version wins. Events without a
+    version (older branches) fall back to arrival order.
     """
-    data = request.get_json(force=True)
+    if a["version"] is None or b["version"] is None:
+        return True
+    return a["version"] >= b["version"]
+
+
+def _sync_merge(kept, dropped):
+    """
+    Coalescing keeps the newest event per key; borrow counts of the event
+    it replaces must survive (max per day, as counts are absolute).
+    """
+    if not dropped.get("borrows"):
+        return kept
+    borrows = dict(kept.get("borrows") or {})
+    for day, count in dropped["borrows"].items():
+        borrows[day] = max(count, borrows.get(day, 0))
+    return dict(kept, borrows=borrows)
+
+
+def _apply_borrow_counts(session, events, globals_by_key):
+    """
+    Merge the per-day borrow counts carried by sync events into BorrowStat
+    and bump BookGlobal.popularity by the increase. Counts are absolute, so
+    a replayed or stale event can only ever raise a bucket to its max.
+    Returns the BookGlobal rows whose popularity changed.
+    """
+    cutoff = date.today() - timedelta(days=app.config["POPULARITY_WINDOW_DAYS"])
+    reported = {}
+    for e in events:
+        bg = globals_by_key.get(e["isbn_key"])
+        if bg is None:
+            continue
+        for day, count in (e.get("borrows") or {}).items():
+            bucket = date.fromisoformat(day)
+            key = (bg.isbn, e["branch_code"], bucket)
+            reported[key] = max(int(count), reported.get(key, 0))
+    if not reported:
+        return []
+    by_isbn = {bg.isbn: bg for bg in globals_by_key.values()}
+
+    existing = {
+        (s.isbn, s.branch_code, s.bucket): s
+        for s in session.execute(
+            select(BorrowStat).where(
+                BorrowStat.isbn.in_({k[0] for k in reported})
+                & BorrowStat.bucket.in_({k[2] for k in reported})
+            )
+        ).scalars()
+    }
+
+    changed = []
+    for (isbn, branch_code, bucket), count in reported.items():
+        stat = existing.get((isbn, branch_code, bucket))
+        if stat is None:
+            stat = BorrowStat(isbn=isbn, branch_code=branch_code, bucket=bucket, count=0)
+            session.add(stat)
+        delta = count - stat.count
+        if delta <= 0:
+            continue
+        stat.count = count
+        bg = by_isbn[isbn]
+        if bucket > cutoff:
+            bg.popularity = (bg.popularity or 0) + delta
+            if bg not in changed:
+                changed.append(bg)
+    return changed
+
+
+def _history_row(data, now, total, available, holds):
+    # the branch's own time of the change; repairs and deletions carry
+    # none, and a branch clock ahead of ours is capped at now
+    at = data.get("timestamp") or now
+    return {
+        "isbn_key": data["isbn_key"],
+        "branch_code": data["branch_code"],
+        "at": min(at, now),
+        "total_copies": total,
+        "available_copies": available,
+        "holds_waiting": holds,
+        "version": data.get("version"),
+    }
+
+
+def apply_sync_batch(events):
+    """
+    Apply availability events in ONE transaction. Callers must pass at most
+    one event per (isbn_key, branch_code); the group-commit writer already
+    reduces each batch to the newest write per key.
+
+    An event is only applied if its branch version is newer than the one
+    stored, so retried or reordered events can never roll a row back.
+    Reconciliation repairs ("repair") also apply at the same version, and
+    "deleted" ones remove the row.
+    Rows are matched on the canonical isbn_key; a title keeps the display
+    ISBN it was first reported with, whatever spelling later events use.
+    Returns {(isbn_key, branch_code): stored version} after the batch.
+    """
+    now = datetime.utcnow()
+    keys = {e["isbn_key"] for e in events}
+    results = {}
+    changes = []
+    history_rows = []
+    renamed = []
+    counter_deltas = {"titles": 0, "total_copies": 0, "available_copies": 0, "holds_waiting": 0}
+
+    session = SessionLocal()
+    try:
+        # Load every row this batch touches with two IN queries
+        globals_by_key = {
+            bg.isbn_key: bg
+            for bg in session.execute(
+                select(BookGlobal).where(BookGlobal.isbn_key.in_(keys))
+            ).scalars()
+        }
+        avail_by_key = {
+            (av.isbn_key, av.branch_code): av
+            for av in session.execute(
+                select(BookAvailability).where(BookAvailability.isbn_key.in_(keys))
+            ).scalars()
+        }
+
+        for data in events:
+            isbn = data["isbn"]
+            version = data.get("version")
+            av = avail_by_key.get(_sync_key(data))
+
+            if data.get("deleted") and av is None:
+                results[_sync_key(data)] = None
+                continue
+            stored = (av.version or 0) if av else 0
+            if av and version is not None and (
+                version < stored if data.get("repair") else version <= stored
+            ):
+                logger.info(
+                    "SYNC STALE isbn=%s branch=%s version=%s (have %s)",
+                    isbn,
+                    data["branch_code"],
+                    version,
+                    av.version,
+                )
+                results[_sync_key(data)] = av.version
+                continue
+
+            if data.get("deleted"):
+                # The branch no longer has this title at all
+                bg = globals_by_key.get(data["isbn_key"])
+                counter_deltas["available_copies"] -= av.available_copies
+                counter_deltas["total_copies"] -= av.total_copies
+                counter_deltas["holds_waiting"] -= av.holds_waiting or 0
+                if bg is not None:
+                    bg.available_total = (bg.available_total or 0) - av.available_copies
+                    bg.branch_count = (bg.branch_count or 0) - int(av.total_copies > 0)
+                session.delete(av)
+                del avail_by_key[_sync_key(data)]
+                results[_sync_key(data)] = None
+                changes.append(
+                    {
+                        "isbn": av.isbn,
+                        "branch_code": data["branch_code"],
+                        "available_copies": 0,
+                        "total_copies": 0,
+                        "removed": True,
+                    }
+                )
+                history_rows.append(_history_row(data, now, 0, 0, 0))
+                continue
+
+            # Upsert BookGlobal (we keep minimal metadata here)
+            bg = globals_by_key.get(data["isbn_key"])
+            if not bg:
+                bg = BookGlobal(
+                    isbn=isbn,
+                    isbn_key=data["isbn_key"],
+                    title=data.get("title") or isbn,
+                    author=data.get("author"),
+                    publisher=data.get("publisher"),
+                    year=data.get("year"),
+                    created_at=now,
+                    available_total=0,
+                    branch_count=0,
+                    popularity=0,
+                )
+                session.add(bg)
+                globals_by_key[data["isbn_key"]] = bg
+                counter_deltas["titles"] += 1
+                renamed.append(bg)
+            else:
+                # If new metadata arrives, update it (useful when first sync
+                # had only ISBN, later ones include title/author).
+                if data.get("title") and data["title"] != bg.title:
+                    bg.title = data["title"]
+                    renamed.append(bg)
+                if data.get("author") and data["author"] != bg.author:
+                    bg.author = data["author"]
+                    renamed.append(bg)
+                if data.get("publisher"):
+                    bg.publisher = data["publisher"]
+                if data.get("year") is not None:
+                    bg.year = data["year"]
+
+            # Keep the per-title summary and global counters in step with
+            # this row's change
+            old_available = av.available_copies if av else 0
+            old_total = av.total_copies if av else 0
+            old_holding = bool(av and av.total_copies > 0)
+            old_holds = (av.holds_waiting or 0) if av else 0
+            # branches that predate holds do not send the field
+            holds = data["holds_waiting"] if data.get("holds_waiting") is not None else old_holds
+            counter_deltas["holds_waiting"] += holds - old_holds
+            counter_deltas["available_copies"] += data["available_copies"] - old_available
+            counter_deltas["total_copies"] += data["total_copies"] - old_total
+            bg.available_total = (
+                (bg.available_total or 0) + data["available_copies"] - old_available
+            )
+            bg.branch_count = (
+                (bg.branch_count or 0) + int(data["total_copies"] > 0) - int(old_holding)
+            )
+
+            # Upsert BookAvailability per branch
+            if av:
+                av.total_copies = data["total_copies"]
+                av.available_copies = data["available_copies"]
+                av.holds_waiting = holds
+                av.last_sync_at = now
+                if version is not None:
+                    av.version = version
+            else:
+                av = BookAvailability(
+                    isbn=bg.isbn,
+                    isbn_key=data["isbn_key"],
+                    branch_code=data["branch_code"],
+                    total_copies=data["total_copies"],
+                    available_copies=data["available_copies"],
+                    holds_waiting=holds,
+                    version=version or 0,
+                    last_sync_at=now,
+                )
+                session.add(av)
+                avail_by_key[_sync_key(data)] = av
+            results[_sync_key(data)] = av.version
+            changes.append(
+                {
+                    "isbn": bg.isbn,
+                    "branch_code": data["branch_code"],
+                    "available_copies": data["available_copies"],
+                    "total_copies": data["total_copies"],
+                }
+            )
+            history_rows.append(
+                _history_row(data, now, data["total_copies"], data["available_copies"], holds)
+            )
+
+        popular = _apply_borrow_counts(session, events, globals_by_key)
+        bump_stat_counters(session, counter_deltas)
+
+        # flush first so new titles have ids; read them before commit
+        # expires the objects
+        session.flush()
+        suggest_rows = {bg.id: (bg.isbn, bg.title, bg.author) for bg in renamed}
+
+        session.commit()
+        change_feed.publish(changes)
+        availability_matrix.apply(changes)
+        if app.config["HISTORY_ENABLED"]:
+            availability_history.append(history_rows)
+        for doc_id, row in suggest_rows.items():
+            suggest_index.upsert(doc_id, *row)
+        for bg in popular:
+            trending.offer(_trending_entry(bg))
+        return results
+    finally:
+        session.close()
+
+
+sync_writer = GroupCommitWriter(
+    apply_sync_batch,
+    _sync_key,
+    newer=_sync_newer,
+    merge=_sync_merge,
+    max_queue=app.config["SYNC_QUEUE_SIZE"],
+    max_batch=app.config["SYNC_BATCH_MAX"],
+    batch_window_ms=app.config["SYNC_BATCH_WINDOW_MS"],
+    max_wait_ms=app.config["SYNC_MAX_WAIT_MS"],
+)
+
+
+def _parse_borrows(value):
+    """
+    {"YYYY-MM-DD": count} as sent by branches, normalized. Anything else is
+    a 400 here; on the writer thread it would fail the whole batch.
+    """
+    if value is None:
+        return None
+    if not isinstance(value, dict):
+        abort(400, description="borrows must be an object of ISO date -> count")
+    borrows = {}
+    for day, count in value.items():
+        try:
+            day = date.fromisoformat(str(day)).isoformat()
+        except ValueError:
+            abort(400, description=f"borrows: invalid date {day!r}")
+        if isinstance(count, bool) or not isinstance(count, int) or count < 0:
+            abort(400, description=f"borrows: count for {day} must be a non-negative integer")
+        borrows[day] = count
+    return borrows
+
+
+def _parse_sync_event(data):
     isbn = data.get("isbn")
     branch_code = data.get("branch_code")
     total = data.get("total_copies")
@@ -316,6 +1357,10 @@ def sync_availability():
 
     if not isbn or not branch_code or total is None or available is None:
         abort(400, description="isbn, branch_code, total_copies, available_copies required")
+    try:
+        key = isbn_key(isbn)
+    except InvalidIsbn as e:
+        abort(400, description=str(e))
 
     logger.info(
         "SYNC RECEIVED isbn=%s branch=%s total=%s avail=%s",
@@ -325,58 +1370,495 @@ def sync_availability():
         available,
     )
 
-    session = SessionLocal()
-    try:
-        # Upsert BookGlobal (we keep minimal metadata here)
-        q_bg = select(BookGlobal).where(BookGlobal.isbn == isbn)
-        bg = session.execute(q_bg).scalar_one_or_none()
-        if not bg:
-            bg = BookGlobal(
-                isbn=isbn,
-                title=data.get("title") or isbn,
-                author=data.get("author"),
-                publisher=data.get("publisher"),
-                year=data.get("year"),
-                created_at=datetime.utcnow(),
-            )
-            session.add(bg)
+    return {
+        "isbn": isbn,
+        "isbn_key": key,
+        "branch_code": branch_code,
+        "total_copies": int(total),
+        "available_copies": int(available),
+        "holds_waiting": int(data["holds_waiting"]) if data.get("holds_waiting") is not None else None,
+        "version": int(data["version"]) if data.get("version") is not None else None,
+        "timestamp": _parse_time(data.get("timestamp")),
+        "title": data.get("title"),
+        "author": data.get("author"),
+        "publisher": data.get("publisher"),
+        "year": data.get("year"),
+        "borrows": _parse_borrows(data.get("borrows")),
+    }
+
+
+def _store_sync_events(events):
+    """
+    Apply events (through the group-commit writer when enabled) and return
+    the stored version for each. Raises WriterBusy.
+    """
+    if app.config["SYNC_GROUP_COMMIT"]:
+        return sync_writer.submit_many(events)
+
+    latest = {}
+    for e in events:
+        current = latest.get(_sync_key(e))
+        if current is None:
+            latest[_sync_key(e)] = e
+        elif _sync_newer(e, current):
+            latest[_sync_key(e)] = _sync_merge(e, current)
         else:
-            # If new metadata arrives, update it (useful when first sync
-            # had only ISBN, later ones include title/author).
-            if data.get("title"):
-                bg.title = data["title"]
-            if data.get("author"):
-                bg.author = data["author"]
-            if data.get("publisher"):
-                bg.publisher = data["publisher"]
-            if data.get("year") is not None:
-                bg.year = data["year"]
-
-        # Upsert BookAvailability per branch
-        q_av = select(BookAvailability).where(
-            (BookAvailability.isbn == isbn)
-            & (BookAvailability.branch_code == branch_code)
+            latest[_sync_key(e)] = _sync_merge(current, e)
+    stored = apply_sync_batch(list(latest.values()))
+    return [stored.get(_sync_key(e)) for e in events]
+
+
+def _sync_result(event, stored_version):
+    # A stale event is still a success for the branch: central already
+    # holds something newer, so the outbox entry can be dropped.
+    applied = event["version"] is None or event["version"] == stored_version
+    return {"isbn": event["isbn"], "applied": applied, "version": stored_version}
+
+
+@app.post("/api/global/sync/availability")
+@require_api_key
+def sync_availability():
+    """
+    Branches call this whenever availability changes. Each event carries
+    the branch's sync "version"; events are idempotent and can arrive in
+    any order, only the newest version per (isbn, branch) is kept.
+
+    With SYNC_GROUP_COMMIT on, the event is queued for the group-commit
+    writer and we only answer 200 once its batch is committed. If that
+    takes longer than SYNC_MAX_WAIT_MS (or the queue is full) we answer
+    503 so the branch keeps the event in its outbox and retries.
+    """
+    event = _parse_sync_event(request.get_json(force=True))
+
+    try:
+        [stored_version] = _store_sync_events([event])
+    except WriterBusy as e:
+        logger.warning(
+            "SYNC DEFERRED isbn=%s branch=%s: %s", event["isbn"], event["branch_code"], e
+        )
+        return jsonify({"error": "Central is busy, retry later"}), 503, {"Retry-After": "1"}
+
+    result = _sync_result(event, stored_version)
+    return jsonify({"message": "synced", "applied": result["applied"], "version": stored_version}), 200
+
+
+@app.post("/api/global/sync/availability/batch")
+@require_api_key
+def sync_availability_batch():
+    """
+    Several availability events in one call (e.g. a multi-item checkout).
+
+    Request JSON: {"events": [<same fields as sync_availability>, ...]}
+    All events are committed before we answer 200; on 503 the branch keeps
+    the whole batch and retries (events are versioned, so that is safe).
+    """
+    data = request.get_json(force=True)
+    raw_events = data.get("events")
+    if not isinstance(raw_events, list) or not raw_events:
+        abort(400, description="events must be a non-empty list")
+    events = [_parse_sync_event(e) for e in raw_events]
+
+    try:
+        stored_versions = _store_sync_events(events)
+    except WriterBusy as e:
+        logger.warning("SYNC BATCH DEFERRED (%d events): %s", len(events), e)
+        return jsonify({"error": "Central is busy, retry later"}), 503, {"Retry-After": "1"}
+
+    return jsonify(
+        {
+            "message": "synced",
+            "results": [_sync_result(e, v) for e, v in zip(events, stored_versions)],
+        }
+    ), 200
+
+
+# ---------------------------------------------------------
+# Availability analytics (in-memory matrix)
+# ---------------------------------------------------------
+
+def _titles_for(isbns):
+    if not isbns:
+        return {}
+    session = read_session()
+    try:
+        return dict(
+            session.execute(
+                select(BookGlobal.isbn, BookGlobal.title).where(BookGlobal.isbn.in_(isbns))
+            ).all()
         )
-        av = session.execute(q_av).scalar_one_or_none()
-        if av:
-            av.total_copies = int(total)
-            av.available_copies = int(available)
-            av.last_sync_at = datetime.utcnow()
+    finally:
+        session.close()
+
+
+@app.get("/api/global/analytics/shortages")
+def analytics_shortages():
+    """
+    Titles with no copy on the shelf at some branch while other branches
+    have at least ?min_surplus= (default 2) available.
+    """
+    min_surplus = max(1, request.args.get("min_surplus", 2, type=int))
+    limit = min(max(request.args.get("limit", 100, type=int), 1), 1000)
+    items, more = availability_matrix.shortages(min_surplus, limit)
+    titles = _titles_for([it["isbn"] for it in items])
+    for it in items:
+        it["title"] = titles.get(it["isbn"])
+    return jsonify({"items": items, "more": more})
+
+
+@app.get("/api/global/analytics/transfers")
+def analytics_transfers():
+    """
+    Suggested one-copy moves that fill empty shelves, never leaving a donor
+    branch with fewer than ?keep= (default 1) copies available.
+    """
+    keep = max(0, request.args.get("keep", 1, type=int))
+    limit = min(max(request.args.get("limit", 100, type=int), 1), 1000)
+    suggestions = availability_matrix.transfers(keep, limit)
+    titles = _titles_for(list({s["isbn"] for s in suggestions}))
+    for s in suggestions:
+        s["title"] = titles.get(s["isbn"])
+    return jsonify(suggestions)
+
+
+@app.get("/api/global/analytics/utilization")
+def analytics_utilization():
+    """
+    Per-branch copies held / on loan and the share of copies on loan.
+    """
+    return jsonify(availability_matrix.utilization())
+
+
+# ---------------------------------------------------------
+# Availability history
+# ---------------------------------------------------------
+
+def _history_args():
+    isbn = request.args.get("isbn")
+    key = try_isbn_key(isbn) if isbn else None
+    if key is None:
+        abort(400, description="valid isbn required")
+    return isbn, key
+
+
+@app.get("/api/global/history/availability")
+def availability_at():
+    """
+    Availability of ?isbn= at each branch (or only ?branch_code=) as of
+    ?at= (ISO time, default now). Times inside the raw window
+    (HISTORY_RAW_DAYS) are exact ("resolution": "event"); older ones give
+    the state at the start of that day ("day").
+    """
+    isbn, key = _history_args()
+    at = _parse_time(request.args.get("at")) if request.args.get("at") else datetime.utcnow()
+    if at is None:
+        abort(400, description="at must be an ISO-8601 time")
+    branch_code = request.args.get("branch_code")
+
+    session = read_session()
+    try:
+        if branch_code:
+            codes = [branch_code]
         else:
-            av = BookAvailability(
-                isbn=isbn,
-                branch_code=branch_code,
-                total_copies=int(total),
-                available_copies=int(available),
-                last_sync_at=datetime.utcnow(),
+            codes = session.execute(select(Branch.code).order_by(Branch.code)).scalars().all()
+        horizon = raw_horizon(session)
+        branches = []
+        for code in codes:
+            state = state_at(session, key, code, at, horizon)
+            if state is not None:
+                branches.append({"branch_code": code, **state})
+    finally:
+        session.close()
+    return jsonify({"isbn": isbn, "at": at.isoformat(), "branches": branches})
+
+
+@app.get("/api/global/history/availability/range")
+def availability_range():
+    """
+    How availability of ?isbn= at ?branch_code= moved between ?from= and
+    ?to= (ISO times; to defaults to now): the state at "from", then every
+    change inside the raw window and one row per day before it (closing
+    counts, low/high, number of changes). ?resolution=day returns daily
+    rows for the whole range, e.g. for utilization over months.
+    """
+    isbn, key = _history_args()
+    branch_code = request.args.get("branch_code")
+    start = _parse_time(request.args.get("from"))
+    end = _parse_time(request.args.get("to")) if request.args.get("to") else datetime.utcnow()
+    if not branch_code or start is None or end is None or start >= end:
+        abort(400, description="branch_code and a from/to range (ISO times, from < to) required")
+    daily_only = request.args.get("resolution") == "day"
+
+    session = read_session()
+    try:
+        horizon = raw_horizon(session)
+        initial = state_at(session, key, branch_code, start, horizon)
+        days, events = changes_between(session, key, branch_code, start, end, horizon, daily_only)
+    finally:
+        session.close()
+
+    lows = [d["min_available"] for d in days] + [e["available_copies"] for e in events]
+    highs = [d["max_available"] for d in days] + [e["available_copies"] for e in events]
+    if initial is not None:
+        lows.append(initial["available_copies"])
+        highs.append(initial["available_copies"])
+    return jsonify(
+        {
+            "isbn": isbn,
+            "branch_code": branch_code,
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "start": initial,
+            "days": days,
+            "changes": events,
+            "min_available": min(lows) if lows else None,
+            "max_available": max(highs) if highs else None,
+        }
+    )
+
+
+@app.post("/api/global/history/compact")
+@require_api_key
+def compact_history():
+    folded, pruned = availability_history.compact()
+    return jsonify({"folded": folded, "pruned": pruned}), 200
+
+
+# ---------------------------------------------------------
+# Reconciliation with branch snapshots
+# ---------------------------------------------------------
+
+reconciler = Reconciler(
+    SessionLocal,
+    _store_sync_events,
+    app.config["SERVICE_API_KEY"],
+    http_client,
+    concurrency=app.config["RECONCILE_CONCURRENCY"],
+    batch_size=app.config["RECONCILE_BATCH"],
+    pause_ms=app.config["RECONCILE_PAUSE_MS"],
+)
+
+
+@app.get("/api/global/reconcile")
+def reconcile_status():
+    """
+    Drift statistics: totals plus the per-branch report of the last pass.
+    """
+    return jsonify(reconciler.stats())
+
+
+@app.post("/api/global/reconcile")
+@require_api_key
+def reconcile_now():
+    """
+    Run a reconciliation pass right away and return its report.
+    """
+    report = reconciler.run()
+    if report is None:
+        return jsonify({"error": "A reconciliation pass is already running"}), 409
+    return jsonify(report)
+
+
+# ---------------------------------------------------------
+# Overdue loans across branches
+# ---------------------------------------------------------
+
+@app.get("/api/global/overdue")
+def global_overdue():
+    """
+    Sum of each active branch's overdue count. Branches answer from their
+    (status, due_at) index, so no loan history crosses the network.
+    """
+    session = read_session()
+    try:
+        branches = session.execute(
+            select(Branch).where(Branch.is_active == True)  # noqa: E712
+        ).scalars().all()
+    finally:
+        session.close()
+
+    per_branch = []
+    total = 0
+    for b in branches:
+        try:
+            resp = http_client.get(
+                f"{b.base_url.rstrip('/')}/api/loans/overdue",
+                params={"count_only": "1"},
+                headers={"X-API-Key": app.config["SERVICE_API_KEY"]},
             )
-            session.add(av)
+            count = resp.json()["overdue"] if resp.ok else None
+        except Exception as e:
+            logger.warning("Overdue count from %s failed: %s", b.code, e)
+            count = None
+        per_branch.append({"branch_code": b.code, "overdue": count})
+        total += count or 0
 
-        session.commit()
-        return jsonify({"message": "synced"}), 200
+    return jsonify({"total_overdue": total, "branches": per_branch})
+
+
+# ---------------------------------------------------------
+# Availability change feed (live catalog)
+# ---------------------------------------------------------
+
+@app.get("/api/global/changes")
+@feed_connection
+def availability_changes():
+    """
+    Availability deltas since a cursor (poll or long-poll).
+    - ?cursor=...  cursor from a previous call or the X-Change-Cursor header
+                   of /api/global/books
+    - ?wait=N      hold the request up to N seconds until something changes
+
+    Response: {"cursor": ..., "reset": bool, "changes": [...]}
+    reset=true means the cursor is unknown/too old: reload the catalog.
+    """
+    cursor = request.args.get("cursor")
+    wait = min(
+        max(request.args.get("wait", 0, type=float), 0.0),
+        app.config["CHANGE_FEED_MAX_WAIT_SECONDS"],
+    )
+
+    changes, next_cursor, reset = change_feed.since(cursor)
+    if not changes and not reset and wait > 0:
+        change_feed.wait(cursor, wait)
+        changes, next_cursor, reset = change_feed.since(cursor)
+
+    return jsonify({"cursor": next_cursor, "reset": reset, "changes": changes})
+
+
+@app.get("/api/global/changes/stream")
+@feed_connection
+def availability_change_stream():
+    """
+    Same feed as /api/global/changes as Server-Sent Events. The cursor comes
+    from ?cursor= or, on reconnect, from the Last-Event-ID header.
+    """
+    cursor = request.headers.get("Last-Event-ID") or request.args.get("cursor")
+    heartbeat = app.config["CHANGE_FEED_MAX_WAIT_SECONDS"]
+    # the request context ends before the body is streamed, so the feed
+    # slot is handed to the stream and released when the client goes away
+    traffic_class = g.pop("admitted_class", None)
+
+    def stream(cursor):
+        while True:
+            changes, cursor, reset = change_feed.since(cursor)
+            if reset:
+                yield f"id: {cursor}\nevent: reset\ndata: {{}}\n\n"
+            elif changes:
+                yield f"id: {cursor}\nevent: availability\ndata: {json.dumps(changes)}\n\n"
+            else:
+                # comment line keeps proxies from closing an idle stream
+                yield ": keepalive\n\n"
+                change_feed.wait(cursor, heartbeat)
+
+    response = Response(
+        stream(cursor),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    if traffic_class is not None:
+        response.call_on_close(lambda: admission.release(traffic_class))
+    return response
+
+
+@app.get("/api/global/availability")
+@require_api_key
+def availability_snapshot_all():
+    """
+    Compact dump of every BookAvailability row for branches bootstrapping
+    their local replica: {"cursor": ..., "rows": [[isbn, branch_code,
+    total_copies, available_copies], ...]}. Continue from "cursor" with
+    /api/global/changes.
+    """
+    session = read_session()
+    if "replica_beat_ms" in session.info:
+        cursor = change_feed.cursor_at(session.info["replica_beat_ms"])
+    else:
+        cursor = change_feed.cursor()
+    try:
+        rows = session.execute(
+            select(
+                BookAvailability.isbn,
+                BookAvailability.branch_code,
+                BookAvailability.total_copies,
+                BookAvailability.available_copies,
+            )
+        ).all()
+        return jsonify({"cursor": cursor, "rows": [list(r) for r in rows]})
+    finally:
+        session.close()
+
+
+# ---------------------------------------------------------
+# Dashboard statistics
+# ---------------------------------------------------------
+
+@app.get("/api/global/stats")
+def global_stats():
+    """
+    Dashboard numbers from the incrementally maintained counters; cost does
+    not depend on catalog size. active_loans = copies currently out.
+    """
+    session = read_session()
+    try:
+        values = dict(session.execute(select(StatCounter.name, StatCounter.value)).all())
     finally:
         session.close()
 
+    total = values.get("total_copies", 0)
+    available = values.get("available_copies", 0)
+    return jsonify(
+        {
+            "branches": {
+                "total": values.get("branches_active", 0) + values.get("branches_inactive", 0),
+                "active": values.get("branches_active", 0),
+                "inactive": values.get("branches_inactive", 0),
+            },
+            "titles": values.get("titles", 0),
+            "total_copies": total,
+            "available_copies": available,
+            "active_loans": total - available,
+            "holds_waiting": values.get("holds_waiting", 0),
+        }
+    )
+
+
+# ---------------------------------------------------------
+# Trending titles
+# ---------------------------------------------------------
+
+@app.get("/api/global/trending")
+def trending_titles():
+    """
+    Most borrowed titles in the rolling window (POPULARITY_WINDOW_DAYS),
+    served from the in-memory top-K. ?limit= caps the list.
+    """
+    limit = request.args.get("limit", type=int)
+    return jsonify(
+        {
+            "window_days": app.config["POPULARITY_WINDOW_DAYS"],
+            "titles": trending.top(limit),
+        }
+    )
+
+
+# ---------------------------------------------------------
+# Typeahead
+# ---------------------------------------------------------
+
+@app.get("/api/global/suggest")
+def suggest_titles():
+    """
+    Title suggestions while the patron types, from the in-memory prefix
+    index (no database access). ?prefix= is matched against the start of
+    titles and of title/author words; ?limit= caps the list (default
+    SUGGEST_LIMIT). Returns ISBN and title only; use /api/global/books for
+    full records.
+    """
+    prefix = request.args.get("prefix", "")
+    limit = request.args.get("limit", type=int) or app.config["SUGGEST_LIMIT"]
+    limit = min(limit, app.config["SUGGEST_MAX_LIMIT"])
+    return jsonify({"prefix": prefix, "titles": suggest_index.suggest(prefix, limit)})
+
 
 # ---------------------------------------------------------
 # Global catalog search
@@ -386,59 +1868,170 @@ def sync_availability():
 def global_search():
     """
     Search across BookGlobal and join availability.
-    - ?query=...  matches title/author/isbn (case-insensitive)
-    - ?isbn=...   exact ISBN match
-    - no params   returns all titles
+    - ?query=...            matches title/author/isbn (case-insensitive);
+                            a valid ISBN also matches its other spellings
+    - ?isbn=...             exact ISBN match, any ISBN-10/13 spelling
+    - ?available=1          only titles with a copy available somewhere
+                            (at ?branch= if given)
+    - ?branch=CODE          only titles held by that branch
+    - ?year_from=&year_to=  publication year range (inclusive)
+    - ?sort=KEY             title | year | available | branches | popularity,
+                            "-" prefix for descending (e.g. sort=-popularity)
+    - ?limit=&offset=       paging
+    - no params             returns all titles
+
+    Filters and sorts run against the per-title summary columns and their
+    indexes, so nothing is aggregated per request.
+
+    The X-Change-Cursor response header is the change-feed position this
+    snapshot corresponds to; pass it to /api/global/changes for updates.
     """
     query = request.args.get("query")
     isbn = request.args.get("isbn")
-
-    session = SessionLocal()
+    available_only = request.args.get("available") == "1"
+    branch = request.args.get("branch")
+    year_from = request.args.get("year_from", type=int)
+    year_to = request.args.get("year_to", type=int)
+    sort = request.args.get("sort")
+    limit = request.args.get("limit", type=int)
+    offset = request.args.get("offset", type=int)
+
+    sort_columns = {
+        "title": BookGlobal.title,
+        "year": BookGlobal.year,
+        "available": BookGlobal.available_total,
+        "branches": BookGlobal.branch_count,
+        "popularity": BookGlobal.popularity,
+    }
+    if sort and sort.lstrip("-") not in sort_columns:
+        abort(400, description=f"sort must be one of {', '.join(sort_columns)}")
+
+    session = read_session()
+    # taken before reading, so no change can fall between snapshot and feed;
+    # a replica snapshot is older, so its cursor is too
+    if "replica_beat_ms" in session.info:
+        cursor = change_feed.cursor_at(session.info["replica_beat_ms"])
+    else:
+        cursor = change_feed.cursor()
     try:
         q = select(BookGlobal)
         if isbn:
-            q = q.where(BookGlobal.isbn == isbn)
+            # (an invalid ISBN matches nothing; "== None" would mean IS NULL)
+            q = q.where(BookGlobal.isbn_key == (try_isbn_key(isbn) or -1))
         elif query:
             like = f"%{query}%"
-            q = q.where(
+            match = (
                 (BookGlobal.title.ilike(like))
                 | (BookGlobal.author.ilike(like))
                 | (BookGlobal.isbn.ilike(like))
             )
+            query_key = try_isbn_key(query)
+            if query_key is not None:
+                match = match | (BookGlobal.isbn_key == query_key)
+            q = q.where(match)
         # else: no filter → return all books
 
-        books = session.execute(q).scalars().all()
-        results = []
-
-        for bg in books:
-            q_av = select(BookAvailability).where(BookAvailability.isbn == bg.isbn)
-            av_list = session.execute(q_av).scalars().all()
+        if branch:
+            at_branch = select(BookAvailability.isbn_key).where(
+                BookAvailability.branch_code == branch
+            )
+            if available_only:
+                at_branch = at_branch.where(BookAvailability.available_copies > 0)
+            q = q.where(BookGlobal.isbn_key.in_(at_branch))
+        elif available_only:
+            q = q.where(BookGlobal.available_total > 0)
+        if year_from is not None:
+            q = q.where(BookGlobal.year >= year_from)
+        if year_to is not None:
+            q = q.where(BookGlobal.year <= year_to)
+
+        if sort:
+            col = sort_columns[sort.lstrip("-")]
+            q = q.order_by(col.desc() if sort.startswith("-") else col.asc(), BookGlobal.id)
+        if limit is not None:
+            q = q.limit(limit)
+        if offset:
+            q = q.offset(offset)
 
-            branches = [
-                {
-                    "branch_code": av.branch_code,
-                    "total_copies": av.total_copies,
-                    "available_copies": av.available_copies,
-                }
-                for av in av_list
-            ]
+        books = session.execute(q).scalars().all()
 
-            results.append(
-                {
-                    "isbn": bg.isbn,
-                    "title": bg.title,
-                    "author": bg.author,
-                    "publisher": bg.publisher,
-                    "year": bg.year,
-                    "branches": branches,
-                }
-            )
+        # availability for all matched titles in one query
+        branches_by_key = {}
+        if books:
+            av_rows = session.execute(
+                select(BookAvailability).where(
+                    BookAvailability.isbn_key.in_([bg.isbn_key for bg in books])
+                )
+            ).scalars()
+            for av in av_rows:
+                branches_by_key.setdefault(av.isbn_key, []).append(
+                    {
+                        "branch_code": av.branch_code,
+                        "total_copies": av.total_copies,
+                        "available_copies": av.available_copies,
+                        "holds_waiting": av.holds_waiting or 0,
+                    }
+                )
+
+        results = [
+            {
+                "isbn": bg.isbn,
+                "title": bg.title,
+                "author": bg.author,
+                "publisher": bg.publisher,
+                "year": bg.year,
+                "available_total": bg.available_total or 0,
+                "branch_count": bg.branch_count or 0,
+                "popularity": bg.popularity or 0,
+                "branches": branches_by_key.get(bg.isbn_key, []),
+            }
+            for bg in books
+        ]
 
-        return jsonify(results)
+        return jsonify(results), 200, {"X-Change-Cursor": cursor}
     finally:
         session.close()
 
 
+def start_background_tasks():
+    start_periodic(
+        "popularity-refresh",
+        app.config["POPULARITY_REFRESH_SECONDS"],
+        refresh_popularity,
+    )
+    if app.config["RECONCILE_SECONDS"] > 0:
+        start_periodic("reconcile", app.config["RECONCILE_SECONDS"], reconciler.run)
+    if app.config["HISTORY_ENABLED"] and app.config["HISTORY_COMPACT_SECONDS"] > 0:
+        start_periodic(
+            "history-compaction",
+            app.config["HISTORY_COMPACT_SECONDS"],
+            availability_history.compact,
+        )
+    if replica_engine is not None:
+        sqlite_copy = (
+            engine.url.get_backend_name() == "sqlite"
+            and replica_engine.url.get_backend_name() == "sqlite"
+        )
+        if sqlite_copy:
+            # local testing: the "replica" is a periodically refreshed copy
+            start_periodic(
+                "replica-refresh",
+                app.config["REPLICA_REFRESH_SECONDS"],
+                db_router.refresh_sqlite_copy,
+                run_immediately=True,
+            )
+        else:
+            start_periodic(
+                "replica-heartbeat",
+                app.config["REPLICA_HEARTBEAT_SECONDS"],
+                db_router.beat,
+                run_immediately=True,
+            )
+
+
 if __name__ == "__main__":
+    debug = True
+    if in_serving_process(debug):
+        start_background_tasks()
     port = int(os.getenv("PORT", "5000"))
-    app.run(host="0.0.0.0", port=port, debug=True)
+    app.run(host="0.0.0.0", port=port, debug=debug)
@@ -0,0 +1,150 @@
+# central_service/assets.py
+"""
+In-memory frontend assets.
+
+At startup every file under frontend/ is read once, fingerprinted (a short
+content hash in the file name, e.g. catalog.3f9a1c2b7d4e.js) and, where it
+pays off, gzipped at the highest level. HTML pages keep their names (they
+are the URLs people open) but their references to other assets are
+rewritten to the fingerprinted names.
+
+Fingerprinted names never change content, so they are served with a
+one-year immutable Cache-Control; pages and the plain names revalidate with
+their ETag and get a 304 when nothing changed. A request never touches the
+disk, and gzip is never done per request.
+
+The same pipeline can run as a build step, writing the fingerprinted files,
+their .gz siblings and a manifest for a reverse proxy or CDN:
+
+    python -m central_service.assets frontend dist
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import sys
+
+# Formats that are already compressed gain nothing from gzip
+_COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml")
+_REFERENCE = re.compile(r'(\b(?:src|href)=")([^"#?:]+)(")')
+
+
+class Asset:
+    __slots__ = ("body", "gzip_body", "content_type", "etag", "immutable")
+
+    def __init__(self, body, content_type, immutable):
+        self.body = body
+        self.content_type = content_type
+        self.immutable = immutable
+        self.etag = hashlib.sha256(body).hexdigest()[:16]
+        self.gzip_body = None
+        if content_type.startswith(_COMPRESSIBLE):
+            packed = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(packed) < len(body):
+                self.gzip_body = packed
+
+
+def _content_type(name):
+    content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    if content_type.startswith("text/") or content_type == "application/javascript":
+        content_type += "; charset=utf-8"
+    return content_type
+
+
+def _fingerprinted(name, body):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(body).hexdigest()[:12]}{ext}"
+
+
+class AssetStore:
+    def __init__(self, max_age=31536000):
+        self.max_age = max_age
+        self.assets = {}    # url path (no leading "/") -> Asset
+        self.manifest = {}  # original name -> fingerprinted name
+
+    def build(self, src_dir):
+        """
+        Load, fingerprint and compress everything under src_dir.
+        """
+        files = {}
+        for root, _, names in os.walk(src_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, src_dir).replace(os.sep, "/")
+                with open(path, "rb") as f:
+                    files[rel] = f.read()
+
+        assets, manifest = {}, {}
+        for rel, body in files.items():
+            if rel.endswith(".html"):
+                continue
+            hashed = _fingerprinted(rel, body)
+            manifest[rel] = hashed
+            content_type = _content_type(rel)
+            assets[hashed] = Asset(body, content_type, immutable=True)
+            # the plain name still works, it just revalidates
+            assets[rel] = Asset(body, content_type, immutable=False)
+
+        for rel, body in files.items():
+            if not rel.endswith(".html"):
+                continue
+            base = os.path.dirname(rel)
+
+            def rewrite(m):
+                target = os.path.normpath(os.path.join(base, m.group(2))).replace(os.sep, "/")
+                if target not in manifest:
+                    return m.group(0)
+                return m.group(1) + os.path.relpath(manifest[target], base or ".") + m.group(3)
+
+            html = _REFERENCE.sub(rewrite, body.decode("utf-8")).encode("utf-8")
+            assets[rel] = Asset(html, _content_type(rel), immutable=False)
+
+        self.assets, self.manifest = assets, manifest
+        return self
+
+    def get(self, path):
+        return self.assets.get(path)
+
+    def headers(self, asset):
+        if asset.immutable:
+            cache = f"public, max-age={self.max_age}, immutable"
+        else:
+            cache = "no-cache"
+        return {"Cache-Control": cache, "Vary": "Accept-Encoding"}
+
+    def stats(self):
+        return {
+            "assets": len(self.manifest),
+            "bytes": sum(len(a.body) for a in self.assets.values() if a.immutable),
+            "gzip_bytes": sum(
+                len(a.gzip_body or a.body) for a in self.assets.values() if a.immutable
+            ),
+        }
+
+    def write(self, out_dir):
+        """
+        Build step: fingerprinted files, .gz siblings, rewritten pages and
+        manifest.json into out_dir.
+        """
+        for path, asset in self.assets.items():
+            if not asset.immutable and not path.endswith(".html"):
+                continue
+            target = os.path.join(out_dir, path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as f:
+                f.write(asset.body)
+            if asset.gzip_body is not None:
+                with open(target + ".gz", "wb") as f:
+                    f.write(asset.gzip_body)
+        with open(os.path.join(out_dir, "manifest.json"), "w") as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("usage: python -m central_service.assets SRC_DIR OUT_DIR")
+    store = AssetStore().build(sys.argv[1])
+    store.write(sys.argv[2])
+    print(json.dumps(store.stats()))
@@ -0,0 +1,195 @@
+# central_service/availability_matrix.py
+"""
+Columnar in-memory copy of BookAvailability for analytics.
+
+ISBNs and branch codes are interned to small integers; each branch owns two
+contiguous int arrays (total / available copies) indexed by ISBN number.
+Updates come from the same change list the sync path publishes, so the
+matrix never has to be rebuilt after startup.
+
+Besides the cells, a few aggregates are kept up to date on every change:
+per-branch sums (for utilization) and the set of titles that some branch
+holds with no copy on the shelf (for shortages and transfers). Reports
+therefore only visit the titles that can actually show up in them.
+"""
+import threading
+from array import array
+from itertools import islice
+
+
+class AvailabilityMatrix:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.isbns = []         # isbn number -> isbn
+        self._isbn_ix = {}      # isbn -> number
+        self.branches = []      # branch number -> code
+        self._branch_ix = {}
+        self._total = []        # per branch: array("i") of total copies
+        self._available = []    # per branch: array("i") of available copies
+        self._sums = []         # per branch: [titles held, total, available]
+        self._empty = {}        # isbn number -> branches holding it with 0 available
+
+    # ----------------- updates -----------------
+
+    def _isbn(self, isbn):
+        i = self._isbn_ix.get(isbn)
+        if i is None:
+            i = len(self.isbns)
+            self._isbn_ix[isbn] = i
+            self.isbns.append(isbn)
+            for col in self._total:
+                col.append(0)
+            for col in self._available:
+                col.append(0)
+        return i
+
+    def _branch(self, code):
+        b = self._branch_ix.get(code)
+        if b is None:
+            b = len(self.branches)
+            self._branch_ix[code] = b
+            self.branches.append(code)
+            self._total.append(array("i", [0]) * len(self.isbns))
+            self._available.append(array("i", [0]) * len(self.isbns))
+            self._sums.append([0, 0, 0])
+        return b
+
+    def _set(self, i, b, total, available):
+        old_total = self._total[b][i]
+        old_available = self._available[b][i]
+        self._total[b][i] = total
+        self._available[b][i] = available
+
+        sums = self._sums[b]
+        sums[0] += int(total > 0) - int(old_total > 0)
+        sums[1] += total - old_total
+        sums[2] += available - old_available
+
+        was_empty = old_total > 0 and old_available == 0
+        is_empty = total > 0 and available == 0
+        if was_empty != is_empty:
+            n = self._empty.get(i, 0) + (1 if is_empty else -1)
+            if n:
+                self._empty[i] = n
+            else:
+                del self._empty[i]
+
+    def load(self, rows):
+        """
+        rows: iterable of (isbn, branch_code, total_copies, available_copies).
+        """
+        with self._lock:
+            for isbn, branch_code, total, available in rows:
+                self._set(self._isbn(isbn), self._branch(branch_code), total, available)
+
+    def apply(self, changes):
+        """
+        changes: the dicts published on the change feed by the sync path.
+        """
+        with self._lock:
+            for c in changes:
+                i = self._isbn(c["isbn"])
+                b = self._branch(c["branch_code"])
+                if c.get("removed"):
+                    self._set(i, b, 0, 0)
+                else:
+                    self._set(i, b, c["total_copies"], c["available_copies"])
+
+    # ----------------- reports -----------------
+
+    def _short_titles(self, min_surplus):
+        """
+        Yield (isbn number, [short branch numbers], [(donor, available)])
+        for titles that are out at some branch and have at least
+        min_surplus copies on the shelf at another one. Only titles in the
+        "out somewhere" set are visited, and callers stop once they have
+        enough. Caller holds the lock.
+        """
+        columns = list(zip(range(len(self.branches)), self._total, self._available))
+        for i in self._empty:
+            short, donors = [], []
+            for b, total, avail in columns:
+                available = avail[i]
+                if available >= min_surplus:
+                    donors.append((b, available))
+                elif available == 0 and total[i] > 0:
+                    short.append(b)
+            if short and donors:
+                yield i, short, donors
+
+    def shortages(self, min_surplus=1, limit=100):
+        """
+        Returns (items, more): up to `limit` short titles and whether there
+        are more beyond them.
+        """
+        with self._lock:
+            found = list(islice(self._short_titles(min_surplus), limit + 1))
+            items = [
+                {
+                    "isbn": self.isbns[i],
+                    "short_at": [self.branches[b] for b in short],
+                    "surplus_at": [
+                        {"branch_code": self.branches[b], "available_copies": a}
+                        for b, a in sorted(donors, key=lambda d: -d[1])
+                    ],
+                }
+                for i, short, donors in found[:limit]
+            ]
+            return items, len(found) > limit
+
+    def transfers(self, keep=1, limit=100):
+        """
+        One-copy moves from branches with spare copies (keeping `keep` on
+        their own shelf) to branches that have none, greedily taking from
+        the donor with the most to spare.
+        """
+        suggestions = []
+        with self._lock:
+            for i, short, donors in self._short_titles(keep + 1):
+                spare = {b: a - keep for b, a in donors}
+                for to in short:
+                    donor = max(spare, key=spare.get)
+                    if spare[donor] <= 0:
+                        break
+                    spare[donor] -= 1
+                    suggestions.append(
+                        {
+                            "isbn": self.isbns[i],
+                            "from_branch": self.branches[donor],
+                            "to_branch": self.branches[to],
+                            "copies": 1,
+                        }
+                    )
+                if len(suggestions) >= limit:
+                    break
+        return suggestions[:limit]
+
+    def utilization(self):
+        with self._lock:
+            out = []
+            for b, code in enumerate(self.branches):
+                titles, total, available = self._sums[b]
+                out.append(
+                    {
+                        "branch_code": code,
+                        "titles": titles,
+                        "total_copies": total,
+                        "available_copies": available,
+                        "on_loan": total - available,
+                        "utilization": (
+                            round((total - available) / total, 4) if total else 0.0
+                        ),
+                    }
+                )
+            return out
+
+    def stats(self):
+        with self._lock:
+            cells = sum(len(col) for col in self._total)
+            return {
+                "isbns": len(self.isbns),
+                "branches": len(self.branches),
+                "cells": cells,
+                "array_bytes": 2 * cells * array("i").itemsize,
+                "titles_out_somewhere": len(self._empty),
+            }
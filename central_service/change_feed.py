@@ -0,0 +1,91 @@
+# central_service/change_feed.py
+"""
+In-memory availability change feed.
+
+sync_availability publishes the rows it actually changed; catalog clients
+hold a cursor and fetch only the deltas since then (poll, long-poll or
+SSE). All subscribers share one bounded buffer, so an idle subscriber
+costs nothing but its cursor.
+"""
+import secrets
+import threading
+import time
+from collections import deque
+from itertools import islice
+
+
+class ChangeFeed:
+    """
+    Cursors look like "<epoch>-<seq>". The epoch changes on every restart,
+    so a client holding a cursor from a previous process is told to reset
+    (refetch the catalog) instead of silently missing changes.
+    """
+
+    def __init__(self, max_changes=10000):
+        self.epoch = secrets.token_hex(4)
+        self._changes = deque(maxlen=max_changes)
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def cursor(self):
+        return f"{self.epoch}-{self._seq}"
+
+    def cursor_at(self, as_of_ms):
+        """
+        Cursor for a snapshot taken at as_of_ms (e.g. a read replica), i.e.
+        the last change published at or before that time.
+        """
+        with self._cond:
+            seq = self._seq
+            for s, _, ts in reversed(self._changes):
+                if ts <= as_of_ms:
+                    break
+                seq = s - 1
+            return f"{self.epoch}-{seq}"
+
+    def publish(self, changes):
+        """
+        changes: iterable of dicts (isbn, branch_code, available_copies,
+        total_copies). Wakes up every waiting subscriber.
+        """
+        with self._cond:
+            now_ms = int(time.time() * 1000)
+            for change in changes:
+                self._seq += 1
+                self._changes.append((self._seq, change, now_ms))
+            self._cond.notify_all()
+
+    def _parse(self, cursor):
+        epoch, _, seq = (cursor or "").partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def since(self, cursor, limit=1000):
+        """
+        Returns (changes, next_cursor, reset). reset=True means the cursor
+        is unknown or too old for the buffer and the client must reload.
+        """
+        seq = self._parse(cursor)
+        with self._cond:
+            oldest = self._changes[0][0] if self._changes else self._seq + 1
+            if seq is None or seq > self._seq or seq < oldest - 1:
+                return [], self.cursor(), True
+            out = []
+            last = seq
+            # the buffer is ordered by seq, so skip straight to the cursor
+            start = len(self._changes) - (self._seq - seq)
+            for s, change, _ in islice(self._changes, start, start + limit):
+                out.append(change)
+                last = s
+            return out, f"{self.epoch}-{last}", False
+
+    def wait(self, cursor, timeout):
+        """
+        Block until something newer than cursor exists or timeout passes.
+        """
+        seq = self._parse(cursor)
+        with self._cond:
+            if seq is None or seq != self._seq:
+                return
+            self._cond.wait_for(lambda: self._seq != seq, timeout=timeout)
@@ -13,3 +13,105 @@ class Config:
     JWT_SECRET = os.getenv("JWT_SECRET", "jwt-dev-secret")
     JWT_ALGORITHM = "HS256"
     JWT_EXP_MINUTES = int(os.getenv("JWT_EXP_MINUTES", "60"))
+
+    # Verified tokens are cached in memory (LRU) so repeat calls skip the
+    # signature check entirely.
+    TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
+
+    # Group commit for /api/global/sync/availability: events are queued and
+    # applied by one writer thread, one transaction per micro-batch.
+    SYNC_GROUP_COMMIT = os.getenv("SYNC_GROUP_COMMIT", "1") == "1"
+    SYNC_QUEUE_SIZE = int(os.getenv("SYNC_QUEUE_SIZE", "10000"))
+    SYNC_BATCH_MAX = int(os.getenv("SYNC_BATCH_MAX", "500"))
+    SYNC_BATCH_WINDOW_MS = int(os.getenv("SYNC_BATCH_WINDOW_MS", "5"))
+    # How long a request waits for its batch to be durable before a 503
+    SYNC_MAX_WAIT_MS = int(os.getenv("SYNC_MAX_WAIT_MS", "2000"))
+
+    # Live catalog change feed: how many deltas to keep in memory and the
+    # longest a long-poll / SSE heartbeat may hold a connection.
+    CHANGE_FEED_SIZE = int(os.getenv("CHANGE_FEED_SIZE", "10000"))
+    CHANGE_FEED_MAX_WAIT_SECONDS = float(os.getenv("CHANGE_FEED_MAX_WAIT_SECONDS", "25"))
+
+    # Optional read replica for catalog reads, e.g.
+    # "mysql+pymysql://reader:pw@replica:3306/central_db" or, for local
+    # testing, "sqlite:///central_replica.db" (refreshed by copying central.db)
+    READ_REPLICA_URL = os.getenv("READ_REPLICA_URL")
+    # Reads fall back to the primary when the replica lags more than this
+    REPLICA_MAX_STALENESS_SECONDS = float(os.getenv("REPLICA_MAX_STALENESS_SECONDS", "5"))
+    REPLICA_HEARTBEAT_SECONDS = float(os.getenv("REPLICA_HEARTBEAT_SECONDS", "1"))
+    REPLICA_REFRESH_SECONDS = float(os.getenv("REPLICA_REFRESH_SECONDS", "2"))
+
+    # Admission control: concurrency budget and wait-queue size per traffic
+    # class. Requests beyond that are shed with 429 (sync) / 503 (patrons).
+    ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "1") == "1"
+    ADMISSION_SYNC_CONCURRENCY = int(os.getenv("ADMISSION_SYNC_CONCURRENCY", "32"))
+    ADMISSION_SYNC_QUEUE = int(os.getenv("ADMISSION_SYNC_QUEUE", "200"))
+    ADMISSION_READ_CONCURRENCY = int(os.getenv("ADMISSION_READ_CONCURRENCY", "16"))
+    ADMISSION_READ_QUEUE = int(os.getenv("ADMISSION_READ_QUEUE", "100"))
+    ADMISSION_WRITE_CONCURRENCY = int(os.getenv("ADMISSION_WRITE_CONCURRENCY", "8"))
+    ADMISSION_WRITE_QUEUE = int(os.getenv("ADMISSION_WRITE_QUEUE", "50"))
+    # Change-feed long-polls and SSE streams each park a server thread for
+    # up to CHANGE_FEED_MAX_WAIT_SECONDS (SSE: for the life of the stream),
+    # so they get their own cap and are refused, not queued, beyond it.
+    ADMISSION_FEED_CONCURRENCY = int(os.getenv("ADMISSION_FEED_CONCURRENCY", "100"))
+    ADMISSION_QUEUE_TIMEOUT_MS = int(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "1000"))
+    ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "2"))
+
+    # Per-request profiling (off by default). A request is profiled when it
+    # sends "X-Profile: <PROFILING_TOKEN>" or is sampled at PROFILING_SAMPLE_RATE.
+    PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+    PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+    PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+    PROFILING_DIR = os.getenv("PROFILING_DIR", "profiles")
+    PROFILING_MAX_FILES = int(os.getenv("PROFILING_MAX_FILES", "200"))
+
+    # Popularity: borrows counted over a rolling window of days; the window
+    # is rolled forward (and the top-K reloaded) every refresh interval.
+    POPULARITY_WINDOW_DAYS = int(os.getenv("POPULARITY_WINDOW_DAYS", "30"))
+    POPULARITY_REFRESH_SECONDS = int(os.getenv("POPULARITY_REFRESH_SECONDS", "3600"))
+    TRENDING_TOP_K = int(os.getenv("TRENDING_TOP_K", "50"))
+
+    # Fingerprinted frontend assets are cached by browsers this long
+    STATIC_MAX_AGE_SECONDS = int(os.getenv("STATIC_MAX_AGE_SECONDS", "31536000"))
+
+    # Typeahead (/api/global/suggest): default and maximum suggestions per
+    # request, and how many postings one lookup may scan before giving up
+    SUGGEST_LIMIT = int(os.getenv("SUGGEST_LIMIT", "10"))
+    SUGGEST_MAX_LIMIT = int(os.getenv("SUGGEST_MAX_LIMIT", "50"))
+    SUGGEST_MAX_SCAN = int(os.getenv("SUGGEST_MAX_SCAN", "1000"))
+
+    # Bulk patron import: rows per central transaction, and users per call
+    # when handing the imported patrons to their home branch
+    USER_IMPORT_CHUNK = int(os.getenv("USER_IMPORT_CHUNK", "1000"))
+    USER_IMPORT_BRANCH_BATCH = int(os.getenv("USER_IMPORT_BRANCH_BATCH", "1000"))
+
+    # Reconciliation against branch snapshots (0 disables the schedule).
+    # At most RECONCILE_CONCURRENCY snapshots are fetched at once; repairs
+    # go to the sync writer RECONCILE_BATCH rows at a time with a pause in
+    # between so live sync traffic is never starved.
+    RECONCILE_SECONDS = int(os.getenv("RECONCILE_SECONDS", "900"))
+    RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", "2"))
+    RECONCILE_BATCH = int(os.getenv("RECONCILE_BATCH", "200"))
+    RECONCILE_PAUSE_MS = int(os.getenv("RECONCILE_PAUSE_MS", "50"))
+
+    # Outbound service-to-service HTTP (common/http_client.py): connections
+    # kept alive per target host, default timeouts, retries for idempotent
+    # calls, and the per-host circuit breaker
+    HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+    HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "3"))
+    HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "1"))
+    HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+    HTTP_BREAKER_FAILURES = int(os.getenv("HTTP_BREAKER_FAILURES", "5"))
+    HTTP_BREAKER_RESET_SECONDS = float(os.getenv("HTTP_BREAKER_RESET_SECONDS", "10"))
+
+    # Availability history (central_service/history.py): applied sync
+    # events are buffered and appended HISTORY_FLUSH_ROWS at a time (or
+    # every HISTORY_FLUSH_SECONDS); compaction folds them into daily rows
+    # and drops raw rows older than HISTORY_RAW_DAYS.
+    HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "1") == "1"
+    HISTORY_FLUSH_ROWS = int(os.getenv("HISTORY_FLUSH_ROWS", "1000"))
+    HISTORY_FLUSH_SECONDS = float(os.getenv("HISTORY_FLUSH_SECONDS", "1"))
+    HISTORY_BUFFER_MAX = int(os.getenv("HISTORY_BUFFER_MAX", "100000"))
+    HISTORY_RAW_DAYS = int(os.getenv("HISTORY_RAW_DAYS", "30"))
+    HISTORY_COMPACT_SECONDS = int(os.getenv("HISTORY_COMPACT_SECONDS", "3600"))
+    HISTORY_COMPACT_BATCH = int(os.getenv("HISTORY_COMPACT_BATCH", "5000"))
@@ -0,0 +1,441 @@
+# central_service/history.py
+"""
+Availability history.
+
+Every sync event apply_sync_batch applies is also appended to
+availability_log, one narrow row per change (integer ISBN key, branch,
+time, counts). Appends are buffered in memory and written by a background
+thread in multi-row INSERTs, so the sync path never waits on them.
+
+A periodic compaction folds the log into availability_daily: per title,
+branch and day the closing counts plus the day's low/high and number of
+changes. Folding is incremental (rows after a watermark id) and keyed on
+the branch version, so late events, e.g. an outbox replayed after an
+outage, still land on the right day. Raw rows older than raw_days are then
+pruned; older days are only kept at daily resolution.
+
+Queries never scan the history:
+- state at time T: one index seek for the last raw row at or before T,
+  falling back to the closing row of the last day before the raw window
+  (or before T's day, when T itself is older than the window);
+- range: the state at the start plus the raw rows, or daily rows, in the
+  range, read from the (isbn_key, branch_code, at/day) indexes.
+"""
+import logging
+import threading
+from collections import deque
+from datetime import datetime, time as dt_time, timedelta
+
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from .models import AvailabilityDaily, AvailabilityLog, HistoryCompaction
+
+logger = logging.getLogger(__name__)
+
+
+def _day_start(when):
+    return datetime.combine(when.date(), dt_time.min)
+
+
+class HistoryLog:
+    def __init__(
+        self,
+        session_factory,
+        flush_rows=1000,
+        flush_interval=1.0,
+        max_buffer=100000,
+        raw_days=30,
+        compact_batch=5000,
+    ):
+        self.session_factory = session_factory
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.raw_days = raw_days
+        self.compact_batch = compact_batch
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._flush_lock = threading.Lock()
+        # the periodic job and the admin endpoint must not fold the same
+        # watermark range at once; across processes _fold_batch claims the
+        # range on the watermark row instead
+        self._compact_lock = threading.Lock()
+
+        self.appended = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.rows_compacted = 0
+        self.rows_pruned = 0
+
+    # ----------------- buffered appends -----------------
+
+    def append(self, rows):
+        """
+        Queue log rows (dicts with isbn_key, branch_code, at, total_copies,
+        available_copies, holds_waiting, version). Never blocks; when the
+        buffer is full (the database has been unwritable for a while) the
+        rows are dropped and counted.
+        """
+        if not rows:
+            return
+        self._ensure_started()
+        with self._cond:
+            room = self.max_buffer - len(self._buffer)
+            if room < len(rows):
+                self.dropped += len(rows) - max(room, 0)
+                rows = rows[: max(room, 0)]
+            self._buffer.extend(rows)
+            self.appended += len(rows)
+            if len(self._buffer) >= self.flush_rows:
+                self._cond.notify()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="history-writer", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._buffer) < self.flush_rows:
+                    self._cond.wait(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                # rows stay buffered and are retried on the next round
+                logger.exception("Writing availability history failed")
+
+    def flush(self):
+        """
+        Write everything buffered so far, flush_rows rows per INSERT.
+        """
+        with self._flush_lock:
+            while True:
+                with self._cond:
+                    batch = [
+                        self._buffer.popleft()
+                        for _ in range(min(self.flush_rows, len(self._buffer)))
+                    ]
+                if not batch:
+                    return
+                session = self.session_factory()
+                try:
+                    session.execute(insert(AvailabilityLog.__table__), batch)
+                    session.commit()
+                except Exception:
+                    with self._cond:
+                        self._buffer.extendleft(reversed(batch))
+                    raise
+                finally:
+                    session.close()
+                self.written += len(batch)
+                self.flushes += 1
+
+    # ----------------- compaction -----------------
+
+    def _watermark(self, session):
+        mark = session.get(HistoryCompaction, 1, with_for_update=True)
+        if mark is None:
+            mark = HistoryCompaction(id=1, last_log_id=0, pruned_before=None)
+            session.add(mark)
+        return mark
+
+    def compact(self, now=None):
+        """
+        Fold new log rows into daily rows, then prune raw rows older than
+        raw_days. Returns (rows folded, rows pruned).
+        """
+        with self._compact_lock:
+            self.flush()
+            folded = 0
+            while True:
+                n = self._fold_batch()
+                folded += n
+                if n < self.compact_batch:
+                    break
+            pruned = self._prune(now or datetime.utcnow())
+            self.rows_compacted += folded
+            self.rows_pruned += pruned
+        if folded or pruned:
+            logger.info("History compaction: folded %d rows, pruned %d", folded, pruned)
+        return folded, pruned
+
+    def _fold_batch(self):
+        log = AvailabilityLog.__table__.c
+        daily = AvailabilityDaily.__table__
+        session = self.session_factory()
+        try:
+            mark = self._watermark(session)
+            rows = session.execute(
+                select(
+                    log.id,
+                    log.isbn_key,
+                    log.branch_code,
+                    log.at,
+                    log.total_copies,
+                    log.available_copies,
+                    log.holds_waiting,
+                    log.version,
+                )
+                .where(log.id > mark.last_log_id)
+                .order_by(log.id)
+                .limit(self.compact_batch)
+            ).all()
+            if not rows:
+                session.commit()
+                return 0
+
+            # claim the range before touching daily rows: if another
+            # process moved (or, on a fresh database, created) the watermark
+            # since we read it, it has folded these rows, so leave them alone
+            try:
+                session.flush()
+            except IntegrityError:
+                session.rollback()
+                return 0
+            claimed = session.execute(
+                update(HistoryCompaction)
+                .where(
+                    (HistoryCompaction.id == 1)
+                    & (HistoryCompaction.last_log_id == mark.last_log_id)
+                )
+                .values(last_log_id=rows[-1].id)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if not claimed:
+                session.rollback()
+                return 0
+
+            # fold into plain dicts first, then one executemany per table
+            folded = {}
+            for row in rows:
+                key = (row.isbn_key, row.branch_code, row.at.date())
+                day = folded.get(key)
+                if day is None:
+                    folded[key] = day = {
+                        "version": -1,
+                        "min_available": row.available_copies,
+                        "max_available": row.available_copies,
+                        "changes": 0,
+                    }
+                day["min_available"] = min(day["min_available"], row.available_copies)
+                day["max_available"] = max(day["max_available"], row.available_copies)
+                day["changes"] += 1
+                # the closing state is the one with the newest branch version
+                if (row.version or 0) >= day["version"]:
+                    day["version"] = row.version or 0
+                    day["total_copies"] = row.total_copies
+                    day["available_copies"] = row.available_copies
+                    day["holds_waiting"] = row.holds_waiting
+
+            existing = {
+                (d.isbn_key, d.branch_code, d.day): d
+                for d in session.execute(
+                    select(daily).where(
+                        daily.c.isbn_key.in_(list({k[0] for k in folded}))
+                        & daily.c.day.in_(list({k[2] for k in folded}))
+                    )
+                )
+            }
+            inserts, updates = [], []
+            for key, day in folded.items():
+                old = existing.get(key)
+                if old is None:
+                    inserts.append(
+                        dict(day, isbn_key=key[0], branch_code=key[1], day=key[2])
+                    )
+                    continue
+                merged = {
+                    "row_id": old.id,
+                    "min_available": min(old.min_available, day["min_available"]),
+                    "max_available": max(old.max_available, day["max_available"]),
+                    "changes": old.changes + day["changes"],
+                }
+                for name in ("version", "total_copies", "available_copies", "holds_waiting"):
+                    merged[name] = day[name] if day["version"] >= old.version else getattr(old, name)
+                updates.append(merged)
+
+            if inserts:
+                session.execute(insert(daily), inserts)
+            if updates:
+                session.execute(
+                    update(daily)
+                    .where(daily.c.id == bindparam("row_id"))
+                    .values(
+                        {
+                            name: bindparam(name)
+                            for name in (
+                                "version",
+                                "total_copies",
+                                "available_copies",
+                                "holds_waiting",
+                                "min_available",
+                                "max_available",
+                                "changes",
+                            )
+                        }
+                    ),
+                    updates,
+                )
+            session.commit()
+            return len(rows)
+        finally:
+            session.close()
+
+    def _prune(self, now):
+        horizon = _day_start(now) - timedelta(days=self.raw_days)
+        session = self.session_factory()
+        try:
+            mark = self._watermark(session)
+            pruned = session.execute(
+                AvailabilityLog.__table__.delete().where(
+                    (AvailabilityLog.at < horizon) & (AvailabilityLog.id <= mark.last_log_id)
+                )
+            ).rowcount
+            if mark.pruned_before is None or mark.pruned_before < horizon:
+                mark.pruned_before = horizon
+            session.commit()
+            return pruned
+        finally:
+            session.close()
+
+    def stats(self):
+        with self._cond:
+            buffered = len(self._buffer)
+        return {
+            "buffered": buffered,
+            "appended": self.appended,
+            "written": self.written,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "rows_compacted": self.rows_compacted,
+            "rows_pruned": self.rows_pruned,
+        }
+
+
+# ----------------- queries -----------------
+
+def raw_horizon(session):
+    """
+    Start of the raw window: log rows before it have been pruned, so only
+    daily rows describe that period. None while nothing has been pruned.
+    """
+    return session.execute(
+        select(HistoryCompaction.pruned_before).where(HistoryCompaction.id == 1)
+    ).scalar_one_or_none()
+
+
+def _state(row, as_of, resolution):
+    return {
+        "total_copies": row.total_copies,
+        "available_copies": row.available_copies,
+        "holds_waiting": row.holds_waiting or 0,
+        "as_of": as_of.isoformat(),
+        "resolution": resolution,
+    }
+
+
+def _closing_before(session, key, branch_code, day):
+    return session.execute(
+        select(AvailabilityDaily)
+        .where(
+            (AvailabilityDaily.isbn_key == key)
+            & (AvailabilityDaily.branch_code == branch_code)
+            & (AvailabilityDaily.day < day)
+        )
+        .order_by(AvailabilityDaily.day.desc())
+        .limit(1)
+    ).scalar_one_or_none()
+
+
+def state_at(session, key, branch_code, at, horizon):
+    """
+    Counts of one title at one branch as of `at`, or None if the branch had
+    no record of it yet. Resolution is "event" inside the raw window and
+    "day" (the state at the start of at's day) before it.
+    """
+    if horizon is None or at >= horizon:
+        q = select(AvailabilityLog).where(
+            (AvailabilityLog.isbn_key == key)
+            & (AvailabilityLog.branch_code == branch_code)
+            & (AvailabilityLog.at <= at)
+        )
+        if horizon is not None:
+            # late rows older than the window are not folded in yet
+            q = q.where(AvailabilityLog.at >= horizon)
+        row = session.execute(
+            q.order_by(AvailabilityLog.at.desc(), AvailabilityLog.id.desc()).limit(1)
+        ).scalar_one_or_none()
+        if row is not None:
+            return _state(row, row.at, "event")
+        if horizon is None:
+            return None
+        daily = _closing_before(session, key, branch_code, horizon.date())
+    else:
+        daily = _closing_before(session, key, branch_code, at.date())
+    if daily is None:
+        return None
+    return _state(daily, datetime.combine(daily.day, dt_time.max), "day")
+
+
+def changes_between(session, key, branch_code, start, end, horizon, daily_only=False):
+    """
+    What happened to one title at one branch in (start, end]: raw changes
+    inside the raw window (unless daily_only), daily rows before it.
+    """
+    days, events = [], []
+    if daily_only:
+        raw_from, day_stop = end, end.date() + timedelta(days=1)
+    else:
+        raw_from = start if horizon is None else max(start, horizon)
+        day_stop = raw_from.date()
+    if start < raw_from:
+        for d in session.execute(
+            select(AvailabilityDaily)
+            .where(
+                (AvailabilityDaily.isbn_key == key)
+                & (AvailabilityDaily.branch_code == branch_code)
+                & (AvailabilityDaily.day >= start.date())
+                & (AvailabilityDaily.day < day_stop)
+            )
+            .order_by(AvailabilityDaily.day)
+        ).scalars():
+            days.append(
+                {
+                    "day": d.day.isoformat(),
+                    "total_copies": d.total_copies,
+                    "available_copies": d.available_copies,
+                    "holds_waiting": d.holds_waiting or 0,
+                    "min_available": d.min_available,
+                    "max_available": d.max_available,
+                    "changes": d.changes,
+                }
+            )
+    if raw_from < end:
+        for row in session.execute(
+            select(AvailabilityLog)
+            .where(
+                (AvailabilityLog.isbn_key == key)
+                & (AvailabilityLog.branch_code == branch_code)
+                & (AvailabilityLog.at > raw_from)
+                & (AvailabilityLog.at <= end)
+            )
+            .order_by(AvailabilityLog.at, AvailabilityLog.id)
+        ).scalars():
+            events.append(
+                {
+                    "at": row.at.isoformat(),
+                    "total_copies": row.total_copies,
+                    "available_copies": row.available_copies,
+                    "holds_waiting": row.holds_waiting or 0,
+                }
+            )
+    return days, events
@@ -5,9 +5,13 @@ from sqlalchemy.orm import declarative_base
 from sqlalchemy import (
     Column,
     Integer,          # <— use Integer for autoincrement PKs in SQLite
+    BigInteger,
     String,
+    Date,
     DateTime,
     Boolean,
+    Index,
+    func,
 )
 
 Base = declarative_base()
@@ -28,24 +32,54 @@ class BookGlobal(Base):
     __tablename__ = "book_global"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
+    # ISBN as first reported (display form, e.g. "978-0132350884")
     isbn = Column(String(20), unique=True, nullable=False)
+    # Canonical ISBN-13 as an integer (common.isbn.isbn_key); every form of
+    # the same ISBN maps here and all lookups/joins use it
+    isbn_key = Column(BigInteger)
     title = Column(String(255), nullable=False)
     author = Column(String(255))
     publisher = Column(String(255))
     year = Column(Integer)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    # Per-title summary across branches, maintained incrementally by
+    # sync_availability so catalog filters/sorts never aggregate at query time
+    available_total = Column(Integer)
+    branch_count = Column(Integer)
+    # Borrows across all branches within the rolling popularity window
+    popularity = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_book_global_isbn_key", "isbn_key", unique=True),
+        Index("ix_book_global_title", "title"),
+        Index("ix_book_global_year", "year"),
+        Index("ix_book_global_available_total", "available_total"),
+        Index("ix_book_global_popularity", "popularity"),
+    )
+
 
 class BookAvailability(Base):
     __tablename__ = "book_availability"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
+    # Display ISBN of the BookGlobal row; isbn_key is what we join on
     isbn = Column(String(20), nullable=False)
+    isbn_key = Column(BigInteger)
     branch_code = Column(String(50), nullable=False)
     total_copies = Column(Integer, nullable=False)
     available_copies = Column(Integer, nullable=False)
+    # Patrons queued at the branch for a copy of this title
+    holds_waiting = Column(Integer, nullable=False, default=0)
+    # Highest branch sync version applied; older updates are ignored
+    version = Column(BigInteger, nullable=False, default=0)
     last_sync_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_book_availability_key_branch", "isbn_key", "branch_code"),
+        Index("ix_book_availability_branch_available", "branch_code", "available_copies"),
+    )
+
 
 class UserCentral(Base):
     """
@@ -60,3 +94,124 @@ class UserCentral(Base):
     email = Column(String(255), nullable=False)
     home_branch = Column(String(50))
     created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # duplicate-email checks during bulk imports (case-insensitive)
+        Index("ix_user_central_email_lower", func.lower(email)),
+    )
+
+
+class RevokedToken(Base):
+    """
+    Deny-list of revoked access tokens, keyed by the token's jti.
+    Rows are only needed until the token would have expired anyway.
+    """
+    __tablename__ = "revoked_token"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    jti = Column(String(32), unique=True, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    revoked_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ReplicaHeartbeat(Base):
+    """
+    Single row stamped on the primary just before replication / copy.
+    Reading it back from the replica tells us how stale the replica is.
+    """
+    __tablename__ = "replica_heartbeat"
+
+    id = Column(Integer, primary_key=True)
+    beat_ms = Column(BigInteger, nullable=False)  # epoch milliseconds
+
+
+class BorrowStat(Base):
+    """
+    Borrows of a title at a branch on a given day, as last reported by the
+    branch (absolute count, so replays are harmless).
+    """
+    __tablename__ = "borrow_stat"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    isbn = Column(String(20), nullable=False)
+    branch_code = Column(String(50), nullable=False)
+    bucket = Column(Date, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_borrow_stat_key", "isbn", "branch_code", "bucket", unique=True),
+        Index("ix_borrow_stat_bucket", "bucket"),
+    )
+
+
+class StatCounter(Base):
+    """
+    Running totals for the dashboard (branches, titles, copies), adjusted
+    in the same transaction as the change so reading them is O(1).
+    """
+    __tablename__ = "stat_counter"
+
+    name = Column(String(50), primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+
+
+class AvailabilityLog(Base):
+    """
+    Append-only log of applied availability changes (central_service/
+    history.py). "at" is the branch's time of the change when it sent one.
+    Rows older than the raw retention are folded into AvailabilityDaily
+    and deleted.
+    """
+    __tablename__ = "availability_log"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    isbn_key = Column(BigInteger, nullable=False)
+    branch_code = Column(String(50), nullable=False)
+    at = Column(DateTime, nullable=False)
+    total_copies = Column(Integer, nullable=False)
+    available_copies = Column(Integer, nullable=False)
+    holds_waiting = Column(Integer)
+    version = Column(BigInteger)
+
+    __table_args__ = (
+        Index("ix_availability_log_key_branch_at", "isbn_key", "branch_code", "at"),
+        Index("ix_availability_log_at", "at"),
+        # ids must never be reused after pruning: compaction's watermark is an id
+        {"sqlite_autoincrement": True},
+    )
+
+
+class AvailabilityDaily(Base):
+    """
+    Per title, branch and day: closing counts (from the change with the
+    highest branch version) plus the day's low/high and number of changes.
+    """
+    __tablename__ = "availability_daily"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    isbn_key = Column(BigInteger, nullable=False)
+    branch_code = Column(String(50), nullable=False)
+    day = Column(Date, nullable=False)
+    total_copies = Column(Integer, nullable=False)
+    available_copies = Column(Integer, nullable=False)
+    holds_waiting = Column(Integer)
+    version = Column(BigInteger, nullable=False)
+    min_available = Column(Integer, nullable=False)
+    max_available = Column(Integer, nullable=False)
+    changes = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_availability_daily_key", "isbn_key", "branch_code", "day", unique=True),
+    )
+
+
+class HistoryCompaction(Base):
+    """
+    Single row: last availability_log id folded into availability_daily,
+    and the start of the raw window (older log rows have been pruned).
+    """
+    __tablename__ = "history_compaction"
+
+    id = Column(Integer, primary_key=True)
+    last_log_id = Column(Integer, nullable=False, default=0)
+    pruned_before = Column(DateTime)
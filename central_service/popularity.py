@@ -0,0 +1,53 @@
+# central_service/popularity.py
+"""
+Popularity ranking.
+
+Branches report absolute borrow counts per title per day. Central keeps
+them per (isbn, branch, day), maintains BookGlobal.popularity (borrows in
+the rolling window) incrementally, and holds the current top-K titles in
+memory so /api/global/trending never has to scan or sort.
+"""
+import threading
+
+
+class TopK:
+    def __init__(self, k):
+        self.k = k
+        self._entries = {}  # isbn -> entry dict
+        self._floor = 0     # lowest score currently in the list
+        self._lock = threading.Lock()
+
+    def replace(self, entries):
+        """
+        entries: dicts with isbn, title, author, popularity (best first).
+        """
+        with self._lock:
+            self._entries = {e["isbn"]: e for e in entries[: self.k]}
+            self._recompute_floor()
+
+    def offer(self, entry):
+        """
+        Incremental update after a title's score changed.
+        """
+        with self._lock:
+            isbn = entry["isbn"]
+            if isbn in self._entries:
+                self._entries[isbn] = entry
+            elif len(self._entries) < self.k or entry["popularity"] > self._floor:
+                self._entries[isbn] = entry
+                if len(self._entries) > self.k:
+                    weakest = min(self._entries.values(), key=lambda e: e["popularity"])
+                    del self._entries[weakest["isbn"]]
+            else:
+                return
+            self._recompute_floor()
+
+    def _recompute_floor(self):
+        self._floor = min((e["popularity"] for e in self._entries.values()), default=0)
+
+    def top(self, n=None):
+        with self._lock:
+            ranked = sorted(
+                self._entries.values(), key=lambda e: (-e["popularity"], e["isbn"])
+            )
+        return [e for e in ranked[: n or self.k] if e["popularity"] > 0]
@@ -0,0 +1,247 @@
+# central_service/reconcile.py
+"""
+Availability reconciliation.
+
+Central's BookAvailability is only as good as the events branches send. A
+lost event or a restored branch DB leaves it wrong until the next change to
+that title. The reconciler pulls a full snapshot from every active branch
+(a few at a time), diffs it against central's rows for that branch and
+turns every difference into a repair event. Repairs go through the normal
+sync path, so summaries, counters and the change feed stay consistent.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import select
+
+from common.isbn import try_isbn_key
+from .models import Branch, BookAvailability
+
+logger = logging.getLogger(__name__)
+
+
+class Reconciler:
+    def __init__(
+        self,
+        session_factory,
+        store_events,
+        api_key,
+        http,
+        concurrency=2,
+        batch_size=200,
+        pause_ms=50,
+        timeout=30,
+    ):
+        """
+        store_events(events) applies a list of sync events (and may raise
+        when the sync path is overloaded). http is the shared HttpClient.
+        """
+        self.session_factory = session_factory
+        self.store_events = store_events
+        self.api_key = api_key
+        self.http = http
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.pause = pause_ms / 1000.0
+        self.timeout = timeout
+        self._running = threading.Lock()
+
+        self.runs = 0
+        self.rows_repaired = 0
+        self.last_report = None
+
+    def stats(self):
+        return {
+            "runs": self.runs,
+            "rows_repaired": self.rows_repaired,
+            "running": self._running.locked(),
+            "last_run": self.last_report,
+        }
+
+    # ----------------- snapshot + diff -----------------
+
+    def fetch_snapshot(self, base_url):
+        resp = self.http.get(
+            f"{base_url.rstrip('/')}/api/sync/availability",
+            headers={"X-API-Key": self.api_key},
+            timeout=self.timeout,
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    def diff(self, branch_code, snapshot):
+        """
+        Compare a branch snapshot with central's rows for that branch.
+        Returns (repair events, stats). One query, then set operations on
+        ISBN keys, so differently spelled ISBNs still line up.
+        """
+        session = self.session_factory()
+        try:
+            central = {
+                key: (total, available, holds or 0, version or 0, isbn)
+                for key, isbn, total, available, holds, version in session.execute(
+                    select(
+                        BookAvailability.isbn_key,
+                        BookAvailability.isbn,
+                        BookAvailability.total_copies,
+                        BookAvailability.available_copies,
+                        BookAvailability.holds_waiting,
+                        BookAvailability.version,
+                    ).where(
+                        (BookAvailability.branch_code == branch_code)
+                        & BookAvailability.isbn_key.isnot(None)
+                    )
+                )
+            }
+        finally:
+            session.close()
+
+        books = {}
+        for b in snapshot["books"]:
+            key = try_isbn_key(b["isbn"])
+            if key is not None:
+                books[key] = b
+        high_water = snapshot.get("version")
+
+        missing = books.keys() - central.keys()
+        extra = central.keys() - books.keys()
+        # branches that predate holds send no holds_waiting; don't flag those
+        mismatched = {
+            key
+            for key in books.keys() & central.keys()
+            if (
+                books[key]["total_copies"],
+                books[key]["available_copies"],
+                books[key].get("holds_waiting", central[key][2]),
+            )
+            != central[key][:3]
+        }
+        # Rows central got from events newer than the snapshot are not drift
+        stale_extra = set()
+        if high_water is not None:
+            stale_extra = {key for key in extra if central[key][3] > high_water}
+        removable = extra - stale_extra
+
+        events = []
+        for key in missing | mismatched:
+            b = books[key]
+            events.append(
+                {
+                    "isbn": b["isbn"],
+                    "isbn_key": key,
+                    "branch_code": branch_code,
+                    "total_copies": b["total_copies"],
+                    "available_copies": b["available_copies"],
+                    "holds_waiting": b.get("holds_waiting"),
+                    "version": b.get("version"),
+                    "title": b.get("title"),
+                    "author": b.get("author"),
+                    "publisher": b.get("publisher"),
+                    "year": b.get("year"),
+                    "borrows": None,
+                    "repair": True,
+                }
+            )
+        for key in removable:
+            events.append(
+                {
+                    "isbn": central[key][4],
+                    "isbn_key": key,
+                    "branch_code": branch_code,
+                    "total_copies": 0,
+                    "available_copies": 0,
+                    "version": high_water,
+                    "borrows": None,
+                    "repair": True,
+                    "deleted": True,
+                }
+            )
+
+        stats = {
+            "rows": len(snapshot["books"]),
+            "invalid_isbns": len(snapshot["books"]) - len(books),
+            "missing": len(missing),
+            "mismatched": len(mismatched),
+            "removed": len(removable),
+            "skipped_newer": len(stale_extra),
+        }
+        return events, stats
+
+    # ----------------- a full pass -----------------
+
+    def _repair(self, events):
+        """
+        Apply repair events in small batches with a pause in between, so
+        live sync traffic keeps getting through the same writer.
+        """
+        done = 0
+        for i in range(0, len(events), self.batch_size):
+            if i:
+                time.sleep(self.pause)
+            batch = events[i : i + self.batch_size]
+            self.store_events(batch)
+            done += len(batch)
+        return done
+
+    def run(self):
+        """
+        Reconcile every active branch once. Returns the report, or None if
+        a pass is already running.
+        """
+        if not self._running.acquire(blocking=False):
+            return None
+        try:
+            started = time.monotonic()
+            session = self.session_factory()
+            try:
+                branches = [
+                    (b.code, b.base_url)
+                    for b in session.execute(
+                        select(Branch).where(Branch.is_active.is_(True))
+                    ).scalars()
+                ]
+            finally:
+                session.close()
+
+            def fetch(branch):
+                code, base_url = branch
+                try:
+                    return code, self.fetch_snapshot(base_url), None
+                except Exception as e:
+                    return code, None, str(e)
+
+            report = {}
+            with ThreadPoolExecutor(max_workers=max(1, self.concurrency)) as pool:
+                for code, snapshot, error in pool.map(fetch, branches):
+                    if error:
+                        logger.warning("Reconcile: %s unreachable: %s", code, error)
+                        report[code] = {"error": error}
+                        continue
+                    events, stats = self.diff(code, snapshot)
+                    try:
+                        stats["repaired"] = self._repair(events)
+                    except Exception as e:
+                        logger.warning("Reconcile: repairs for %s deferred: %s", code, e)
+                        stats["error"] = str(e)
+                    self.rows_repaired += stats.get("repaired", 0)
+                    report[code] = stats
+
+            drift = sum(
+                r.get("missing", 0) + r.get("mismatched", 0) + r.get("removed", 0)
+                for r in report.values()
+            )
+            self.runs += 1
+            self.last_report = {
+                "finished_at": datetime.utcnow().isoformat() + "Z",
+                "duration_ms": int((time.monotonic() - started) * 1000),
+                "drift": drift,
+                "branches": report,
+            }
+            if drift:
+                logger.info("Reconcile: repaired %d drifted rows", drift)
+            return self.last_report
+        finally:
+            self._running.release()
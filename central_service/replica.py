@@ -0,0 +1,128 @@
+# central_service/replica.py
+"""
+Read/write split for central.
+
+Read-only endpoints ask the router for a session; it hands out a replica
+session when the replica is fresh enough and falls back to the primary
+otherwise. Freshness is measured with a heartbeat row written on the
+primary and read back from the replica, which works the same for a real
+replica and for the periodically refreshed SQLite copy used locally.
+"""
+import logging
+import sqlite3
+import threading
+import time
+
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+from .models import ReplicaHeartbeat
+
+logger = logging.getLogger(__name__)
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+class ReplicaRouter:
+    def __init__(self, primary_engine, replica_engine, max_staleness_seconds, check_interval=1.0):
+        self.primary_engine = primary_engine
+        self.replica_engine = replica_engine
+        self.max_staleness_ms = int(max_staleness_seconds * 1000)
+        self.check_interval = check_interval
+        self.PrimarySession = sessionmaker(bind=primary_engine, autoflush=False, autocommit=False)
+        self.ReplicaSession = (
+            sessionmaker(bind=replica_engine, autoflush=False, autocommit=False)
+            if replica_engine is not None
+            else None
+        )
+        self._replica_beat_ms = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+        self.replica_reads = 0
+        self.primary_reads = 0
+
+    # ----------------- routing -----------------
+
+    def _replica_beat(self):
+        """
+        Heartbeat visible on the replica, re-read at most every check_interval.
+        """
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return self._replica_beat_ms
+        with self._lock:
+            if now - self._checked_at >= self.check_interval:
+                try:
+                    with self.replica_engine.connect() as conn:
+                        self._replica_beat_ms = conn.execute(
+                            select(ReplicaHeartbeat.beat_ms).where(ReplicaHeartbeat.id == 1)
+                        ).scalar_one_or_none()
+                except Exception as e:
+                    logger.debug("Replica heartbeat check failed: %s", e)
+                    self._replica_beat_ms = None
+                self._checked_at = now
+        return self._replica_beat_ms
+
+    def read_session(self, write_token=None):
+        """
+        Session for a read-only request. write_token is the X-Write-Token a
+        client got back from its last write; if the replica hasn't caught up
+        to it, the read goes to the primary (read-your-writes).
+        """
+        if self.ReplicaSession is not None:
+            beat = self._replica_beat()
+            fresh = beat is not None and now_ms() - beat <= self.max_staleness_ms
+            caught_up = True
+            if write_token:
+                try:
+                    caught_up = beat is not None and int(write_token) <= beat
+                except ValueError:
+                    pass
+            if fresh and caught_up:
+                self.replica_reads += 1
+                session = self.ReplicaSession()
+                # lets callers tell which point in time they are reading
+                session.info["replica_beat_ms"] = beat
+                return session
+        self.primary_reads += 1
+        return self.PrimarySession()
+
+    def lag_seconds(self):
+        beat = self._replica_beat() if self.replica_engine is not None else None
+        return None if beat is None else (now_ms() - beat) / 1000.0
+
+    # ----------------- maintenance -----------------
+
+    def beat(self):
+        """
+        Stamp the heartbeat on the primary.
+        """
+        session = self.PrimarySession()
+        try:
+            hb = session.get(ReplicaHeartbeat, 1)
+            if hb is None:
+                session.add(ReplicaHeartbeat(id=1, beat_ms=now_ms()))
+            else:
+                hb.beat_ms = now_ms()
+            session.commit()
+        finally:
+            session.close()
+
+    def refresh_sqlite_copy(self):
+        """
+        Local stand-in for replication: heartbeat, then copy the primary
+        SQLite file onto the replica file with the online backup API.
+        """
+        self.beat()
+        src = sqlite3.connect(self.primary_engine.url.database)
+        dst = sqlite3.connect(self.replica_engine.url.database)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+        # make the next read see the new heartbeat straight away
+        self._checked_at = 0.0
@@ -0,0 +1,175 @@
+# central_service/suggest.py
+"""
+Typeahead over the global catalog.
+
+Two sorted lists, searched with bisect:
+- every title's normalized full text, so "harry pot" finds titles that
+  start with what was typed (these rank first, alphabetically);
+- every distinct title/author token, each with the ids of the titles that
+  contain it, so "pott" or "rowl" find titles by a later word or the author.
+
+A lookup is a binary search plus a short forward scan that stops as soon as
+`limit` titles are found (or after max_scan postings for multi-word
+prefixes whose other words rarely match), so cost does not grow with the
+catalog. The index is built once at startup and kept current from the sync
+path when titles are added or renamed.
+"""
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+
+_WORD = re.compile(r"[^\W_]+")
+
+
+def words(text):
+    """
+    Lowercased, accent-stripped words of text.
+    """
+    text = text or ""
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(c for c in text if not unicodedata.combining(c))
+    return _WORD.findall(text.casefold())
+
+
+class SuggestIndex:
+    def __init__(self, max_scan=1000):
+        self.max_scan = max_scan
+        self._lock = threading.Lock()
+        self._docs = {}      # id -> (isbn, title, author, phrase, tokens)
+        self._phrases = []   # sorted (phrase, id)
+        self._tokens = []    # sorted distinct tokens
+        self._postings = {}  # token -> [id, ...]
+
+    @staticmethod
+    def _entry(isbn, title, author):
+        tokens = tuple(dict.fromkeys(words(title) + words(author)))
+        return (isbn, title, author, " ".join(words(title)), tokens)
+
+    # ----------------- updates -----------------
+
+    def load(self, rows):
+        """
+        rows: iterable of (id, isbn, title, author). Replaces the index.
+        """
+        docs, postings = {}, {}
+        for doc_id, isbn, title, author in rows:
+            entry = self._entry(isbn, title, author)
+            docs[doc_id] = entry
+            for token in entry[4]:
+                postings.setdefault(token, []).append(doc_id)
+        phrases = sorted((entry[3], doc_id) for doc_id, entry in docs.items())
+        tokens = sorted(postings)
+        with self._lock:
+            self._docs, self._phrases = docs, phrases
+            self._tokens, self._postings = tokens, postings
+
+    def _remove(self, doc_id):
+        entry = self._docs.pop(doc_id)
+        i = bisect_left(self._phrases, (entry[3], doc_id))
+        del self._phrases[i]
+        for token in entry[4]:
+            ids = self._postings[token]
+            ids.remove(doc_id)
+            if not ids:
+                del self._postings[token]
+                del self._tokens[bisect_left(self._tokens, token)]
+
+    def upsert(self, doc_id, isbn, title, author):
+        """
+        Add a title, or re-index it if its title/author changed.
+        """
+        with self._lock:
+            old = self._docs.get(doc_id)
+            if old is not None:
+                if old[:3] == (isbn, title, author):
+                    return
+                self._remove(doc_id)
+            entry = self._entry(isbn, title, author)
+            self._docs[doc_id] = entry
+            insort(self._phrases, (entry[3], doc_id))
+            for token in entry[4]:
+                ids = self._postings.get(token)
+                if ids is None:
+                    self._postings[token] = [doc_id]
+                    insort(self._tokens, token)
+                else:
+                    ids.append(doc_id)
+
+    # ----------------- lookups -----------------
+
+    def _narrowest(self, query):
+        """
+        (lo, hi, word): the token range of the query word that occurs in
+        the fewest titles. Caller holds the lock.
+        """
+        best = None
+        for w in query:
+            lo = bisect_left(self._tokens, w)
+            hi = bisect_left(self._tokens, w + "\U0010ffff", lo)
+            # counting postings is only worth it for short ranges; a prefix
+            # matching many tokens is assumed to match many titles
+            if hi - lo <= 32:
+                size = (sum(len(self._postings[t]) for t in self._tokens[lo:hi]), 0)
+            else:
+                size = (float("inf"), hi - lo)
+            if best is None or size < best[0]:
+                best = (size, lo, hi, w)
+        return best[1:]
+
+    def suggest(self, prefix, limit=10):
+        """
+        Up to `limit` {"isbn", "title"} for titles matching prefix: titles
+        that start with it first, then titles with a word (or author) that
+        does. With several words, each must prefix some word of the title.
+        """
+        query = words(prefix)
+        if not query or limit <= 0:
+            return []
+        phrase = " ".join(query)
+        found = []
+        seen = set()
+
+        with self._lock:
+            phrases = self._phrases
+            i = bisect_left(phrases, (phrase,))
+            while i < len(phrases) and len(found) < limit:
+                text, doc_id = phrases[i]
+                if not text.startswith(phrase):
+                    break
+                seen.add(doc_id)
+                found.append(doc_id)
+                i += 1
+
+            # Then titles with a matching word, driven from the query word
+            # with the fewest postings; the others are checked per title
+            lo, hi, driver = self._narrowest(query)
+            others = [w for w in query if w != driver]
+            tokens = self._tokens
+            scanned = 0
+            for j in range(lo, hi):
+                if len(found) >= limit or scanned >= self.max_scan:
+                    break
+                for doc_id in self._postings[tokens[j]]:
+                    scanned += 1
+                    if doc_id not in seen:
+                        seen.add(doc_id)
+                        doc_tokens = self._docs[doc_id][4]
+                        if all(any(t.startswith(w) for t in doc_tokens) for w in others):
+                            found.append(doc_id)
+                            if len(found) >= limit:
+                                break
+                    if scanned >= self.max_scan:
+                        break
+
+            return [
+                {"isbn": self._docs[d][0], "title": self._docs[d][1]} for d in found
+            ]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "titles": len(self._docs),
+                "tokens": len(self._tokens),
+            }
@@ -0,0 +1,173 @@
+# central_service/sync_writer.py
+"""
+Group-commit writer for availability sync.
+
+Request handlers put events on a bounded queue and wait; a single writer
+thread drains the queue in micro-batches and applies each batch in one
+transaction, so a burst of N syncs costs a handful of commits instead
+of N.
+"""
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class WriterBusy(Exception):
+    """The queue is full or the batch was not durable within the max wait."""
+
+
+class _Ticket:
+    __slots__ = ("event", "done", "error", "result")
+
+    def __init__(self, event):
+        self.event = event
+        self.done = threading.Event()
+        self.error = None
+        self.result = None
+
+
+class GroupCommitWriter:
+    """
+    apply_batch(events) is called on the writer thread with a list of
+    event dicts (already reduced to one write per key) and must commit
+    them in a single transaction. Its return value, if any, is a dict
+    keyed like key_func(event) and is handed back to each waiter.
+
+    newer(a, b) decides whether event a replaces event b for the same key
+    inside a batch; by default the later arrival wins. merge(kept, dropped),
+    if given, returns the surviving event with whatever it must carry over
+    from the one it replaces.
+    """
+
+    def __init__(
+        self,
+        apply_batch,
+        key_func,
+        newer=None,
+        merge=None,
+        max_queue=10000,
+        max_batch=500,
+        batch_window_ms=5,
+        max_wait_ms=2000,
+    ):
+        self.apply_batch = apply_batch
+        self.key_func = key_func
+        self.newer = newer or (lambda a, b: True)
+        self.merge = merge or (lambda kept, dropped: kept)
+        self.max_batch = max_batch
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        # simple counters, read by whoever wants to report them
+        self.batches = 0
+        self.events_applied = 0
+        self.events_coalesced = 0
+        self.rejected = 0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="sync-group-commit", daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, event):
+        """
+        Queue one event and block until its batch has committed.
+        Raises WriterBusy when the queue is full or the wait times out.
+        """
+        return self.submit_many([event])[0]
+
+    def submit_many(self, events):
+        """
+        Queue several events and block until all of them have committed.
+        Returns their results in order. Raises WriterBusy when the queue is
+        full or the wait times out.
+        """
+        self._ensure_started()
+        tickets = []
+        for event in events:
+            ticket = _Ticket(event)
+            try:
+                self._queue.put_nowait(ticket)
+            except queue.Full:
+                self.rejected += 1
+                raise WriterBusy("sync queue is full")
+            tickets.append(ticket)
+
+        deadline = time.monotonic() + self.max_wait
+        for ticket in tickets:
+            if not ticket.done.wait(max(0.0, deadline - time.monotonic())):
+                self.rejected += 1
+                raise WriterBusy("sync batch not committed in time")
+            if ticket.error is not None:
+                raise ticket.error
+        return [t.result for t in tickets]
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "batches": self.batches,
+            "events_applied": self.events_applied,
+            "events_coalesced": self.events_coalesced,
+            "rejected": self.rejected,
+        }
+
+    # ----------------- writer thread -----------------
+
+    def _collect(self):
+        tickets = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_window
+        while len(tickets) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    tickets.append(self._queue.get(timeout=remaining))
+                else:
+                    tickets.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return tickets
+
+    def _run(self):
+        while True:
+            tickets = self._collect()
+
+            # one write per key inside the batch
+            latest = {}
+            for t in tickets:
+                key = self.key_func(t.event)
+                current = latest.get(key)
+                if current is None:
+                    latest[key] = t.event
+                elif self.newer(t.event, current):
+                    latest[key] = self.merge(t.event, current)
+                else:
+                    latest[key] = self.merge(current, t.event)
+            events = list(latest.values())
+
+            try:
+                results = self.apply_batch(events) or {}
+                error = None
+            except Exception as e:
+                logger.exception("Group commit of %d sync events failed", len(events))
+                results = {}
+                error = e
+
+            self.batches += 1
+            if error is None:
+                self.events_applied += len(events)
+                self.events_coalesced += len(tickets) - len(events)
+            for t in tickets:
+                t.error = error
+                t.result = results.get(self.key_func(t.event))
+                t.done.set()
@@ -0,0 +1,175 @@
+# central_service/user_import.py
+"""
+Bulk patron import: parse a CSV or NDJSON upload as it streams in and
+upsert UserCentral one chunk (one transaction) at a time.
+"""
+import csv
+import json
+from datetime import datetime
+
+from sqlalchemy import func, insert, or_, select, update
+
+from .models import UserCentral
+
+FIELDS = ("external_id", "name", "email", "home_branch")
+
+
+def iter_rows(lines, fmt):
+    """
+    Yield (row_number, dict or None, error) from an iterable of byte lines.
+    fmt is "csv" (header row required) or "ndjson".
+    """
+    text = (line.decode("utf-8-sig") for line in lines)
+    if fmt == "csv":
+        for n, row in enumerate(csv.DictReader(text), start=1):
+            yield n, row, None
+        return
+
+    n = 0
+    for line in text:
+        line = line.strip()
+        if not line:
+            continue
+        n += 1
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield n, None, "invalid JSON"
+            continue
+        if not isinstance(row, dict):
+            yield n, None, "expected a JSON object"
+            continue
+        yield n, row, None
+
+
+def _clean(row):
+    out = {}
+    for f in FIELDS:
+        v = row.get(f)
+        v = str(v).strip() if v is not None else ""
+        out[f] = v or None
+    return out
+
+
+class UserImport:
+    """
+    Runs one import. Rows are fed with add(); every chunk_size rows are
+    written in a single transaction. deliver(users) is called after each
+    commit with the rows that were created or changed.
+
+    Duplicates are rejected per row: an external_id seen earlier in the
+    same upload, or an email that already belongs to another patron.
+    """
+
+    def __init__(self, session_factory, chunk_size=1000, deliver=None):
+        self.session_factory = session_factory
+        self.chunk_size = chunk_size
+        self.deliver = deliver
+        self.results = []
+        self.counts = {"created": 0, "updated": 0, "unchanged": 0, "error": 0}
+        self._seen_ids = set()
+        self._seen_emails = {}  # email -> external_id, within this upload
+        self._chunk = []
+
+    def _result(self, n, external_id, status, error=None):
+        r = {"row": n, "external_id": external_id, "status": status}
+        if error:
+            r["error"] = error
+        self.results.append(r)
+        self.counts["error" if error else status] += 1
+
+    def add(self, n, row, error=None):
+        if error:
+            self._result(n, None, "error", error)
+            return
+        row = _clean(row)
+        ext, email = row["external_id"], row["email"]
+        if not ext or not row["name"] or not email:
+            self._result(n, ext, "error", "external_id, name, email are required")
+            return
+        if ext in self._seen_ids:
+            self._result(n, ext, "error", "duplicate external_id in upload")
+            return
+        owner = self._seen_emails.get(email.lower())
+        if owner is not None:
+            self._result(n, ext, "error", f"email already used by {owner} in upload")
+            return
+        self._seen_ids.add(ext)
+        self._seen_emails[email.lower()] = ext
+
+        self._chunk.append((n, row))
+        if len(self._chunk) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        chunk, self._chunk = self._chunk, []
+        if not chunk:
+            return
+
+        ids = {row["external_id"] for _, row in chunk}
+        emails = {row["email"].lower() for _, row in chunk}
+        session = self.session_factory()
+        try:
+            existing = {}
+            email_owner = {}
+            for u in session.execute(
+                select(UserCentral).where(
+                    or_(
+                        UserCentral.external_id.in_(ids),
+                        func.lower(UserCentral.email).in_(emails),
+                    )
+                )
+            ).scalars():
+                if u.external_id in ids:
+                    existing[u.external_id] = u
+                email_owner[u.email.lower()] = u.external_id
+
+            inserts, updates, changed = [], [], []
+            now = datetime.utcnow()
+            for n, row in chunk:
+                ext = row["external_id"]
+                owner = email_owner.get(row["email"].lower())
+                if owner is not None and owner != ext:
+                    self._result(n, ext, "error", f"email already used by {owner}")
+                    continue
+
+                user = existing.get(ext)
+                if user is None:
+                    inserts.append(dict(row, created_at=now))
+                    changed.append(row)
+                    self._result(n, ext, "created")
+                    continue
+
+                # like POST /api/users, a missing home_branch keeps the old one
+                home_branch = row["home_branch"] or user.home_branch
+                if (user.name, user.email, user.home_branch) == (
+                    row["name"], row["email"], home_branch
+                ):
+                    self._result(n, ext, "unchanged")
+                    continue
+                updates.append(
+                    {
+                        "id": user.id,
+                        "name": row["name"],
+                        "email": row["email"],
+                        "home_branch": home_branch,
+                    }
+                )
+                changed.append(dict(row, home_branch=home_branch))
+                self._result(n, ext, "updated")
+
+            if inserts:
+                session.execute(insert(UserCentral), inserts)
+            if updates:
+                session.execute(update(UserCentral), updates)
+            session.commit()
+        finally:
+            session.close()
+
+        if changed and self.deliver:
+            self.deliver(changed)
+
+    def finish(self):
+        self.flush()
+        self.results.sort(key=lambda r: r["row"])
+        return {"summary": dict(self.counts, rows=len(self.results)), "results": self.results}
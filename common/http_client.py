@@ -0,0 +1,259 @@
+# common/http_client.py
+"""
+Shared outbound HTTP client for service-to-service calls.
+
+One HttpClient per process replaces bare requests.get/post:
+- a keep-alive requests.Session per target host, its pool capped at
+  pool_size connections (extra concurrent calls open a connection that is
+  closed afterwards instead of being kept);
+- deadlines: a call never outlives the caller's deadline, which is either
+  passed in or inherited from the incoming request's X-Deadline-Ms header,
+  and the remaining budget is forwarded to the next hop the same way;
+- retries with jittered backoff, only for idempotent calls (GET/HEAD/
+  PUT/DELETE, or callers passing idempotent=True) and only when the
+  request may not have been processed (connection errors, timeouts);
+- a circuit breaker per host: after breaker_failures consecutive failures
+  calls fail fast with CircuitOpen for breaker_reset seconds, then a
+  single trial call decides whether to close it again;
+- per-host request, failure, retry and latency statistics plus pool usage.
+
+Errors are requests exceptions (CircuitOpen is a ConnectionError,
+DeadlineExceeded a Timeout), so existing except clauses keep working.
+"""
+import random
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEADLINE_HEADER = "X-Deadline-Ms"
+_IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# Server errors that count against the breaker; 503/429 are deliberate
+# back-pressure and are left to the caller
+_BREAKER_STATUSES = {500, 502, 504}
+
+
+class CircuitOpen(requests.ConnectionError):
+    pass
+
+
+class DeadlineExceeded(requests.Timeout):
+    pass
+
+
+def install_deadlines(app):
+    """
+    Record the deadline of incoming requests that carry X-Deadline-Ms, so
+    outbound calls made while handling them inherit it.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def _read_deadline():
+        budget = request.headers.get(DEADLINE_HEADER, type=int)
+        if budget is not None:
+            g.deadline = time.monotonic() + max(budget, 0) / 1000.0
+
+
+def _request_deadline():
+    try:
+        from flask import g, has_request_context
+    except ImportError:
+        return None
+    return g.get("deadline") if has_request_context() else None
+
+
+class _Host:
+    def __init__(self, session):
+        self.session = session
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.short_circuited = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.trial_in_flight = False
+        self.latencies = deque(maxlen=1024)
+
+
+class HttpClient:
+    def __init__(
+        self,
+        pool_size=10,
+        timeout=3.0,
+        connect_timeout=1.0,
+        retries=2,
+        backoff=0.05,
+        breaker_failures=5,
+        breaker_reset=10.0,
+    ):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self._session_factory = self._new_session
+
+    def _new_session(self, host):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def set_transport(self, transport):
+        """
+        Send every call through transport (anything with a requests-style
+        request(method, url, **kwargs)) instead of real sessions. Used by
+        bench_sync.py to run the services in one process.
+        """
+        with self._lock:
+            self._session_factory = lambda host: transport
+            self._hosts = {}
+
+    def _host(self, netloc):
+        host = self._hosts.get(netloc)
+        if host is None:
+            with self._lock:
+                host = self._hosts.get(netloc)
+                if host is None:
+                    host = _Host(self._session_factory(netloc))
+                    self._hosts[netloc] = host
+        return host
+
+    # ----------------- circuit breaker -----------------
+
+    def _admit(self, host):
+        with host.lock:
+            if host.consecutive_failures < self.breaker_failures:
+                return
+            if time.monotonic() >= host.open_until and not host.trial_in_flight:
+                host.trial_in_flight = True  # half-open: let one call through
+                return
+            host.short_circuited += 1
+        raise CircuitOpen("circuit open for this host")
+
+    def _record(self, host, ok, elapsed):
+        with host.lock:
+            host.requests += 1
+            host.latencies.append(elapsed)
+            host.trial_in_flight = False
+            if ok:
+                host.consecutive_failures = 0
+            else:
+                host.failures += 1
+                host.consecutive_failures += 1
+                if host.consecutive_failures >= self.breaker_failures:
+                    host.open_until = time.monotonic() + self.breaker_reset
+
+    # ----------------- requests -----------------
+
+    def request(self, method, url, timeout=None, deadline=None, idempotent=None, **kwargs):
+        """
+        timeout: read timeout for each attempt (default self.timeout).
+        deadline: time.monotonic() value by which the whole call, retries
+        included, must be done; defaults to the incoming request's.
+        """
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in _IDEMPOTENT_METHODS
+        if deadline is None:
+            deadline = _request_deadline()
+        host = self._host(urlsplit(url).netloc)
+        read_timeout = self.timeout if timeout is None else timeout
+        attempts = 1 + (self.retries if idempotent else 0)
+
+        for attempt in range(attempts):
+            connect, read = self.connect_timeout, read_timeout
+            headers = dict(kwargs.pop("headers", None) or {})
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise DeadlineExceeded("deadline exceeded before the call")
+                connect, read = min(connect, remaining), min(read, remaining)
+                headers[DEADLINE_HEADER] = str(int(remaining * 1000))
+            kwargs["headers"] = headers
+
+            self._admit(host)
+            started = time.monotonic()
+            try:
+                resp = host.session.request(method, url, timeout=(connect, read), **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self._record(host, False, time.monotonic() - started)
+                if attempt + 1 >= attempts:
+                    raise
+            except Exception:
+                # anything else (broken chunked body, redirect loop, ...) is
+                # not retried, but must still be recorded: this may be the
+                # half-open trial, which would otherwise keep the circuit open
+                self._record(host, False, time.monotonic() - started)
+                raise
+            else:
+                self._record(
+                    host, resp.status_code not in _BREAKER_STATUSES, time.monotonic() - started
+                )
+                return resp
+
+            with host.lock:
+                host.retries += 1
+            pause = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+            if deadline is not None:
+                pause = min(pause, max(0.0, deadline - time.monotonic()))
+            time.sleep(pause)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    # ----------------- stats -----------------
+
+    def _pool_stats(self, session):
+        adapter = getattr(session, "adapters", {}).get("http://")
+        manager = getattr(adapter, "poolmanager", None)
+        if manager is None:
+            return None
+        opened = idle = 0
+        # the pool container can't be iterated safely; keys() is a copy
+        for key in manager.pools.keys():
+            pool = manager.pools.get(key)
+            if pool is None:
+                continue
+            opened += pool.num_connections
+            if pool.pool is not None:
+                idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        return {"connections_opened": opened, "idle": idle, "max_size": self.pool_size}
+
+    def stats(self):
+        out = {}
+        for netloc, host in list(self._hosts.items()):
+            with host.lock:
+                latencies = sorted(host.latencies)
+                entry = {
+                    "requests": host.requests,
+                    "failures": host.failures,
+                    "retries": host.retries,
+                    "short_circuited": host.short_circuited,
+                    "circuit": (
+                        "open"
+                        if host.consecutive_failures >= self.breaker_failures
+                        else "closed"
+                    ),
+                }
+            if latencies:
+                pick = lambda p: round(latencies[int(p * (len(latencies) - 1))] * 1000, 1)
+                entry["latency_ms"] = {"p50": pick(0.5), "p99": pick(0.99), "max": pick(1.0)}
+            pool = self._pool_stats(host.session)
+            if pool is not None:
+                entry["pool"] = pool
+            out[netloc] = entry
+        return out
@@ -0,0 +1,62 @@
+# common/isbn.py
+"""
+ISBN normalization.
+
+Books arrive as ISBN-10 or ISBN-13, with or without hyphens/spaces. Every
+form of the same book maps to one key: its ISBN-13 as an integer (fits a
+BIGINT). Indexes and lookups use the key; the string a branch entered is
+kept for display.
+"""
+
+
+class InvalidIsbn(ValueError):
+    pass
+
+
+def _isbn13_check(first12):
+    total = sum(int(c) * (3 if i % 2 else 1) for i, c in enumerate(first12))
+    return str((10 - total % 10) % 10)
+
+
+def _isbn10_check(first9):
+    total = sum(int(c) * (10 - i) for i, c in enumerate(first9))
+    check = (11 - total % 11) % 11
+    return "X" if check == 10 else str(check)
+
+
+def isbn_key(raw):
+    """
+    Canonical integer key for an ISBN-10 or ISBN-13. Raises InvalidIsbn for
+    anything else, including a wrong check digit.
+    """
+    s = "".join(str(raw or "").split()).replace("-", "").upper()
+
+    if len(s) == 10 and s[:9].isdigit() and (s[9].isdigit() or s[9] == "X"):
+        if _isbn10_check(s[:9]) != s[9]:
+            raise InvalidIsbn(f"bad ISBN-10 check digit: {raw!r}")
+        first12 = "978" + s[:9]
+        return int(first12 + _isbn13_check(first12))
+
+    if len(s) == 13 and s.isdigit() and s[:3] in ("978", "979"):
+        if _isbn13_check(s[:12]) != s[12]:
+            raise InvalidIsbn(f"bad ISBN-13 check digit: {raw!r}")
+        return int(s)
+
+    raise InvalidIsbn(f"not an ISBN-10 or ISBN-13: {raw!r}")
+
+
+def try_isbn_key(raw):
+    """
+    isbn_key, or None when raw is not a valid ISBN.
+    """
+    try:
+        return isbn_key(raw)
+    except InvalidIsbn:
+        return None
+
+
+def isbn13(key):
+    """
+    Bare 13-digit string for a key.
+    """
+    return f"{key:013d}"
@@ -0,0 +1,42 @@
+# common/periodic.py
+"""
+Tiny helper for the background jobs both services run (deny-list refresh,
+sweepers, schedulers). Each job gets one daemon thread.
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def start_periodic(name, interval_seconds, func, run_immediately=False):
+    """
+    Call func() every interval_seconds on a daemon thread.
+    Exceptions are logged and the loop keeps going.
+    """
+
+    def loop():
+        if not run_immediately:
+            time.sleep(interval_seconds)
+        while True:
+            try:
+                func()
+            except Exception:
+                logger.exception("Periodic job %s failed", name)
+            time.sleep(interval_seconds)
+
+    t = threading.Thread(target=loop, name=name, daemon=True)
+    t.start()
+    return t
+
+
+def in_serving_process(debug):
+    """
+    False in the Werkzeug reloader's watcher process. With debug=True the
+    watcher runs __main__ as well but never serves requests, so jobs
+    started there would run twice and update state the serving process
+    never sees.
+    """
+    return not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true"
@@ -0,0 +1,148 @@
+# common/profiling.py
+"""
+Opt-in per-request profiling for the Flask services.
+
+When PROFILING_ENABLED is off nothing is installed at all. When it is on,
+a request is profiled if it carries "X-Profile: <PROFILING_TOKEN>" or is
+picked by PROFILING_SAMPLE_RATE. The cProfile stats and the SQL statements
+the request ran are written to PROFILING_DIR, named after the route and
+duration, and the directory is capped at PROFILING_MAX_FILES profiles.
+"""
+import cProfile
+import hmac
+import io
+import itertools
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+
+from flask import g, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# cProfile can only run one profiler at a time reliably, so profiled
+# requests are serialized; a request that can't get the lock just runs
+# unprofiled.
+_profile_lock = threading.Lock()
+_sql_capture = threading.local()
+_profile_seq = itertools.count(1)
+
+
+def _route_slug():
+    rule = request.url_rule.rule if request.url_rule else request.path
+    return re.sub(r"[^A-Za-z0-9]+", "_", rule).strip("_") or "root"
+
+
+def _rotate(directory, max_files):
+    profiles = sorted(
+        (f for f in os.listdir(directory) if f.endswith(".prof")),
+        key=lambda f: os.path.getmtime(os.path.join(directory, f)),
+    )
+    for old in profiles[: max(0, len(profiles) - max_files)]:
+        for path in (old, old[: -len(".prof")] + ".txt"):
+            try:
+                os.remove(os.path.join(directory, path))
+            except FileNotFoundError:
+                pass
+
+
+def _attach_sql_capture(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if getattr(_sql_capture, "statements", None) is not None:
+            conn.info.setdefault("_profile_t0", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        statements = getattr(_sql_capture, "statements", None)
+        if statements is not None and conn.info.get("_profile_t0"):
+            elapsed = time.perf_counter() - conn.info["_profile_t0"].pop()
+            statements.append((elapsed, statement, parameters))
+
+
+def install_profiling(app, engines):
+    """
+    Register the profiling hooks on app if PROFILING_ENABLED is set.
+    engines: SQLAlchemy engines whose statements should be captured.
+    """
+    if not app.config.get("PROFILING_ENABLED"):
+        return
+
+    directory = app.config["PROFILING_DIR"]
+    max_files = app.config["PROFILING_MAX_FILES"]
+    token = app.config.get("PROFILING_TOKEN")
+    sample_rate = app.config["PROFILING_SAMPLE_RATE"]
+    os.makedirs(directory, exist_ok=True)
+
+    for engine in engines:
+        if engine is not None:
+            _attach_sql_capture(engine)
+
+    @app.before_request
+    def _start_profile():
+        sent = request.headers.get("X-Profile")
+        wanted = bool(token and sent and hmac.compare_digest(sent, token))
+        if not wanted and not (sample_rate and random.random() < sample_rate):
+            return
+        if not _profile_lock.acquire(blocking=False):
+            return
+        g._profiler = cProfile.Profile()
+        g._profile_started = time.perf_counter()
+        _sql_capture.statements = []
+        g._profiler.enable()
+
+    @app.after_request
+    def _finish_profile(response):
+        profiler = g.pop("_profiler", None)
+        if profiler is None:
+            return response
+        try:
+            profiler.disable()
+            duration_ms = (time.perf_counter() - g.pop("_profile_started")) * 1000
+            statements = _sql_capture.statements
+            _sql_capture.statements = None
+
+            name = "{}-{}_{}_{}_{}ms".format(
+                time.strftime("%Y%m%dT%H%M%S"),
+                next(_profile_seq),
+                request.method,
+                _route_slug(),
+                int(duration_ms),
+            )
+            base = os.path.join(directory, name)
+            profiler.dump_stats(base + ".prof")
+
+            out = io.StringIO()
+            out.write(f"{request.method} {request.full_path} -> {response.status_code}\n")
+            out.write(f"duration: {duration_ms:.1f} ms\n")
+            sql_ms = sum(s[0] for s in statements) * 1000
+            out.write(f"\nSQL: {len(statements)} statements, {sql_ms:.1f} ms\n")
+            for elapsed, statement, params in statements:
+                out.write(f"  [{elapsed * 1000:.2f} ms] {' '.join(statement.split())}  {params!r}\n")
+            out.write("\nTop functions by cumulative time:\n")
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(30)
+            with open(base + ".txt", "w") as f:
+                f.write(out.getvalue())
+
+            _rotate(directory, max_files)
+            response.headers["X-Profile-Id"] = name
+        except Exception:
+            logger.exception("Writing request profile failed")
+        finally:
+            _sql_capture.statements = None
+            _profile_lock.release()
+        return response
+
+    @app.teardown_request
+    def _abandon_profile(exc):
+        # the view raised, so after_request never ran: just clean up
+        profiler = g.pop("_profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            _sql_capture.statements = None
+            _profile_lock.release()
@@ -0,0 +1,68 @@
+# common/schema.py
+"""
+Minimal in-place schema upgrades for the SQLite/MySQL files created by
+older versions. create_all() only creates missing tables, so columns added
+to existing models later are added here with ALTER TABLE.
+"""
+import logging
+
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+
+def add_missing_columns(engine, metadata):
+    """
+    For every mapped table that already exists, add any column that the
+    model has but the database does not. New columns must be nullable or
+    carry a scalar default.
+    """
+    insp = inspect(engine)
+    existing_tables = set(insp.get_table_names())
+    quote = engine.dialect.identifier_preparer.quote
+
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            present = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in present:
+                    continue
+                col_type = col.type.compile(dialect=engine.dialect)
+                ddl = f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(col.name)} {col_type}"
+                default = getattr(col.default, "arg", None)
+                if default is not None and not callable(default):
+                    ddl += f" DEFAULT {default!r}" if isinstance(default, str) else f" DEFAULT {int(default)}"
+                logger.info("Schema upgrade: %s", ddl)
+                conn.execute(text(ddl))
+
+
+def _index_names(engine, table_name):
+    if engine.url.get_backend_name() == "sqlite":
+        # the inspector skips expression indexes such as lower(email)
+        with engine.connect() as conn:
+            return set(
+                conn.execute(
+                    text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :t"),
+                    {"t": table_name},
+                ).scalars()
+            )
+    return {ix["name"] for ix in inspect(engine).get_indexes(table_name)}
+
+
+def add_missing_indexes(engine, metadata):
+    """
+    create_all() skips indexes on tables that already exist; create any
+    declared index that is not there yet.
+    """
+    for table in metadata.sorted_tables:
+        present = _index_names(engine, table.name)
+        for index in table.indexes:
+            if index.name not in present:
+                index.create(engine)
+
+
+def upgrade_schema(engine, metadata):
+    add_missing_columns(engine, metadata)
+    add_missing_indexes(engine, metadata)
@@ -0,0 +1,149 @@
+# common/tokens.py
+"""
+Signed access tokens shared by central and the branches.
+
+Central issues the tokens at login; every service verifies them locally
+with the shared JWT secret, so an authenticated request never needs a
+database lookup just to find out who the caller is.
+"""
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+
+
+class TokenError(Exception):
+    """Raised when a token is missing, malformed, expired or revoked."""
+
+
+def issue_token(external_id, home_branch, secret, algorithm, exp_minutes):
+    """
+    Build a signed token for a patron. Returns (token, claims).
+    Claims are readable by anyone holding the token, so they carry no
+    personal data; branches fetch the profile from central when needed.
+    """
+    now = int(time.time())
+    claims = {
+        "sub": str(external_id),
+        "home_branch": home_branch,
+        "iat": now,
+        "exp": now + int(exp_minutes) * 60,
+        # short random id so a single token can be revoked
+        "jti": secrets.token_hex(8),
+    }
+    token = jwt.encode(claims, secret, algorithm=algorithm)
+    return token, claims
+
+
+def bearer_token(auth_header):
+    """
+    Extract the token from an "Authorization: Bearer <token>" header.
+    """
+    if not auth_header:
+        return None
+    scheme, _, token = auth_header.partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return None
+    return token.strip()
+
+
+class DenyList:
+    """
+    Revoked token ids (jti -> exp). Entries are dropped once the token
+    would have expired anyway, so the list only ever holds live tokens.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def add(self, jti, exp):
+        with self._lock:
+            self._entries[jti] = int(exp)
+
+    def replace(self, entries):
+        """
+        Swap in a full list of {"jti": ..., "exp": ...} dicts.
+        """
+        fresh = {e["jti"]: int(e["exp"]) for e in entries}
+        with self._lock:
+            self._entries = fresh
+
+    def prune(self, now=None):
+        now = now or time.time()
+        with self._lock:
+            self._entries = {j: e for j, e in self._entries.items() if e > now}
+
+    def entries(self):
+        with self._lock:
+            return [{"jti": j, "exp": e} for j, e in self._entries.items()]
+
+    def __contains__(self, jti):
+        return jti in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TokenVerifier:
+    """
+    Verifies tokens with the shared secret and remembers the result in a
+    small LRU cache, so repeat requests skip the signature check too.
+    """
+
+    def __init__(self, secret, algorithm, cache_size=1024):
+        self.secret = secret
+        self.algorithm = algorithm
+        self.cache_size = cache_size
+        self.deny_list = DenyList()
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def verify(self, token):
+        """
+        Return the token's claims or raise TokenError.
+        """
+        if not token:
+            raise TokenError("Missing access token")
+
+        now = time.time()
+        with self._lock:
+            claims = self._cache.get(token)
+            if claims is not None:
+                self._cache.move_to_end(token)
+
+        if claims is None:
+            try:
+                claims = jwt.decode(
+                    token,
+                    self.secret,
+                    algorithms=[self.algorithm],
+                    options={"require": ["exp", "sub", "jti"]},
+                )
+            except jwt.ExpiredSignatureError:
+                raise TokenError("Access token has expired")
+            except jwt.InvalidTokenError:
+                raise TokenError("Invalid access token")
+            if not claims.get("sub") or not claims.get("jti"):
+                raise TokenError("Invalid access token")
+
+            with self._lock:
+                self._cache[token] = claims
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        if claims["exp"] <= now:
+            self.forget(token)
+            raise TokenError("Access token has expired")
+        if claims["jti"] in self.deny_list:
+            raise TokenError("Access token has been revoked")
+        return claims
+
+    def revoke(self, claims):
+        self.deny_list.add(claims["jti"], claims["exp"])
+
+    def forget(self, token):
+        with self._lock:
+            self._cache.pop(token, None)
@@ -2,6 +2,11 @@
 // const CENTRAL_BASE = window.location.origin;
 const CENTRAL_BASE = "http://localhost:5000";
 
+// Change-feed position of the catalog currently on screen
+let changeCursor = null;
+let changeStream = null;
+let lastQuery = "";
+
 // -------------------------------------------------------------
 // Helpers: auth + API
 // -------------------------------------------------------------
@@ -22,14 +27,132 @@ function getUserId() {
 }
 
 async function fetchCatalog(query) {
-  const params = query ? `?query=${encodeURIComponent(query)}` : "";
-  const resp = await fetch(`${CENTRAL_BASE}/api/global/books${params}`);
+  // filtering happens on central, against its per-title summary
+  const params = new URLSearchParams();
+  if (query) params.set("query", query);
+  const availableOnly = document.getElementById("available-only");
+  if (availableOnly && availableOnly.checked) params.set("available", "1");
+  const qs = params.toString() ? `?${params}` : "";
+  const resp = await fetch(`${CENTRAL_BASE}/api/global/books${qs}`);
   if (!resp.ok) {
     throw new Error(`Catalog request failed with ${resp.status}`);
   }
+  changeCursor = resp.headers.get("X-Change-Cursor");
   return await resp.json();
 }
 
+// -------------------------------------------------------------
+// Typeahead (served from central's in-memory prefix index)
+// -------------------------------------------------------------
+let suggestTimer = null;
+let suggestSeq = 0;
+let suggestedTitles = new Set();
+
+async function fetchSuggestions(prefix) {
+  const resp = await fetch(
+    `${CENTRAL_BASE}/api/global/suggest?prefix=${encodeURIComponent(prefix)}&limit=8`
+  );
+  if (!resp.ok) return [];
+  const payload = await resp.json();
+  return payload.titles || [];
+}
+
+function renderSuggestions(titles) {
+  const list = document.getElementById("search-suggestions");
+  if (!list) return;
+  list.innerHTML = "";
+  suggestedTitles = new Set();
+  titles.forEach((t) => {
+    if (suggestedTitles.has(t.title)) return;
+    suggestedTitles.add(t.title);
+    const option = document.createElement("option");
+    option.value = t.title;
+    option.label = t.isbn;
+    list.appendChild(option);
+  });
+}
+
+function onSearchInput(input) {
+  const prefix = input.value.trim();
+
+  // picking an entry from the list: search for that title right away
+  if (suggestedTitles.has(prefix)) {
+    renderSuggestions([]);
+    loadAndRender(prefix);
+    return;
+  }
+
+  clearTimeout(suggestTimer);
+  if (!prefix) {
+    renderSuggestions([]);
+    return;
+  }
+  suggestTimer = setTimeout(async () => {
+    const seq = ++suggestSeq;
+    try {
+      const titles = await fetchSuggestions(prefix);
+      // drop answers to prefixes the patron has already typed past
+      if (seq === suggestSeq) renderSuggestions(titles);
+    } catch (err) {
+      console.error("Suggestions failed", err);
+    }
+  }, 120);
+}
+
+// -------------------------------------------------------------
+// Live availability (server-sent change feed)
+// -------------------------------------------------------------
+function updatePill(pill, avail, total) {
+  pill.dataset.availableCopies = String(avail);
+  pill.dataset.totalCopies = String(total);
+  pill.textContent = `${pill.dataset.branchCode}: ${avail}/${total} available`;
+
+  if (avail <= 0) {
+    pill.classList.add("branch-pill--empty");
+    pill.disabled = true;
+    pill.title = "No copies available at this branch.";
+    pill.removeEventListener("click", onBorrowClick);
+  } else {
+    pill.classList.remove("branch-pill--empty");
+    pill.disabled = false;
+    pill.title = "Click to borrow from this branch.";
+    pill.removeEventListener("click", onBorrowClick);
+    pill.addEventListener("click", onBorrowClick);
+  }
+}
+
+function applyChanges(changes) {
+  changes.forEach((c) => {
+    document
+      .querySelectorAll(`.branch-pill[data-isbn="${CSS.escape(c.isbn)}"]`)
+      .forEach((pill) => {
+        if (pill.dataset.branchCode !== c.branch_code) return;
+        if (c.removed) {
+          pill.remove();
+        } else {
+          updatePill(pill, c.available_copies ?? 0, c.total_copies ?? 0);
+        }
+      });
+  });
+}
+
+function subscribeToChanges() {
+  if (changeStream) changeStream.close();
+  if (!changeCursor || typeof EventSource === "undefined") return;
+
+  changeStream = new EventSource(
+    `${CENTRAL_BASE}/api/global/changes/stream?cursor=${encodeURIComponent(changeCursor)}`
+  );
+  changeStream.addEventListener("availability", (e) => {
+    changeCursor = e.lastEventId;
+    applyChanges(JSON.parse(e.data));
+  });
+  changeStream.addEventListener("reset", () => {
+    // we fell too far behind (or central restarted): reload once
+    loadAndRender(lastQuery);
+  });
+}
+
 // -------------------------------------------------------------
 // Rendering
 // -------------------------------------------------------------
@@ -214,9 +337,12 @@ async function loadAndRender(query) {
       "Loading titles from the central catalog…";
   }
 
+  lastQuery = query;
+
   try {
     const books = await fetchCatalog(query);
     renderBooks(books);
+    subscribeToChanges();
 
     if (statusEl) {
       const token = getAccessToken();
@@ -253,7 +379,16 @@ document.addEventListener("DOMContentLoaded", () => {
     });
   }
 
+  const availableOnly = document.getElementById("available-only");
+  if (availableOnly) {
+    availableOnly.addEventListener("change", () => {
+      loadAndRender(input ? input.value.trim() : "");
+    });
+  }
+
   if (input) {
+    input.addEventListener("input", () => onSearchInput(input));
+
     // Live filter on Enter
     input.addEventListener("keyup", (e) => {
       if (e.key === "Enter") {
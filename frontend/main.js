@@ -237,20 +237,21 @@ async function loadDashboardSnapshot() {
   const statusPill = document.querySelector(".status-pill");
 
   try {
-    const [branchesResp, booksResp] = await Promise.all([
+    // counts come precomputed from central; no need to pull the catalog
+    const [branchesResp, statsResp] = await Promise.all([
       fetch(`${CENTRAL_BASE}/api/branches`),
-      fetch(`${CENTRAL_BASE}/api/global/books`)
+      fetch(`${CENTRAL_BASE}/api/global/stats`)
     ]);
 
     const branches = await branchesResp.json();
-    const books = await booksResp.json();
+    const stats = await statsResp.json();
 
-    const branchesCount = Array.isArray(branches) ? branches.length : 0;
-    const titlesCount = Array.isArray(books) ? books.length : 0;
+    const branchesCount = stats.branches ? stats.branches.total : 0;
+    const titlesCount = stats.titles || 0;
 
     if (branchesEl) branchesEl.textContent = branchesCount;
     if (titlesEl) titlesEl.textContent = titlesCount;
-    if (reservationsEl) reservationsEl.textContent = "0"; // placeholder for now
+    if (reservationsEl) reservationsEl.textContent = stats.holds_waiting || 0;
 
     // mini-branch table
     if (miniTableBody && Array.isArray(branches)) {
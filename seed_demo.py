@@ -1,9 +1,12 @@
 # seed_demo.py
-import requests
+from common.http_client import HttpClient
 
 CENTRAL_BASE_URL = "http://localhost:5000"
 SERVICE_API_KEY = "super-secret-key"
 
+# one keep-alive connection pool per service for the whole run
+http_client = HttpClient(timeout=5)
+
 BRANCHES = [
     {
         "code": "DOWNTOWN_TORONTO",
@@ -110,7 +113,7 @@ def check_service(name, url):
     """Hit /api/health and return True/False."""
     health_url = f"{url.rstrip('/')}/api/health"
     try:
-        r = requests.get(health_url, timeout=3)
+        r = http_client.get(health_url, timeout=3)
         print(f"[CHECK] {name} -> {health_url} -> {r.status_code}")
         return r.ok
     except Exception as e:
@@ -123,14 +126,13 @@ def register_branches():
     ok = True
     for b in BRANCHES:
         try:
-            resp = requests.post(
+            resp = http_client.post(
                 f"{CENTRAL_BASE_URL}/api/branches",
                 json={
                     "code": b["code"],
                     "name": b["name"],
                     "base_url": b["base_url"],
                 },
-                timeout=5,
             )
             print(f"  {b['code']}: {resp.status_code} {resp.text.strip()}")
             if not resp.ok:
@@ -150,11 +152,10 @@ def seed_books_for_branch(branch):
         payload["total_copies"] = 2 + (i % 4)  # 2–5 copies
 
         try:
-            resp = requests.post(
+            resp = http_client.post(
                 f"{branch['base_url']}/api/books",
                 headers={"X-API-Key": SERVICE_API_KEY},
                 json=payload,
-                timeout=5,
             )
             print(f"  [{i:02}] {book['title']} -> {resp.status_code}")
             if not resp.ok: